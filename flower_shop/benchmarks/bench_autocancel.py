@@ -0,0 +1,100 @@
+"""
+Замер автоотмены неоплаченных заказов на синтетических данных.
+
+Сравнивает cancel_unpaid_orders (один UPDATE и bulk_create уведомлений) с прежним
+подходом — save() каждого заказа, когда post_save ставит уведомление по одному.
+Построчный вариант меряется на выборке (--naive-sample) и пересчитывается на весь объём.
+Данные создаются в отдельной тестовой базе (TEST NAME из настроек), рабочая база не трогается.
+
+Запуск из каталога flower_shop:
+    python benchmarks/bench_autocancel.py --orders 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "flower_shop.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from datetime import timedelta  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from bot.models import OutboundMessage  # noqa: E402
+from orders.models import Order, cancel_unpaid_orders  # noqa: E402
+from users.models import UserProfile  # noqa: E402
+
+User = get_user_model()
+
+
+def populate(orders_count, users_count):
+    """Создаёт пользователей (половина с Telegram) и просроченные неоплаченные заказы."""
+    User.objects.bulk_create([User(username=f"bench{i}") for i in range(users_count)], batch_size=1000)
+    users = list(User.objects.filter(username__startswith="bench").values_list("id", flat=True))
+    UserProfile.objects.bulk_create(
+        [UserProfile(user_id=user_id, full_name=f"Клиент {i}", telegram_id=100000 + i if i % 2 else None)
+         for i, user_id in enumerate(users)],
+        batch_size=1000,
+    )
+    Order.objects.bulk_create(
+        [Order(user_id=users[i % len(users)], total_price=1000) for i in range(orders_count)],
+        batch_size=2000,
+    )
+    Order.objects.update(created_at=timezone.now() - timedelta(hours=100))
+
+
+def reset():
+    Order.objects.update(status="awaiting_payment")
+    OutboundMessage.objects.all().delete()
+
+
+def cancel_per_object(limit):
+    """Прежний способ: save() каждого заказа, уведомление ставит post_save."""
+    cutoff = timezone.now() - timedelta(hours=72)
+    with transaction.atomic():
+        for order in Order.objects.filter(status="awaiting_payment", created_at__lt=cutoff).select_related("user")[:limit]:
+            order.status = "canceled"
+            order.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--naive-sample", type=int, default=2000)
+    args = parser.parse_args()
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        started = time.perf_counter()
+        populate(args.orders, args.users)
+        print(f"Создано заказов: {args.orders} ({time.perf_counter() - started:.1f} с)")
+
+        started = time.perf_counter()
+        report = cancel_unpaid_orders(72, dry_run=True)
+        print(f"dry-run: {report['orders']} заказов, {time.perf_counter() - started:.3f} с")
+
+        started = time.perf_counter()
+        report = cancel_unpaid_orders(72)
+        bulk = time.perf_counter() - started
+        print(f"Один UPDATE + bulk_create: {report['orders']} заказов, "
+              f"{report['notified']} уведомлений, {bulk:.2f} с")
+
+        reset()
+        sample = min(args.naive_sample, args.orders)
+        started = time.perf_counter()
+        cancel_per_object(sample)
+        naive = (time.perf_counter() - started) * args.orders / sample
+        print(f"save() по одному: ~{naive:.1f} с на {args.orders} заказов (по выборке {sample}), "
+              f"в {naive / bulk:.0f} раз медленнее")
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Одновременные обновления бота из многих чатов: /start и кнопка «Отменить заказ».
+
+Обновления подаются в диспетчер aiogram (dp.feed_update) все разом, как после
+паузы в поллинге. Сравниваются два режима:
+- «shared» — весь ORM бота идёт через один общий поток sync_to_async
+  (BOT_DB_THREADS = 0, как раньше);
+- «pooled» — обновления берут поток ORM из пула DbThreadPool (--threads).
+
+Чтобы замер отражал рабочие условия, к каждому запросу добавляется задержка
+базы (--db-latency, как у сетевой СУБД), к каждому вызову Bot API — задержка
+сети (--api-latency), а рядом работает имитация диспетчера очереди уведомлений,
+который держит свой синхронный поток, пока ждёт отправки пачки (--outbox-stall).
+Данные создаются в отдельной тестовой базе (TEST NAME из настроек).
+
+Запуск из каталога flower_shop:
+    python benchmarks/bench_bot_updates.py --chats 200 --threads 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from contextlib import nullcontext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "flower_shop.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from aiogram import types  # noqa: E402
+from asgiref.sync import sync_to_async  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+import bot.main as bot_main  # noqa: E402
+from bot.callbacks import CancelOrder  # noqa: E402
+from bot.dbthreads import DbThreadPool, own_db_thread  # noqa: E402
+from orders.models import Order, OrderItem  # noqa: E402
+from users.models import UserProfile  # noqa: E402
+
+User = get_user_model()
+FIRST_CHAT = 1000000
+
+
+def populate(chats):
+    """По клиенту с Telegram и неоплаченным заказом из трёх позиций на каждый чат."""
+    User.objects.bulk_create([User(username=f"chat{i}") for i in range(chats)])
+    users = dict(User.objects.filter(username__startswith="chat").values_list("username", "id"))
+    UserProfile.objects.bulk_create([
+        UserProfile(user_id=users[f"chat{i}"], full_name=f"Клиент {i}", telegram_id=FIRST_CHAT + i)
+        for i in range(chats)
+    ])
+    orders = Order.objects.bulk_create([Order(user_id=users[f"chat{i}"], total_price=1500) for i in range(chats)])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, flower_name=name, quantity=1, price=500, subtotal=500)
+        for order in orders for name in ("Роза", "Тюльпан", "Пион")
+    ])
+    return [order.id for order in orders]
+
+
+def make_updates(order_ids):
+    updates = []
+    for index, order_id in enumerate(order_ids):
+        chat = {"id": FIRST_CHAT + index, "type": "private"}
+        user = {"id": FIRST_CHAT + index, "is_bot": False, "first_name": "Клиент"}
+        if index % 2:
+            payload = {"message": {"message_id": 1, "date": 0, "chat": chat, "from": user, "text": "/start"}}
+        else:
+            payload = {"callback_query": {
+                "id": str(index), "from": user, "chat_instance": "bench", "data": CancelOrder(order_id=order_id).pack(),
+                "message": {"message_id": 1, "date": 0, "chat": chat, "text": "Заказ"},
+            }}
+        updates.append(types.Update.model_validate({"update_id": index, **payload}, context={"bot": bot_main.bot}))
+    return updates
+
+
+def add_db_latency(latency):
+    def slow_execute(execute, sql, params, many, context):
+        time.sleep(latency)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(slow_execute)
+
+    connection_created.connect(install, weak=False)
+
+
+def fake_bot_api(latency):
+    async def call(*args, **kwargs):
+        await asyncio.sleep(latency)
+    for name in ("send_message", "edit_message_text", "answer_callback_query"):
+        setattr(bot_main.bot, name, call)
+
+
+async def outbox_worker(stall, own_thread, stop):
+    """Как bot.main.dispatch_outbox: синхронная пачка занимает поток, пока ждёт Telegram."""
+    async with (own_db_thread() if own_thread else nullcontext()):
+        while not stop.is_set():
+            await sync_to_async(time.sleep)(stall)
+
+
+async def replay(updates, threads, stall):
+    bot_main.db_threads = DbThreadPool(threads)
+    latencies = []
+
+    async def feed(update):
+        started = time.perf_counter()
+        await bot_main.dp.feed_update(bot_main.bot, update)
+        latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    worker = asyncio.ensure_future(outbox_worker(stall, bool(threads), stop)) if stall else None
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in updates))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    if worker:
+        await worker
+    await bot_main.db_threads.close()
+    await sync_to_async(connections.close_all)()
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--db-latency", type=float, default=0.002, help="сек на запрос к базе")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="сек на вызов Bot API")
+    parser.add_argument("--outbox-stall", type=float, default=0.5,
+                        help="сек, на которые диспетчер очереди занимает свой поток; 0 — без диспетчера")
+    parser.add_argument("--threads", type=int, default=8, help="размер пула потоков ORM в режиме pooled")
+    args = parser.parse_args()
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        updates = make_updates(populate(args.chats))
+        connections.close_all()
+        add_db_latency(args.db_latency)
+        fake_bot_api(args.api_latency)
+        for mode, threads in (("shared", 0), ("pooled", args.threads)):
+            elapsed, latencies = asyncio.run(replay(updates, threads, args.outbox_stall))
+            latencies.sort()
+            print(f"{mode:>8}: {len(updates)} обновлений за {elapsed:.2f} с ({len(updates) / elapsed:.0f}/с), "
+                  f"медиана {statistics.median(latencies) * 1000:.0f} мс, "
+                  f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} мс")
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
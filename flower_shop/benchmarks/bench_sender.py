@@ -0,0 +1,132 @@
+"""
+Сравнение скорости отправки сообщений из синхронного кода.
+
+«До» — asyncio.run с новым Bot и новой aiohttp-сессией на каждое сообщение
+(прежний bot.utils.send_message), «после» — общий TelegramSender.
+Telegram заменён локальным фейковым Bot API на aiohttp, поэтому TLS в замер
+не входит: на настоящем api.telegram.org разница только больше.
+
+Сообщения рассылаются по разным чатам, а общий лимит TelegramRateLimiter
+по умолчанию поднят (--global-rate), чтобы измерялся транспорт, а не лимиты.
+
+Запуск из каталога flower_shop:
+    python benchmarks/bench_sender.py --messages 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "flower_shop.settings")
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiohttp import web  # noqa: E402
+from bot.sender import TelegramSender  # noqa: E402
+
+TOKEN = "123456789:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+CHAT_ID = 123456789
+
+
+async def fake_send_message(request):
+    data = await request.post()
+    return web.json_response({
+        "ok": True,
+        "result": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": int(data["chat_id"]), "type": "private"},
+            "text": data["text"],
+        },
+    })
+
+
+def start_fake_api(port):
+    """Запускает фейковый Bot API в отдельном потоке и возвращает его адрес."""
+    app = web.Application()
+    app.router.add_post("/bot{token}/sendMessage", fake_send_message)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    async def serve():
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        ready.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{port}"
+
+
+def send_per_call(api_server, count):
+    """Прежний способ: новый цикл, Bot и сессия на каждое сообщение."""
+    async def send(chat_id, text):
+        bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api_server)))
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+        finally:
+            await bot.session.close()
+
+    for i in range(count):
+        asyncio.run(send(CHAT_ID + i, f"Сообщение {i}"))
+
+
+def send_shared_sequential(api_server, count):
+    """Общий отправитель, вызывающий код ждёт каждое сообщение (как bot.utils.send_message)."""
+    sender = TelegramSender(token=TOKEN, api_server=api_server)
+    try:
+        for i in range(count):
+            sender.send_message(CHAT_ID + i, f"Сообщение {i}").result()
+    finally:
+        sender.close()
+
+
+def send_shared_batch(api_server, count):
+    """Общий отправитель, пачка Future ожидается разом (как dispatch_outbox)."""
+    sender = TelegramSender(token=TOKEN, api_server=api_server)
+    try:
+        futures = [sender.send_message(CHAT_ID + i, f"Сообщение {i}") for i in range(count)]
+        for future in futures:
+            future.result()
+    finally:
+        sender.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--global-rate", type=float, default=100000,
+                        help="Общий лимит отправителя, сообщений в секунду (в бою — 30)")
+    args = parser.parse_args()
+    settings.TELEGRAM_GLOBAL_RATE = args.global_rate
+
+    api_server = start_fake_api(args.port)
+    for name, runner in [
+        ("asyncio.run на сообщение (до)", send_per_call),
+        ("общий отправитель, по одному", send_shared_sequential),
+        ("общий отправитель, пачкой", send_shared_batch),
+    ]:
+        started = time.perf_counter()
+        runner(api_server, args.messages)
+        elapsed = time.perf_counter() - started
+        print(f"{name:32} {args.messages / elapsed:8.0f} сообщ./с  ({elapsed:.2f} с)")
+
+
+if __name__ == "__main__":
+    main()
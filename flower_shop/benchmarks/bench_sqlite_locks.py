@@ -0,0 +1,96 @@
+"""
+Нагрузочный тест одновременной записи в SQLite из нескольких процессов.
+
+Несколько процессов (как веб-воркеры и бот) одновременно оформляют заказы:
+транзакция читает заказы клиента и создаёт новый. Сравниваются два режима:
+«как было» — журнал DELETE, отложенные транзакции, без повторов, и рабочий
+режим из core.db — WAL, synchronous=NORMAL, BEGIN IMMEDIATE, busy_timeout
+и повтор транзакции при «database is locked». Для каждого режима создаётся
+своя тестовая база (TEST NAME из настроек), рабочая база не трогается.
+
+Запуск из каталога flower_shop:
+    python benchmarks/bench_sqlite_locks.py --workers 8 --orders 200
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "flower_shop.settings")
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import OperationalError, connection, connections, transaction  # noqa: E402
+from core.db import retry_on_lock  # noqa: E402
+from orders.models import Order  # noqa: E402
+from users.models import UserProfile  # noqa: E402
+
+User = get_user_model()
+
+
+def place_order(profile_id):
+    with transaction.atomic():
+        Order.objects.filter(user_id=profile_id).count()
+        Order.objects.create(user_id=profile_id, total_price=1000)
+
+
+def worker(profile_id, orders, retry, results):
+    write = retry_on_lock(place_order) if retry else place_order
+    errors = 0
+    for _ in range(orders):
+        try:
+            write(profile_id)
+        except OperationalError:
+            errors += 1
+    results.put(errors)
+
+
+def run(mode, workers, orders):
+    tuned = mode == "tuned"
+    settings.SQLITE_JOURNAL_MODE = "WAL" if tuned else None
+    settings.SQLITE_SYNCHRONOUS = "NORMAL" if tuned else None
+    connection.settings_dict["OPTIONS"]["transaction_mode"] = "IMMEDIATE" if tuned else "DEFERRED"
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        user = User.objects.create_user(username="bench")
+        profile_id = UserProfile.objects.get(user=user).pk
+        connections.close_all()  # процессы открывают свои соединения
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        processes = [context.Process(target=worker, args=(profile_id, orders, tuned, results))
+                     for _ in range(workers)]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        errors = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        created = Order.objects.count()
+        print(f"{mode:>6}: создано {created} из {workers * orders} заказов, "
+              f"ошибок «database is locked»: {errors}, {elapsed:.1f} с")
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--orders", type=int, default=200, help="заказов на процесс")
+    args = parser.parse_args()
+    for mode in ("plain", "tuned"):
+        run(mode, args.workers, args.orders)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,11 @@
 from django.contrib import admin
+from .models import OutboundMessage
 
 # Register your models here.
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "chat_id", "status", "attempts", "next_attempt_at", "created_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("chat_id",)
+    raw_id_fields = ("order", "user")
+    readonly_fields = ("created_at", "sent_at", "last_error")
@@ -3,6 +3,7 @@ import threading
 import asyncio
 import os
 from django.apps import AppConfig
+from django.conf import settings
 
 class BotConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
@@ -12,10 +13,12 @@ class BotConfig(AppConfig):
 
     def ready(self):
         """Запускаем бота только один раз в главном процессе Django."""
+        from . import profiles  # noqa: F401 — подключает сигналы сброса кэша профилей
         if "RUN_MAIN" not in os.environ:  # ✅ Django вызывает `ready()` дважды, `RUN_MAIN` фильтрует перезапуски
             return
 
-        if "runserver" in sys.argv:
+        # В продакшене бот работает отдельным процессом (команда runbot), а не внутри веб-сервера
+        if "runserver" in sys.argv and getattr(settings, "BOT_RUN_WITH_RUNSERVER", True):
             if not BotConfig._bot_thread or not BotConfig._bot_thread.is_alive():
                 BotConfig._bot_thread = threading.Thread(target=self.run_bot, daemon=True)
                 BotConfig._bot_thread.start()
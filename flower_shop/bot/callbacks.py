@@ -0,0 +1,82 @@
+import logging
+from aiogram.filters.callback_data import CallbackData
+
+logger = logging.getLogger(__name__)
+
+# Данные кнопок: короткий префикс и поля через «:», например «oc:1234». Telegram
+# ограничивает callback_data 64 байтами — pack() проверяет это сам.
+
+
+class CancelOrder(CallbackData, prefix="oc"):
+    """Кнопка «Отменить заказ»: показать подтверждение."""
+    order_id: int
+
+
+class ConfirmCancel(CallbackData, prefix="oy"):
+    """«Да, отменить»."""
+    order_id: int
+
+
+class KeepOrder(CallbackData, prefix="on"):
+    """«Нет» — вернуть сообщение о заказе."""
+    order_id: int
+
+
+# Кнопки в сообщениях, отправленных до коротких префиксов: «cancel_order_1234»
+LEGACY_PREFIXES = {
+    "cancel_order": CancelOrder,
+    "confirm_cancel": ConfirmCancel,
+    "cancel_no": KeepOrder,
+}
+
+
+class CallbackRouter:
+    """
+    Таблица «префикс → обработчик» для нажатий на кнопки.
+
+    Регистрируется в диспетчере одним обработчиком: вместо проверки каждого
+    фильтра по очереди префикс ищется в словаре, данные разбираются один раз
+    фабрикой CallbackData и передаются обработчику вторым аргументом.
+    Повреждённые и устаревшие данные не роняют обработчик — на нажатие
+    отвечают подсказкой.
+    """
+
+    def __init__(self):
+        self._routes = {}
+
+    def route(self, factory):
+        """Декоратор: обработчик (callback, callback_data) для кнопок factory."""
+        def decorator(handler):
+            if factory.__prefix__ in self._routes:
+                raise ValueError(f"Префикс {factory.__prefix__!r} уже занят")
+            self._routes[factory.__prefix__] = (factory, handler)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        """(обработчик, разобранные данные) или None, если кнопка не распознана."""
+        prefix, sep, _ = (data or "").partition(":")
+        if sep and prefix in self._routes:
+            factory, handler = self._routes[prefix]
+            try:
+                return handler, factory.unpack(data)
+            except (TypeError, ValueError):  # ошибка проверки pydantic — тоже ValueError
+                return None
+        legacy, _, value = (data or "").rpartition("_")
+        factory = LEGACY_PREFIXES.get(legacy)
+        if factory is not None and factory.__prefix__ in self._routes:
+            try:
+                return self._routes[factory.__prefix__][1], factory(order_id=value)
+            except ValueError:
+                return None
+        return None
+
+    async def dispatch(self, callback, bot):
+        """Вызывает обработчик нажатия или отвечает, что кнопка устарела."""
+        resolved = self.resolve(callback.data)
+        if resolved is None:
+            logger.warning("Неизвестные данные кнопки: %r", callback.data)
+            await bot.answer_callback_query(callback.id, "Кнопка устарела.")
+            return
+        handler, callback_data = resolved
+        return await handler(callback, callback_data)
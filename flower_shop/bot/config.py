@@ -0,0 +1,2 @@
+TOKEN = "123456789:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw"
+ADMIN_IDS = [111111111]
@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+import itertools
+from collections.abc import MutableMapping
+from contextlib import asynccontextmanager, contextmanager
+import asgiref
+from asgiref.sync import SyncToAsync, ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+# Асинхронный ORM Django (aget, asave, async for) выполняет запросы через
+# sync_to_async(thread_sensitive=True), то есть по умолчанию в одном общем потоке
+# на весь процесс: пока там идёт чужая работа с базой, ждут все чаты. Поток
+# выбирается по ThreadSensitiveContext из контекста вызова — этим и пользуются
+# функции ниже.
+#
+# Многоразовые полосы DbThreadPool держатся на внутренностях asgiref, которых нет
+# в публичном API: SyncToAsync.thread_sensitive_context (текущий контекст) и
+# SyncToAsync.context_to_thread_executor (поток каждого контекста). Поэтому версия
+# asgiref закреплена в requirements.txt, а пул проверяет эти атрибуты при создании.
+ASGIREF_VERSION = "3.8.1"
+
+
+def check_asgiref():
+    """Падает при создании пула, если в установленном asgiref нет нужных внутренностей."""
+    context = getattr(SyncToAsync, "thread_sensitive_context", None)
+    executors = getattr(SyncToAsync, "context_to_thread_executor", None)
+    if not isinstance(context, contextvars.ContextVar) or not isinstance(executors, MutableMapping):
+        raise ImproperlyConfigured(
+            f"DbThreadPool не поддерживает asgiref {asgiref.__version__} (проверен с {ASGIREF_VERSION}): "
+            f"закрепите asgiref=={ASGIREF_VERSION} или задайте BOT_DB_THREADS = 0"
+        )
+
+
+@asynccontextmanager
+async def own_db_thread():
+    """Отдельный поток и своё соединение для ORM внутри блока (для долгоживущих циклов бота)."""
+    async with ThreadSensitiveContext():
+        try:
+            yield
+        finally:
+            await sync_to_async(connections.close_all)()
+
+
+class DbThreadPool:
+    """
+    Пул потоков ORM для обработчиков обновлений.
+
+    Каждая «полоса» — ThreadSensitiveContext со своим потоком и постоянным
+    соединением с базой. Обновления распределяются по полосам по чату (или по
+    кругу), не занимая полосу целиком: пока одно обновление ждёт Bot API, в той
+    же полосе идут запросы других. Запросы разных полос выполняются параллельно,
+    а потоки и соединения не создаются заново на каждое сообщение. size=0 — общий поток.
+    """
+
+    def __init__(self, size=None):
+        self.size = getattr(settings, "BOT_DB_THREADS", 8) if size is None else size
+        if self.size:
+            check_asgiref()
+        self._lanes = [ThreadSensitiveContext() for _ in range(self.size)]
+        self._next = itertools.count()
+
+    @contextmanager
+    def lane(self, key=None):
+        """Направляет ORM внутри блока в полосу key % size (key — например, id чата)."""
+        if not self._lanes:
+            yield
+            return
+        index = next(self._next) if key is None else key
+        token = SyncToAsync.thread_sensitive_context.set(self._lanes[index % len(self._lanes)])
+        try:
+            yield
+        finally:
+            SyncToAsync.thread_sensitive_context.reset(token)
+
+    async def close(self):
+        """Закрывает соединения полос и останавливает их потоки."""
+        for lane in self._lanes:
+            executor = SyncToAsync.context_to_thread_executor.pop(lane, None)
+            if executor is None:  # в полосе не было ни одного запроса
+                continue
+            await asyncio.get_running_loop().run_in_executor(executor, connections.close_all)
+            executor.shutdown()
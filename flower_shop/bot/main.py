@@ -3,18 +3,36 @@ from asgiref.sync import sync_to_async
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from django.core.exceptions import ObjectDoesNotExist
 from orders.models import Order
 from aiogram.client.default import DefaultBotProperties
+from aiohttp import web
 from bot.config import TOKEN, ADMIN_IDS
 from aiogram.types import CallbackQuery
-from cart.views import is_working_hours
 from users.models import UserProfile
+from bot.callbacks import CallbackRouter, CancelOrder, ConfirmCancel, KeepOrder
+from bot.dbthreads import DbThreadPool, own_db_thread
+from bot.outbox import dispatch_batch
+from bot.profiles import profile_cache
+from bot.ratelimit import PRIORITY_LOW, TelegramRateLimiter, send_priority
+from bot.reminders import ReminderScheduler
+from bot.webhook import TelegramWebhook, webhook_setting
+from core.routers import pinned_to_primary, read_from_replica
 
 # Инициализация бота и диспетчера
 bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
+bot.session.middleware(TelegramRateLimiter())  # Лимиты Telegram на отправку сообщений
 dp = Dispatcher()
 
+# Потоки ORM для обработчиков: обновления из разных чатов работают с базой параллельно
+db_threads = DbThreadPool()
+
+@dp.update.outer_middleware()
+async def isolate_update(handler, event, data):
+    """Каждое обновление — своя область read-your-writes и поток ORM из пула (по чату)."""
+    chat = data.get("event_chat")
+    with pinned_to_primary(), db_threads.lane(chat.id if chat else None):
+        return await handler(event, data)
+
 # Клавиатура для запроса номера телефона
 phone_keyboard = ReplyKeyboardMarkup(
     keyboard=[[KeyboardButton(text="📞 Отправить номер", request_contact=True)]],
@@ -26,7 +44,7 @@ phone_keyboard = ReplyKeyboardMarkup(
 async def start_command(message: types.Message):
     """Показывает Telegram ID пользователя"""
     telegram_id = message.from_user.id
-    profile = await sync_to_async(UserProfile.get_by_telegram_id)(telegram_id)
+    profile = await profile_cache.aget(telegram_id)
 
     if profile:
         response_text = (
@@ -55,10 +73,10 @@ async def process_contact(message: types.Message):
         phone_number = "+" + phone_number
 
     try:
-        profile = await sync_to_async(UserProfile.objects.get)(phone=phone_number)
+        profile = await UserProfile.objects.aget(phone=phone_number)
         if profile:
             profile.telegram_id = message.from_user.id
-            await sync_to_async(profile.save)()
+            await profile.asave()
             await bot.send_message(message.chat.id, "✅ Ваш Telegram успешно привязан к аккаунту!")
         else:
             await bot.send_message(message.chat.id, f"❌ Ошибка: пользователь с номером телефона {phone_number} не найден. Проверьте корректность номера.")
@@ -68,64 +86,86 @@ async def process_contact(message: types.Message):
 @dp.message(Command("unlink"))
 async def unlink_telegram(message: types.Message):
     """Отвязка Telegram ID от пользователя"""
-    try:
-        user = await sync_to_async(UserProfile.objects.get)(telegram_id=message.from_user.id)
-        user.telegram_id = None
-        await sync_to_async(user.save)()
+    telegram_id = message.from_user.id
+    cached = await profile_cache.aget(telegram_id)
+    # Профиль из кэша общий для всех обработчиков — меняем свою копию из базы
+    profile = await UserProfile.objects.filter(pk=cached.pk, telegram_id=telegram_id).afirst() if cached else None
+    if profile:
+        profile.telegram_id = None
+        await profile.asave()  # post_save сбросит запись в кэше
         await bot.send_message(message.chat.id, "✅ Ваш Telegram успешно отвязан от аккаунта.")
-    except ObjectDoesNotExist:
+    else:
+        if cached:
+            profile_cache.invalidate(telegram_id)  # отвязан в другом процессе, кэш устарел
         await bot.send_message(message.chat.id, "❌ Ошибка: ваш Telegram ID не привязан к аккаунту.")
 
-async def check_payment_reminders():
-    """Проверка заказов и отправка напоминаний об оплате"""
-    if not await sync_to_async(is_working_hours)():
+async def remind_about_order(order):
+    """Напоминание об оплате одного просроченного заказа."""
+    if not hasattr(order, 'user') or not order.user:
+        for admin_id in ADMIN_IDS:
+            await bot.send_message(
+                admin_id,
+                f"⚠️ Заказ #{order.id} пропущен: отсутствует пользователь"
+            )
+            print(f"Заказ #{order.id} пропущен: отсутствует пользователь, уведомлен админ")
         return
-    overdue_orders = await sync_to_async(list)(Order.objects.filter(status="awaiting_payment").select_related('user'))
-    for order in overdue_orders:
-        is_overdue = await sync_to_async(order.is_payment_overdue)()
-        if not hasattr(order, 'user') or not order.user:
-            for admin_id in ADMIN_IDS:
-                await bot.send_message(
-                    admin_id,
-                    f"⚠️ Заказ #{order.id} пропущен: отсутствует пользователь"
-                )
-                print(f"Заказ #{order.id} пропущен: отсутствует пользователь, уведомлен админ")
-            continue
-        
-        if is_overdue:
-            if order.user.telegram_id:
-                await bot.send_message(
-                    order.user.telegram_id,
-                    f"⚠️ Ваш заказ #{order.id} ожидает оплаты! Пожалуйста, оплатите его."
-                )
-                print(f"Уведомление отправлено пользователю для заказа #{order.id}")
-            else:
-                for admin_id in ADMIN_IDS:
-                    await bot.send_message(
-                        admin_id,
-                        f"⚠️ Заказ #{order.id} просрочен, но у пользователя {order.user.full_name} (телефон: {order.user.phone}) нет telegram_id."
-                    )
-                print(f"Заказ #{order.id} пропущен: отсутствует telegram_id, уведомлен админ")
+
+    if order.user.telegram_id:
+        await bot.send_message(
+            order.user.telegram_id,
+            f"⚠️ Ваш заказ #{order.id} ожидает оплаты! Пожалуйста, оплатите его."
+        )
+        print(f"Уведомление отправлено пользователю для заказа #{order.id}")
+    else:
+        for admin_id in ADMIN_IDS:
+            await bot.send_message(
+                admin_id,
+                f"⚠️ Заказ #{order.id} просрочен, но у пользователя {order.user.full_name} (телефон: {order.user.phone}) нет telegram_id."
+            )
+        print(f"Заказ #{order.id} пропущен: отсутствует telegram_id, уведомлен админ")
+
+# Напоминания об оплате отправляются по сроку каждого заказа
+reminder_scheduler = ReminderScheduler(remind_about_order)
 
 async def send_payment_reminders():
-    """Периодически проверяет заказы и отправляет напоминания об оплате"""
-    while True:
-        await check_payment_reminders()
-        await asyncio.sleep(10800)  # Проверяем раз в три часа
+    """Запускает планировщик напоминаний об оплате"""
+    # Напоминания пропускают вперёд ответы пользователям и уведомления о заказах
+    with send_priority(PRIORITY_LOW):
+        async with own_db_thread():
+            await reminder_scheduler.run()
+
+async def load_order_summary(order_id):
+    """
+    Заказ вместе с позициями и цветами и его текстовая сводка.
 
-@dp.callback_query(lambda callback: callback.data.startswith("cancel_order_"))
-async def cancel_order(callback: CallbackQuery):
+    Два запроса (заказ с пользователем и позиции) в одном aget; сводка строится
+    из уже загруженных позиций, название цветка берётся из снимка в позиции.
+    """
+    order = await Order.objects.select_related("user").prefetch_related("items").aget(id=order_id)
+    return order, order.get_order_summary()
+
+# Нажатия на кнопки: один обработчик в диспетчере, дальше — по префиксу данных кнопки
+callbacks = CallbackRouter()
+
+@dp.callback_query()
+async def route_callback(callback: CallbackQuery):
+    await callbacks.dispatch(callback, bot)
+
+@callbacks.route(CancelOrder)
+async def cancel_order(callback: CallbackQuery, callback_data: CancelOrder):
     """Обработка нажатия на кнопку 'Отменить заказ' с подтверждением."""
-    order_id = int(callback.data.split("_")[-1])
-    order = await sync_to_async(Order.objects.get)(id=order_id)
+    order_id = callback_data.order_id
+    # Только показ: статус перепроверяется по основной базе при подтверждении
+    with read_from_replica():
+        order, order_summary = await load_order_summary(order_id)
 
     if order.status not in ["shipped", "delivered", "canceled"]:
         confirm_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Да, отменить", callback_data=f"confirm_cancel_{order_id}")],
-            [InlineKeyboardButton(text="Нет", callback_data=f"cancel_no_{order_id}")]
+            [InlineKeyboardButton(text="Да, отменить", callback_data=ConfirmCancel(order_id=order_id).pack())],
+            [InlineKeyboardButton(text="Нет", callback_data=KeepOrder(order_id=order_id).pack())]
         ])
         await bot.edit_message_text(
-            f"Вы уверены, что хотите отменить заказ #{order_id}?\n\n{await sync_to_async(order.get_order_summary)()}",
+            f"Вы уверены, что хотите отменить заказ #{order_id}?\n\n{order_summary}",
             chat_id=callback.message.chat.id,
             message_id=callback.message.message_id,
             reply_markup=confirm_keyboard
@@ -133,24 +173,24 @@ async def cancel_order(callback: CallbackQuery):
         await bot.answer_callback_query(callback.id)
     else:
         await bot.edit_message_text(
-            f"❌ Заказ #{order_id}:\n\n{await sync_to_async(order.get_order_summary)()}",
+            f"❌ Заказ #{order_id}:\n\n{order_summary}",
             chat_id=callback.message.chat.id,
             message_id=callback.message.message_id,
             reply_markup=None
         )
         await bot.answer_callback_query(callback.id, "❌ Невозможно отменить заказ: он уже отправлен, доставлен или отменён.")
 
-@dp.callback_query(lambda callback: callback.data.startswith("confirm_cancel_"))
-async def confirm_cancel_order(callback: CallbackQuery):
+@callbacks.route(ConfirmCancel)
+async def confirm_cancel_order(callback: CallbackQuery, callback_data: ConfirmCancel):
     """Подтверждение отмены заказа."""
-    order_id = int(callback.data.split("_")[-1])
-    order = await sync_to_async(Order.objects.get)(id=order_id)
+    order_id = callback_data.order_id
+    order, order_summary = await load_order_summary(order_id)
 
     if order.status not in ["shipped", "delivered", "canceled"]:
         order.status = "canceled"
-        await sync_to_async(order.save)()
+        await order.asave()  # post_save ставит уведомление и снимает напоминания
         await bot.edit_message_text(
-            f"❌ Заказ #{order_id} отменен.\n\n{await sync_to_async(order.get_order_summary)()}",
+            f"❌ Заказ #{order_id} отменен.\n\n{order_summary}",
             chat_id=callback.message.chat.id,
             message_id=callback.message.message_id,
             reply_markup=None
@@ -159,15 +199,15 @@ async def confirm_cancel_order(callback: CallbackQuery):
     else:
         await bot.answer_callback_query(callback.id, "❌ Невозможно отменить заказ: он уже отправлен или доставлен.")
 
-@dp.callback_query(lambda callback: callback.data.startswith("cancel_no_"))
-async def cancel_no(callback: CallbackQuery):
+@callbacks.route(KeepOrder)
+async def cancel_no(callback: CallbackQuery, callback_data: KeepOrder):
     """Отказ от отмены заказа."""
-    order_id = int(callback.data.split("_")[-1])
-    order = await sync_to_async(Order.objects.get)(id=order_id)
-    order_summary = await sync_to_async(order.get_order_summary)()
-    
+    order_id = callback_data.order_id
+    with read_from_replica():
+        order, order_summary = await load_order_summary(order_id)
+
     cancel_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Отменить заказ", callback_data=f"cancel_order_{order_id}")]
+        [InlineKeyboardButton(text="Отменить заказ", callback_data=CancelOrder(order_id=order_id).pack())]
     ])
     reply_markup = cancel_keyboard if order.status in ["awaiting_payment", "pending", "processing"] else None
     await bot.edit_message_text(
@@ -178,10 +218,59 @@ async def cancel_no(callback: CallbackQuery):
     )
     await bot.answer_callback_query(callback.id, "Отмена заказа отклонена.")
 
-async def main():
-    """Запуск бота"""
-    asyncio.create_task(send_payment_reminders())
-    await dp.start_polling(bot)
+async def dispatch_outbox():
+    """Периодически отправляет сообщения из очереди уведомлений (для запуска вместе с runserver)"""
+    # dispatch_batch синхронный и ждёт отправки пачки — в своём потоке он не задерживает обработчики
+    async with own_db_thread():
+        while True:
+            processed = await sync_to_async(dispatch_batch)()
+            if not processed:
+                await asyncio.sleep(2)
+
+def start_background_tasks(outbox=True):
+    """Напоминания об оплате и (если outbox) разбор очереди уведомлений."""
+    tasks = [asyncio.create_task(send_payment_reminders())]
+    if outbox:
+        tasks.append(asyncio.create_task(dispatch_outbox()))
+    return tasks
+
+async def shutdown(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await db_threads.close()
+    await bot.session.close()
+
+async def main(outbox=True):
+    """Запуск бота (long polling)"""
+    tasks = start_background_tasks(outbox)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await shutdown(tasks)
+
+async def run_webhook(host, port, secret_token, url=None, path=None, concurrency=None, outbox=True):
+    """
+    Запуск бота как HTTP-сервиса: Telegram присылает обновления на host:port + path.
+
+    Если передан url (внешний адрес сервиса), вебхук регистрируется в Telegram
+    с тем же секретом и max_connections, равным числу одновременно обрабатываемых обновлений.
+    """
+    webhook = TelegramWebhook(dp, bot, secret_token, concurrency)
+    path = path or webhook_setting("BOT_WEBHOOK_PATH")
+    runner = web.AppRunner(webhook.create_app(path))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if url:
+        await bot.set_webhook(url.rstrip("/") + path, secret_token=secret_token,
+                              max_connections=webhook.concurrency,
+                              allowed_updates=dp.resolve_used_update_types())
+    tasks = start_background_tasks(outbox)
+    try:
+        await asyncio.Event().wait()  # до остановки процесса
+    finally:
+        await runner.cleanup()
+        await shutdown(tasks)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,41 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from bot.outbox import dispatch_batch, outbox_stats
+
+logger = logging.getLogger("bot.outbox")
+
+
+class Command(BaseCommand):
+    help = "Отправляет сообщения из очереди уведомлений в Telegram"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Сколько сообщений забирать за раз")
+        parser.add_argument("--interval", type=float, default=2.0, help="Пауза (сек), когда очередь пуста")
+        parser.add_argument("--once", action="store_true", help="Обработать очередь один раз и выйти")
+        parser.add_argument("--stats-interval", type=float, default=60.0,
+                            help="Как часто (сек) писать в лог состояние очереди; 0 — не писать")
+
+    def handle(self, *args, **options):
+        total = 0
+        stats_interval = options["stats_interval"]
+        next_stats = time.monotonic() + stats_interval
+        while True:
+            processed = dispatch_batch(options["batch_size"])
+            total += processed
+            if stats_interval and time.monotonic() >= next_stats:
+                self.report(outbox_stats(), options["verbosity"])
+                next_stats = time.monotonic() + stats_interval
+            if processed:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(f"Обработано сообщений: {total}")
+        if options["verbosity"] > 1:
+            self.report(outbox_stats(), options["verbosity"])
+
+    def report(self, stats, verbosity):
+        logger.info("Очередь уведомлений: %s", stats)
+        if verbosity > 1:
+            self.stdout.write(f"Очередь уведомлений: {stats}")
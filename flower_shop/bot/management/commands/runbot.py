@@ -0,0 +1,44 @@
+import asyncio
+from django.core.management.base import BaseCommand, CommandError
+from bot import main as bot_main
+from bot.webhook import webhook_setting
+
+
+class Command(BaseCommand):
+    help = "Запускает Telegram-бота отдельным процессом: long polling или приём обновлений через вебхук"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+        parser.add_argument("--host", default="127.0.0.1", help="Адрес HTTP-сервера вебхука")
+        parser.add_argument("--port", type=int, default=8081, help="Порт HTTP-сервера вебхука")
+        parser.add_argument("--url", default=None,
+                            help="Внешний адрес для setWebhook (по умолчанию BOT_WEBHOOK_URL); без него вебхук не регистрируется")
+        parser.add_argument("--concurrency", type=int, default=None,
+                            help="Сколько обновлений обрабатывать одновременно (по умолчанию BOT_WEBHOOK_CONCURRENCY)")
+        parser.add_argument("--no-outbox", action="store_true",
+                            help="Не разбирать очередь уведомлений (её разбирает отдельный dispatch_outbox)")
+
+    def handle(self, *args, **options):
+        outbox = not options["no_outbox"]
+        if options["mode"] == "polling":
+            self.stdout.write("Бот запущен (long polling)")
+            run = self.polling(outbox)
+        else:
+            secret = webhook_setting("BOT_WEBHOOK_SECRET")
+            if not secret:
+                raise CommandError("Для режима webhook задайте BOT_WEBHOOK_SECRET")
+            self.stdout.write(f"Бот принимает обновления на http://{options['host']}:{options['port']}"
+                              f"{webhook_setting('BOT_WEBHOOK_PATH')}")
+            run = bot_main.run_webhook(
+                options["host"], options["port"], secret,
+                url=options["url"] or webhook_setting("BOT_WEBHOOK_URL"),
+                concurrency=options["concurrency"], outbox=outbox,
+            )
+        try:
+            asyncio.run(run)
+        except KeyboardInterrupt:
+            self.stdout.write("Бот остановлен")
+
+    async def polling(self, outbox):
+        await bot_main.bot.delete_webhook()  # getUpdates не работает, пока установлен вебхук
+        await bot_main.main(outbox=outbox)
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0001_initial'),
+        ('orders', '0006_order_idempotency_key'),
+        ('users', '0003_notificationlog'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outboundmessage',
+            name='outbox_due_idx',
+        ),
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Высокий'), (1, 'Обычный'), (2, 'Низкий')], default=1, verbose_name='Приоритет'),
+        ),
+        migrations.AddIndex(
+            model_name='outboundmessage',
+            index=models.Index(fields=['status', 'priority', 'next_attempt_at'], name='outbox_due_idx'),
+        ),
+    ]
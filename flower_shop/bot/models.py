@@ -1,3 +1,45 @@
 from django.db import models
+from django.utils import timezone
+from .ratelimit import PRIORITY_CHOICES, PRIORITY_NORMAL
 
-# Create your models here.
+
+class OutboundMessage(models.Model):
+    """
+    Исходящее сообщение Telegram (transactional outbox).
+
+    Сигналы пишут строку в той же транзакции, что и изменение данных, а отправкой
+    занимается диспетчер (manage.py dispatch_outbox), поэтому веб-запрос не ждёт Telegram.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Ожидает отправки"),
+        (STATUS_SENT, "Отправлено"),
+        (STATUS_FAILED, "Ошибка"),
+    ]
+
+    chat_id = models.BigIntegerField(verbose_name="Telegram ID получателя")
+    text = models.TextField(blank=True, verbose_name="Текст")  # Пустой текст — сводка заказа на момент отправки
+    reply_markup = models.JSONField(null=True, blank=True, verbose_name="Клавиатура")
+    order = models.ForeignKey("orders.Order", on_delete=models.CASCADE, null=True, blank=True,
+                              related_name="outbound_messages", verbose_name="Заказ")
+    user = models.ForeignKey("users.UserProfile", on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name="outbound_messages", verbose_name="Пользователь")
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_NORMAL,
+                                                verbose_name="Приоритет")
+    log_on_delivery = models.BooleanField(default=False, verbose_name="Записать в журнал уведомлений")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Отправлено")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "priority", "next_attempt_at"], name="outbox_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"Сообщение #{self.id} для {self.chat_id} ({self.get_status_display()})"
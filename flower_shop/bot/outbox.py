@@ -0,0 +1,177 @@
+import concurrent.futures
+import logging
+import time
+from datetime import timedelta
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from core.db import retry_on_lock
+from core.routers import read_from_replica
+from .models import OutboundMessage
+from .ratelimit import PRIORITY_CHOICES, PRIORITY_NORMAL
+from .sender import get_sender
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для настроек диспетчера
+OUTBOX_DEFAULTS = {
+    "OUTBOX_BATCH_SIZE": 50,
+    "OUTBOX_MAX_ATTEMPTS": 8,
+    "OUTBOX_BACKOFF_BASE": 5,  # секунд, удваивается с каждой попыткой
+    "OUTBOX_BACKOFF_MAX": 3600,
+    "OUTBOX_LEASE": 120,  # на сколько секунд диспетчер «забирает» пачку сообщений
+    "OUTBOX_SEND_TIMEOUT": 60,  # сколько секунд ждать отправки пачки (с учётом лимитов Telegram)
+}
+
+
+def _setting(name):
+    return getattr(settings, name, OUTBOX_DEFAULTS[name])
+
+
+def enqueue_message(chat_id, text="", reply_markup=None, *, order=None, user=None, log=False,
+                    priority=PRIORITY_NORMAL):
+    """
+    Ставит сообщение в очередь на отправку.
+
+    Вызывается внутри транзакции изменения, поэтому сообщение появится в очереди
+    только вместе с закоммиченными данными. Если text пустой, при отправке
+    будет сформирована сводка заказа order. log=True — записать сообщение
+    в NotificationLog пользователя user после успешной доставки. Сообщения
+    с меньшим priority отправляются первыми.
+    """
+    return OutboundMessage.objects.create(
+        chat_id=chat_id,
+        text=text,
+        reply_markup=reply_markup.model_dump(mode="json", exclude_none=True) if reply_markup else None,
+        order=order,
+        user=user,
+        log_on_delivery=log,
+        priority=priority,
+    )
+
+
+def render(message):
+    """Текст и клавиатура сообщения для отправки."""
+    text = message.text or message.order.get_order_summary()
+    reply_markup = InlineKeyboardMarkup.model_validate(message.reply_markup) if message.reply_markup else None
+    return text, reply_markup
+
+
+def backoff(attempts):
+    """Задержка перед следующей попыткой: экспоненциально растёт, но не больше OUTBOX_BACKOFF_MAX."""
+    return min(_setting("OUTBOX_BACKOFF_BASE") * 2 ** (attempts - 1), _setting("OUTBOX_BACKOFF_MAX"))
+
+
+@retry_on_lock
+def claim_batch(batch_size=None):
+    """
+    Забирает пачку готовых к отправке сообщений.
+
+    Сообщения «арендуются»: next_attempt_at сдвигается на OUTBOX_LEASE, поэтому
+    второй диспетчер их не возьмёт, а после падения процесса они снова станут доступны.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=_setting("OUTBOX_LEASE"))
+    due = OutboundMessage.objects.filter(status=OutboundMessage.STATUS_PENDING, next_attempt_at__lte=now)
+    ids = list(due.order_by("priority", "next_attempt_at", "id").values_list("id", flat=True)[:batch_size or _setting("OUTBOX_BATCH_SIZE")])
+    if not ids:
+        return []
+    due.filter(id__in=ids).update(next_attempt_at=lease_until)
+    return list(
+        OutboundMessage.objects.filter(id__in=ids, next_attempt_at=lease_until)
+        .select_related("order", "user")
+        .prefetch_related("order__items")  # сводки заказов без запроса на каждую позицию
+        .order_by("priority", "id")
+    )
+
+
+def deliver(messages):
+    """Отправляет сообщения через общий отправитель. Возвращает по исключению на сообщение (None — доставлено)."""
+    sender = get_sender()
+    errors = [None] * len(messages)
+    futures = []
+    for index, message in enumerate(messages):
+        try:
+            text, markup = render(message)
+        except Exception as e:  # например, заказ удалён — отправлять нечего
+            errors[index] = e
+            continue
+        futures.append((index, sender.send_message(message.chat_id, text, markup, priority=message.priority)))
+
+    # Лимиты Telegram могут задержать пачку; не дождавшиеся отправки сообщения
+    # отменяются и уходят на повтор (аренда OUTBOX_LEASE длиннее этого ожидания)
+    deadline = time.monotonic() + _setting("OUTBOX_SEND_TIMEOUT")
+    for index, future in futures:
+        try:
+            future.result(max(deadline - time.monotonic(), 0))
+        except concurrent.futures.TimeoutError as e:
+            future.cancel()
+            errors[index] = e
+        except Exception as e:
+            errors[index] = e
+    return errors
+
+
+def record_outcomes(messages, errors):
+    """Отмечает доставленные сообщения, планирует повторы и пишет NotificationLog только при успехе."""
+    from users.models import NotificationLog  # users.models сам ставит сообщения в очередь через этот модуль
+
+    now = timezone.now()
+    logs = []
+    for message, error in zip(messages, errors):
+        message.attempts += 1
+        if error is None:
+            message.status = OutboundMessage.STATUS_SENT
+            message.sent_at = now
+            message.last_error = ""
+            if message.log_on_delivery and message.user_id:
+                logs.append(NotificationLog(user_id=message.user_id, message=message.text))
+        elif isinstance(error, (TelegramForbiddenError, TelegramBadRequest)) or \
+                message.attempts >= _setting("OUTBOX_MAX_ATTEMPTS"):
+            # Бот заблокирован, чат не найден или попытки исчерпаны — повторять бессмысленно
+            message.status = OutboundMessage.STATUS_FAILED
+            message.last_error = repr(error)
+            logger.warning("Сообщение #%s не доставлено: %r", message.id, error)
+        else:
+            delay = error.retry_after if isinstance(error, TelegramRetryAfter) else backoff(message.attempts)
+            message.next_attempt_at = now + timedelta(seconds=delay)
+            message.last_error = repr(error)
+    _save_outcomes(messages, logs)
+
+
+@retry_on_lock
+def _save_outcomes(messages, logs):
+    # Повторяется только запись: счётчики попыток уже посчитаны и не увеличатся дважды
+    with transaction.atomic():
+        OutboundMessage.objects.bulk_update(
+            messages, ["status", "attempts", "next_attempt_at", "last_error", "sent_at"]
+        )
+        if logs:
+            type(logs[0]).objects.bulk_create(logs)
+
+
+def dispatch_batch(batch_size=None):
+    """Забирает и отправляет одну пачку сообщений. Возвращает число обработанных сообщений."""
+    messages = claim_batch(batch_size)
+    if messages:
+        record_outcomes(messages, deliver(messages))
+    return len(messages)
+
+
+def outbox_stats():
+    """Глубина очереди по приоритетам, возраст старейшего сообщения и состояние лимитера отправителя."""
+    with read_from_replica(ignore_writes=True):  # отчёт: секундное отставание реплики не важно
+        pending = OutboundMessage.objects.filter(status=OutboundMessage.STATUS_PENDING)
+        by_priority = dict(pending.values_list("priority").annotate(count=Count("id")))
+        oldest = pending.aggregate(oldest=Min("created_at"))["oldest"]
+        failed = OutboundMessage.objects.filter(status=OutboundMessage.STATUS_FAILED).count()
+    return {
+        "pending": sum(by_priority.values()),
+        "pending_by_priority": {name: by_priority.get(priority, 0) for priority, name in PRIORITY_CHOICES},
+        "oldest_pending_age": (timezone.now() - oldest).total_seconds() if oldest else 0.0,
+        "failed": failed,
+        "sender": get_sender().stats(),
+    }
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from users.models import UserProfile
+
+# Значения по умолчанию для кэша профилей бота
+PROFILE_CACHE_DEFAULTS = {
+    "BOT_PROFILE_CACHE_SIZE": 10000,  # профилей в памяти, самые давние вытесняются
+    "BOT_PROFILE_CACHE_TTL": 300,  # сек; страховка от правок из другого процесса
+    "BOT_PROFILE_CACHE_NEGATIVE_TTL": 30,  # сек для «не привязан»: привязка на сайте видна боту быстрее
+}
+
+_MISSING = object()
+
+
+def _setting(name):
+    return getattr(settings, name, PROFILE_CACHE_DEFAULTS[name])
+
+
+class TelegramProfileCache:
+    """
+    LRU-кэш «Telegram ID → профиль» с TTL для обработчиков бота.
+
+    Помнит и отсутствие профиля (короче, BOT_PROFILE_CACHE_NEGATIVE_TTL), чтобы
+    сообщения непривязанных пользователей тоже не шли в базу. Записи сбрасываются
+    сигналами post_save/post_delete UserProfile — привязка и отвязка в этом
+    процессе видны сразу, правки из других процессов — по истечении TTL.
+    Возвращаемые профили общие для всех обработчиков: только для чтения.
+    """
+
+    def __init__(self, maxsize=None, ttl=None, negative_ttl=None):
+        self.maxsize = _setting("BOT_PROFILE_CACHE_SIZE") if maxsize is None else maxsize
+        self.ttl = _setting("BOT_PROFILE_CACHE_TTL") if ttl is None else ttl
+        self.negative_ttl = _setting("BOT_PROFILE_CACHE_NEGATIVE_TTL") if negative_ttl is None else negative_ttl
+        self._entries = OrderedDict()  # telegram_id -> (профиль или None, истекает)
+        self._by_profile = {}  # pk профиля -> telegram_id, под которым он лежит в кэше
+        self._lock = threading.Lock()  # сигналы приходят из потоков ORM
+        self._generation = 0  # растёт при каждом сбросе: результат запроса, начатого до сброса, не кэшируется
+        self.hits = self.negative_hits = self.misses = self.evictions = self.invalidations = 0
+
+    def _get(self, telegram_id):
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                self.negative_hits += entry[0] is None
+                return entry[0]
+            self.misses += 1
+            return _MISSING
+
+    def _put(self, telegram_id, profile, generation):
+        with self._lock:
+            if generation != self._generation:
+                return  # профиль менялся, пока шёл запрос
+            self._drop(telegram_id)
+            ttl = self.ttl if profile is not None else self.negative_ttl
+            self._entries[telegram_id] = (profile, time.monotonic() + ttl)
+            if profile is not None:
+                self._by_profile[profile.pk] = telegram_id
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, telegram_id):
+        entry = self._entries.pop(telegram_id, None)
+        if entry is not None and entry[0] is not None:
+            self._by_profile.pop(entry[0].pk, None)
+
+    async def aget(self, telegram_id):
+        """Профиль по Telegram ID или None; в базу — только при промахе."""
+        profile = self._get(telegram_id)
+        if profile is not _MISSING:
+            return profile
+        generation = self._generation
+        profile = await UserProfile.aget_by_telegram_id(telegram_id)
+        self._put(telegram_id, profile, generation)
+        return profile
+
+    def invalidate(self, *telegram_ids, profile_pk=None):
+        """Сбрасывает записи для указанных Telegram ID и профиля profile_pk."""
+        with self._lock:
+            self._generation += 1
+            keys = {key for key in telegram_ids if key is not None}
+            if profile_pk is not None and profile_pk in self._by_profile:
+                keys.add(self._by_profile[profile_pk])
+            for key in keys:
+                if key in self._entries:
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        """Очищает кэш и счётчики."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_profile.clear()
+            self.hits = self.negative_hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self):
+        """Счётчики для мониторинга."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+profile_cache = TelegramProfileCache()
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_profile_cache(sender, instance, **kwargs):
+    """Сбрасывает кэш по старому и новому Telegram ID изменённого профиля."""
+    loaded = getattr(instance, "_loaded_state", {})  # значения до сохранения (ChangeTrackingMixin)
+    telegram_ids = (instance.telegram_id, loaded.get("telegram_id"))
+    profile_cache.invalidate(*telegram_ids, profile_pk=instance.pk)
+    # Повторно после коммита: параллельный обработчик мог успеть прочитать старые данные
+    transaction.on_commit(lambda: profile_cache.invalidate(*telegram_ids, profile_pk=instance.pk))
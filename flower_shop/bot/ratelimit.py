@@ -0,0 +1,237 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих сообщений: меньше — важнее
+PRIORITY_HIGH = 0  # транзакционные: заказ создан или отменён
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2  # напоминания и массовые рассылки
+PRIORITY_CHOICES = [
+    (PRIORITY_HIGH, "Высокий"),
+    (PRIORITY_NORMAL, "Обычный"),
+    (PRIORITY_LOW, "Низкий"),
+]
+
+# Значения по умолчанию — лимиты Telegram из документации Bot API
+RATE_LIMIT_DEFAULTS = {
+    "TELEGRAM_GLOBAL_RATE": 30,  # сообщений в секунду на бота
+    "TELEGRAM_CHAT_RATE": 1,  # сообщений в секунду в личный чат
+    "TELEGRAM_CHAT_BURST": 3,
+    "TELEGRAM_GROUP_RATE": 20 / 60,  # сообщений в секунду в группу
+    "TELEGRAM_RETRY_LIMIT": 3,  # сколько раз повторять после RetryAfter
+    "TELEGRAM_MAX_RETRY_AFTER": 60,  # более долгое ожидание возвращается вызывающему как ошибка
+}
+
+_priority = contextvars.ContextVar("telegram_send_priority", default=PRIORITY_NORMAL)
+
+
+def _setting(name):
+    return getattr(settings, name, RATE_LIMIT_DEFAULTS[name])
+
+
+@contextmanager
+def send_priority(priority):
+    """Задаёт приоритет всех сообщений, отправляемых внутри блока."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Сколько секунд ждать следующего токена (0 — можно отправлять сейчас)."""
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until):
+        """Запрещает отправку до момента until (по time.monotonic), например после RetryAfter."""
+        self.blocked_until = max(self.blocked_until, until)
+
+    @property
+    def idle(self):
+        return self.tokens >= self.capacity and self.blocked_until <= self.updated
+
+
+class TelegramRateLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии aiogram, соблюдающее лимиты Telegram.
+
+    Запросы с chat_id (отправка и редактирование сообщений) ждут токен в общей
+    корзине бота и в корзине чата. Ожидающие обслуживаются по приоритету
+    (send_priority), а внутри приоритета — по очереди. После RetryAfter чат
+    блокируется на указанное Telegram время, и запрос повторяется. Остальные
+    запросы (getUpdates, answerCallbackQuery) проходят без ограничений.
+
+    Лимиты действуют в пределах одного цикла событий: у бота-поллера и у общего
+    отправителя свои экземпляры.
+    """
+
+    def __init__(self, global_rate=None, chat_rate=None, chat_burst=None, group_rate=None,
+                 retry_limit=None, max_retry_after=None, max_chats=10000):
+        self.global_rate = global_rate or _setting("TELEGRAM_GLOBAL_RATE")
+        self.chat_rate = chat_rate or _setting("TELEGRAM_CHAT_RATE")
+        self.chat_burst = chat_burst or _setting("TELEGRAM_CHAT_BURST")
+        self.group_rate = group_rate or _setting("TELEGRAM_GROUP_RATE")
+        self.retry_limit = _setting("TELEGRAM_RETRY_LIMIT") if retry_limit is None else retry_limit
+        self.max_retry_after = max_retry_after or _setting("TELEGRAM_MAX_RETRY_AFTER")
+        self.max_chats = max_chats
+        self.global_bucket = TokenBucket(self.global_rate, self.global_rate)
+        self._chat_buckets = OrderedDict()
+        # Куча ожидающих: (приоритет, порядковый номер, chat_id, время постановки, future)
+        self._waiters = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._pump_task = None
+        self.granted = 0
+        self.retried = 0
+        self._waits = deque(maxlen=1000)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        retries = 0
+        while True:
+            await self.acquire(chat_id, _priority.get())
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.retried += 1
+                self._chat_bucket(chat_id).block(time.monotonic() + e.retry_after)
+                retries += 1
+                if retries > self.retry_limit or e.retry_after > self.max_retry_after:
+                    raise
+                logger.warning("Telegram просит подождать %s с для чата %s", e.retry_after, chat_id)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные id и @username — группы и каналы, у них лимит строже
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            bucket = (TokenBucket(self.group_rate, 1) if is_group
+                      else TokenBucket(self.chat_rate, self.chat_burst))
+            self._chat_buckets[chat_id] = bucket
+            if len(self._chat_buckets) > self.max_chats:
+                self._evict_idle()
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for chat_id in list(self._chat_buckets):
+            if len(self._chat_buckets) <= self.max_chats:
+                break
+            bucket = self._chat_buckets[chat_id]
+            bucket.delay(now)
+            if bucket.idle:
+                del self._chat_buckets[chat_id]
+
+    async def acquire(self, chat_id, priority=PRIORITY_NORMAL):
+        """Ждёт разрешения отправить сообщение в chat_id."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), chat_id, time.monotonic(), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._wakeup = asyncio.Event()
+            self._pump_task = asyncio.ensure_future(self._pump())
+        self._wakeup.set()
+        await future
+
+    async def _pump(self):
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._grant(time.monotonic())
+            if delay is None:
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant(self, now):
+        """Пропускает самого приоритетного ожидающего, чей чат свободен; иначе возвращает паузу."""
+        global_delay = self.global_bucket.delay(now)
+        if global_delay > 0:
+            return global_delay
+        skipped = []
+        delay = None
+        try:
+            while self._waiters:
+                item = heapq.heappop(self._waiters)
+                priority, seq, chat_id, enqueued_at, future = item
+                if future.done():  # ожидающий отменён
+                    continue
+                bucket = self._chat_bucket(chat_id)
+                chat_delay = bucket.delay(now)
+                if chat_delay > 0:
+                    skipped.append(item)
+                    delay = chat_delay if delay is None else min(delay, chat_delay)
+                    continue
+                bucket.take(now)
+                self.global_bucket.take(now)
+                self.granted += 1
+                self._waits.append(now - enqueued_at)
+                future.set_result(None)
+                return None
+            return delay
+        finally:
+            for item in skipped:
+                heapq.heappush(self._waiters, item)
+
+    async def close(self):
+        """Останавливает очередь ожидания (ожидающие запросы отменяются)."""
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            self._pump_task = None
+        for item in self._waiters:
+            item[4].cancel()
+        self._waiters.clear()
+
+    def stats(self):
+        """Состояние очереди для мониторинга (вызывать из цикла событий лимитера)."""
+        queued = Counter(item[0] for item in self._waiters if not item[4].done())
+        waits = list(self._waits)
+        return {
+            "queued": sum(queued.values()),
+            "queued_by_priority": {name: queued.get(priority, 0) for priority, name in PRIORITY_CHOICES},
+            "granted": self.granted,
+            "retry_after": self.retried,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_max": max(waits) if waits else 0.0,
+        }
@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from cart.schedule import get_schedule
+from core.routers import read_from_replica
+from orders.models import Order, PaymentReminder
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для настроек напоминаний об оплате
+REMINDER_DEFAULTS = {
+    "PAYMENT_REMINDER_INTERVAL_HOURS": 24,  # пауза между повторными напоминаниями
+    "PAYMENT_REMINDER_MAX": 3,  # сколько всего напоминаний по одному заказу
+    "PAYMENT_REMINDER_POLL": 300,  # сек: как часто подхватывать заказы, созданные другими процессами
+}
+# Сколько заказов загружать за одно обращение к базе
+LOAD_CHUNK_SIZE = 1000
+
+
+def _setting(name):
+    return getattr(settings, name, REMINDER_DEFAULTS[name])
+
+
+def reminder_due_at(created_at, sent, last_sent_at):
+    """Когда отправить следующее напоминание (None — предел напоминаний исчерпан)."""
+    if sent >= _setting("PAYMENT_REMINDER_MAX"):
+        return None
+    if not sent:
+        return created_at + Order.PAYMENT_TIMEOUT
+    return last_sent_at + timedelta(hours=_setting("PAYMENT_REMINDER_INTERVAL_HOURS"))
+
+
+def _with_ledger(orders):
+    return orders.annotate(reminders_sent=Count("payment_reminders"),
+                           last_reminder_at=Max("payment_reminders__sent_at"))
+
+
+async def load_awaiting(after_id=0, size=None):
+    """
+    Порция неоплаченных заказов с id больше after_id: список (id, срок следующего напоминания).
+
+    Скан читается с реплики: отставание лишь откладывает подхват заказа, а статус
+    перед отправкой напоминания перепроверяет load_due по основной базе.
+    """
+    chunk = (_with_ledger(Order.objects.filter(status="awaiting_payment", id__gt=after_id))
+             .order_by("id")
+             .values_list("id", "created_at", "reminders_sent", "last_reminder_at")[:size or LOAD_CHUNK_SIZE])
+    with read_from_replica(ignore_writes=True):
+        rows = [row async for row in chunk]
+    return [(order_id, reminder_due_at(created_at, sent, last_sent_at))
+            for order_id, created_at, sent, last_sent_at in rows]
+
+
+async def load_due(order_ids):
+    """Заказы, по которым подошёл срок напоминания, с числом уже отправленных напоминаний."""
+    orders = _with_ledger(Order.objects.filter(id__in=order_ids).select_related("user")).order_by("id")
+    return [order async for order in orders]
+
+
+async def record_reminders(orders, sent_at):
+    await PaymentReminder.objects.abulk_create(
+        [PaymentReminder(order=order, number=order.reminders_sent + 1, sent_at=sent_at) for order in orders],
+        ignore_conflicts=True,
+    )
+
+
+class ReminderScheduler:
+    """
+    Планировщик напоминаний об оплате.
+
+    Держит кучу сроков следующего напоминания по каждому неоплаченному заказу
+    и спит до ближайшего. Все заказы загружаются один раз при запуске; новые
+    и оплаченные заказы этого процесса приходят через сигнал post_save, заказы
+    из других процессов подхватываются раз в PAYMENT_REMINDER_POLL секунд
+    запросом по id больше последнего загруженного. Каждое отправленное
+    напоминание записывается в PaymentReminder, поэтому после перезапуска
+    повторы и предел PAYMENT_REMINDER_MAX сохраняются.
+    """
+
+    def __init__(self, remind):
+        self.remind = remind  # async-функция, отправляющая напоминание по заказу
+        self._heap = []
+        self._due = {}  # id заказа -> актуальный срок; записи кучи с другим сроком устарели
+        self._last_seen_id = 0
+        self._loop = None
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._due)
+
+    def schedule(self, order_id, due_at):
+        """Назначает (или снимает при due_at=None) следующее напоминание по заказу."""
+        if due_at is None:
+            self._due.pop(order_id, None)
+            return
+        self._due[order_id] = due_at
+        heapq.heappush(self._heap, (due_at, order_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def next_due(self):
+        """Ближайший срок напоминания или None."""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, moment):
+        """Снимает с расписания заказы со сроком не позже moment и возвращает их id."""
+        order_ids = []
+        while True:
+            due_at = self.next_due()
+            if due_at is None or due_at > moment:
+                return order_ids
+            due_at, order_id = heapq.heappop(self._heap)
+            del self._due[order_id]
+            order_ids.append(order_id)
+
+    def notify(self, order_id, due_at):
+        """Потокобезопасное обновление расписания (вызывается из сигналов)."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.schedule, order_id, due_at)
+
+    async def load_new(self):
+        """Подгружает заказы, появившиеся после последней загрузки."""
+        while True:
+            chunk = await load_awaiting(self._last_seen_id)
+            if not chunk:
+                return
+            self._last_seen_id = chunk[-1][0]
+            for order_id, due_at in chunk:
+                self.schedule(order_id, due_at)
+
+    async def process_due(self, moment=None):
+        """Отправляет напоминания, срок которых наступил. Возвращает число отправленных."""
+        moment = moment or timezone.now()
+        order_ids = self.pop_due(moment)
+        if not order_ids:
+            return 0
+
+        schedule = await sync_to_async(get_schedule)()  # кеш расписания — синхронный API
+        if not schedule.is_open(moment):
+            # Ночью и в выходные не беспокоим — переносим на открытие магазина
+            opening = schedule.next_opening(moment) or moment + timedelta(seconds=_setting("PAYMENT_REMINDER_POLL"))
+            for order_id in order_ids:
+                self.schedule(order_id, opening)
+            return 0
+
+        reminded = []
+        for order in await load_due(order_ids):
+            if order.status != "awaiting_payment":
+                continue  # оплачен или отменён — напоминать больше не нужно
+            if reminder_due_at(order.created_at, order.reminders_sent, order.last_reminder_at) is None:
+                continue
+            try:
+                await self.remind(order)
+            except Exception:
+                logger.exception("Не удалось отправить напоминание по заказу #%s", order.id)
+                self.schedule(order.id, moment + timedelta(seconds=_setting("PAYMENT_REMINDER_POLL")))
+                continue
+            reminded.append(order)
+
+        if reminded:
+            await record_reminders(reminded, moment)
+        for order in reminded:
+            self.schedule(order.id, reminder_due_at(order.created_at, order.reminders_sent + 1, moment))
+        return len(reminded)
+
+    async def run(self):
+        """Основной цикл: спит до ближайшего срока, новых заказов или очередного опроса базы."""
+        global _active_scheduler
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        _active_scheduler = self
+        poll = _setting("PAYMENT_REMINDER_POLL")
+        next_poll = 0.0
+        try:
+            while True:
+                if time.monotonic() >= next_poll:
+                    await self.load_new()
+                    next_poll = time.monotonic() + poll
+                await self.process_due()
+
+                timeout = next_poll - time.monotonic()
+                due_at = self.next_due()
+                if due_at is not None:
+                    timeout = min(timeout, (due_at - timezone.now()).total_seconds())
+                self._wakeup.clear()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            if _active_scheduler is self:
+                _active_scheduler = None
+
+
+# Планировщик, запущенный в этом процессе (бот под runserver), — ему передаются изменения заказов
+_active_scheduler = None
+
+
+@receiver(post_save, sender=Order)
+def track_order_for_reminders(sender, instance, created, update_fields=None, **kwargs):
+    """Сообщает запущенному планировщику о новом неоплаченном заказе или об оплате/отмене."""
+    scheduler = _active_scheduler
+    if scheduler is None or (update_fields is not None and "status" not in update_fields):
+        return
+    if instance.status == "awaiting_payment":
+        if not created:
+            return
+        due_at = instance.created_at + Order.PAYMENT_TIMEOUT
+    else:
+        due_at = None
+    order_id = instance.id
+    transaction.on_commit(lambda: scheduler.notify(order_id, due_at))
@@ -0,0 +1,135 @@
+import asyncio
+import atexit
+import logging
+import threading
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from django.conf import settings
+from bot.config import TOKEN
+from .ratelimit import PRIORITY_NORMAL, TelegramRateLimiter, send_priority
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramSender:
+    """
+    Отправитель сообщений для синхронного кода (представления, сигналы, команды).
+
+    Держит один фоновый поток с постоянным циклом событий и один Bot с общей
+    aiohttp-сессией, поэтому соединение с Telegram переиспользуется между
+    сообщениями. Синхронный код передаёт корутины через run_coroutine_threadsafe
+    и получает concurrent.futures.Future. Запросы проходят через TelegramRateLimiter.
+    """
+
+    def __init__(self, token=TOKEN, api_server=None):
+        self.token = token
+        self.api_server = api_server
+        self.bot = None
+        self.limiter = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self._loop = loop
+            self._thread = threading.Thread(target=run, name="telegram-sender", daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    async def _get_bot(self):
+        # Bot и его сессия создаются внутри цикла отправителя и живут вместе с ним
+        if self.bot is None:
+            session = AiohttpSession(
+                api=TelegramAPIServer.from_base(self.api_server)) if self.api_server else None
+            self.bot = Bot(token=self.token, session=session)
+            self.limiter = TelegramRateLimiter()
+            self.bot.session.middleware(self.limiter)
+        return self.bot
+
+    def submit(self, coroutine_function, *args, priority=PRIORITY_NORMAL, **kwargs):
+        """Выполняет coroutine_function(bot, *args, **kwargs) в цикле отправителя; возвращает Future."""
+        self._start()
+
+        async def call():
+            with send_priority(priority):
+                return await coroutine_function(await self._get_bot(), *args, **kwargs)
+
+        return asyncio.run_coroutine_threadsafe(call(), self._loop)
+
+    def send_message(self, chat_id, text, reply_markup=None, priority=PRIORITY_NORMAL):
+        """Ставит отправку сообщения в цикл отправителя; возвращает Future с результатом."""
+        return self.submit(_send_message, chat_id=chat_id, text=text, reply_markup=reply_markup, priority=priority)
+
+    def stats(self, timeout=5):
+        """Очередь и время ожидания в лимитере (None, если отправитель ещё не запускался)."""
+        if self._loop is None or self.limiter is None:
+            return None
+
+        async def collect():
+            return self.limiter.stats()
+
+        return asyncio.run_coroutine_threadsafe(collect(), self._loop).result(timeout)
+
+    def close(self, timeout=5):
+        """Закрывает сессию бота и останавливает цикл."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        if thread.is_alive():
+            future = asyncio.run_coroutine_threadsafe(self._close_bot(), loop)
+            try:
+                future.result(timeout)
+            except Exception as e:
+                logger.warning("Не удалось закрыть сессию бота: %r", e)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+        if not loop.is_running():
+            loop.close()
+
+    async def _close_bot(self):
+        if self.bot is not None:
+            await self.limiter.close()
+            await self.bot.session.close()
+            self.bot = self.limiter = None
+
+
+async def _send_message(bot, **kwargs):
+    return await bot.send_message(**kwargs)
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sender():
+    """Общий для процесса отправитель (создаётся при первом обращении)."""
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                _sender = TelegramSender(api_server=getattr(settings, "TELEGRAM_API_SERVER", None))
+    return _sender
+
+
+@atexit.register
+def shutdown():
+    """Закрывает общий отправитель (вызывается при завершении процесса)."""
+    global _sender
+    with _sender_lock:
+        sender, _sender = _sender, None
+    if sender is not None:
+        sender.close()
@@ -1,9 +1,11 @@
 import unittest
 import asyncio
+import json
+import threading
 import django
 from django.conf import settings
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.db import connection
 import pytest
 import sys
@@ -29,20 +31,43 @@ if not settings.configured:
     )
     django.setup()
 
-from asgiref.sync import sync_to_async
-from unittest.mock import Mock, patch, AsyncMock, MagicMock
+from asgiref.sync import async_to_sync, sync_to_async
+from unittest.mock import Mock, patch, AsyncMock
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from aiogram import types
-from bot.main import start_command, process_contact, unlink_telegram, check_payment_reminders
-from bot.utils import send_telegram_message
+from bot.main import start_command, process_contact, unlink_telegram, remind_about_order, load_order_summary
+from bot.main import route_callback
+from bot.callbacks import CallbackRouter, CancelOrder, ConfirmCancel
+from bot.main import bot as main_bot, dp
+from bot.dbthreads import ASGIREF_VERSION, DbThreadPool, own_db_thread
+from django.core.exceptions import ImproperlyConfigured
+import asgiref
+import os
+from bot.profiles import TelegramProfileCache, profile_cache
+from bot.webhook import SECRET_HEADER, TelegramWebhook
+from aiohttp.test_utils import TestClient, TestServer
+from django.core.management.base import CommandError
+from bot.utils import send_message
+from bot.sender import TelegramSender
+from bot.reminders import ReminderScheduler
+from orders.models import PaymentReminder
+from bot.ratelimit import TelegramRateLimiter, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from aiogram.methods import SendMessage, GetUpdates
+from time import monotonic
 from users.models import UserProfile, notify_profile_update
 from orders.models import Order, send_status_update
 from cart.models import WorkingHours
 from django.utils.timezone import now, timedelta
 from freezegun import freeze_time
 from datetime import time
-from cart.views import is_working_hours
+from io import StringIO
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from bot.models import OutboundMessage
+from bot.outbox import enqueue_message, dispatch_batch, backoff, outbox_stats
+from catalog.models import Flower
+from orders.models import OrderItem
+from users.models import NotificationLog
 
 @pytest.mark.django_db
 class TestBot(TestCase):
@@ -57,6 +82,7 @@ class TestBot(TestCase):
     def setUp(self):
         post_save.disconnect(notify_profile_update, sender=UserProfile)
         post_save.disconnect(send_status_update, sender=Order)
+        profile_cache.clear()
         self.auth_user = User.objects.create(username="testuser")
         self.user, created = UserProfile.objects.get_or_create(user=self.auth_user)
         self.user.full_name = "Test User"
@@ -144,6 +170,8 @@ class TestBot(TestCase):
         )
         updated_user = await sync_to_async(UserProfile.objects.get)(phone="+79991234567")
         self.assertEqual(updated_user.telegram_id, 987654321)
+        # Привязка меняет только telegram_id — уведомление «профиль обновлён» не ставится
+        self.assertFalse(await OutboundMessage.objects.filter(chat_id=987654321).aexists())
 
     @patch('bot.main.bot.send_message', new_callable=AsyncMock)
     async def test_process_contact_not_found(self, mock_send_message):
@@ -171,41 +199,670 @@ class TestBot(TestCase):
         self.assertIsNone(updated_user.telegram_id)
 
     @patch('bot.main.bot.send_message', new_callable=AsyncMock)
-    @patch('cart.views.is_working_hours')
-    @patch('orders.models.Order.objects.filter')
-    @patch('orders.models.Order.is_payment_overdue')
-    async def test_check_payment_reminders(self, mock_is_payment_overdue, mock_order_filter, mock_is_working_hours, mock_send_message):
-        mock_is_payment_overdue.return_value = True
-        mock_queryset = MagicMock()
-        mock_queryset.select_related.return_value = [self.order]
-        mock_order_filter.return_value = mock_queryset
-        mock_is_working_hours.return_value = True
-        
-        self.assertTrue(await sync_to_async(is_working_hours)(), "is_working_hours should return True via sync_to_async")
-        overdue_orders = mock_order_filter.return_value.select_related('user')
-        self.assertEqual(len(overdue_orders), 1, "overdue_orders should contain one order")
-        self.assertEqual(overdue_orders[0].id, self.order.id, "overdue_orders[0] should match self.order")
-        self.assertTrue(await sync_to_async(overdue_orders[0].is_payment_overdue)(), "is_payment_overdue should return True")
-        
-        await check_payment_reminders()
-        
+    async def test_unlink_telegram_keeps_cached_profile_intact(self, mock_send_message):
+        """Отвязка не меняет общий объект из кэша, даже если сохранение упало."""
+        message = Mock(spec=types.Message)
+        message.from_user = Mock(id=123456789)
+        message.chat = Mock(id=123456789)
+        cached = await profile_cache.aget(123456789)
+        with patch.object(UserProfile, "asave", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                await unlink_telegram(message)
+        self.assertEqual(cached.telegram_id, 123456789)
+        await unlink_telegram(message)
+        self.assertEqual(cached.telegram_id, 123456789)
+        self.assertIsNone(await profile_cache.aget(123456789))
+
+    @patch('bot.main.bot.send_message', new_callable=AsyncMock)
+    async def test_unlink_telegram_stale_cache(self, mock_send_message):
+        """Профиль уже отвязан в другом процессе: сообщаем об ошибке и сбрасываем запись кэша."""
+        message = Mock(spec=types.Message)
+        message.from_user = Mock(id=123456789)
+        message.chat = Mock(id=123456789)
+        await profile_cache.aget(123456789)
+        await UserProfile.objects.filter(pk=self.user.pk).aupdate(telegram_id=None)  # без сигналов
+        await unlink_telegram(message)
+        mock_send_message.assert_called_once_with(123456789, "❌ Ошибка: ваш Telegram ID не привязан к аккаунту.")
+        self.assertIsNone(await profile_cache.aget(123456789))
+
+    @patch('bot.main.bot.send_message', new_callable=AsyncMock)
+    async def test_remind_about_order(self, mock_send_message):
+        await remind_about_order(self.order)
         mock_send_message.assert_called_once_with(
             123456789,
             f"⚠️ Ваш заказ #{self.order.id} ожидает оплаты! Пожалуйста, оплатите его."
         )
 
-    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
-    async def test_send_telegram_message(self, mock_bot_send_message):
-        chat_id = 123456789
-        text = "Test message"
-        await send_telegram_message(chat_id, text)
-        mock_bot_send_message.assert_called_once_with(chat_id=chat_id, text=text, reply_markup=None)
-
     def test_run_async(self):
         async def dummy():
             return "done"
         result = asyncio.run(dummy())
         self.assertEqual(result, "done")
 
+
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.auth_user = User.objects.create(username="outboxuser")
+        self.user = UserProfile.objects.get(user=self.auth_user)
+        self.user.full_name = "Test User"
+        self.user.phone = "+79991234567"
+        self.user.telegram_id = 123456789
+        self.user.save()
+        self.order = Order.objects.create(user=self.user, status="awaiting_payment", total_price=1000.00)
+        OutboundMessage.objects.all().delete()
+        NotificationLog.objects.all().delete()
+
+    def test_status_change_is_queued_not_sent(self):
+        """Смена статуса только ставит сообщение в очередь, журнал пишется после доставки."""
+        with patch('aiogram.Bot.send_message', new_callable=AsyncMock) as mock_send:
+            self.order.status = "processing"
+            self.order.save()
+            mock_send.assert_not_called()
+        message = OutboundMessage.objects.get()
+        self.assertEqual(message.status, OutboundMessage.STATUS_PENDING)
+        self.assertFalse(NotificationLog.objects.exists())
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_dispatch_marks_sent_and_logs(self, mock_send):
+        enqueue_message(self.user.telegram_id, "Привет", user=self.user, log=True)
+        self.assertEqual(dispatch_batch(), 1)
+        mock_send.assert_called_once_with(chat_id=123456789, text="Привет", reply_markup=None)
+        message = OutboundMessage.objects.get()
+        self.assertEqual(message.status, OutboundMessage.STATUS_SENT)
+        self.assertEqual(message.attempts, 1)
+        self.assertEqual(NotificationLog.objects.get().message, "Привет")
+        self.assertEqual(dispatch_batch(), 0)
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_transient_error_schedules_retry(self, mock_send):
+        mock_send.side_effect = ConnectionError("network down")
+        enqueue_message(self.user.telegram_id, "Привет", user=self.user, log=True)
+        dispatch_batch()
+        message = OutboundMessage.objects.get()
+        self.assertEqual(message.status, OutboundMessage.STATUS_PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertGreater(message.next_attempt_at, now() + timedelta(seconds=backoff(1) - 1))
+        self.assertFalse(NotificationLog.objects.exists())
+        # До наступления next_attempt_at сообщение повторно не забирается
+        self.assertEqual(dispatch_batch(), 0)
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_retry_after_is_honoured(self, mock_send):
+        mock_send.side_effect = TelegramRetryAfter(method=Mock(), message="Flood control", retry_after=600)
+        enqueue_message(self.user.telegram_id, "Привет")
+        dispatch_batch()
+        message = OutboundMessage.objects.get()
+        self.assertGreater(message.next_attempt_at, now() + timedelta(seconds=590))
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_blocked_bot_fails_permanently(self, mock_send):
+        mock_send.side_effect = TelegramForbiddenError(method=Mock(), message="bot was blocked by the user")
+        enqueue_message(self.user.telegram_id, "Привет", user=self.user, log=True)
+        dispatch_batch()
+        message = OutboundMessage.objects.get()
+        self.assertEqual(message.status, OutboundMessage.STATUS_FAILED)
+        self.assertFalse(NotificationLog.objects.exists())
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_order_summary_rendered_at_dispatch(self, mock_send):
+        flower = Flower.objects.create(name="Роза", price=500.00, image="flowers/rose.jpg")
+        order = Order.objects.create(user=self.user, status="awaiting_payment", total_price=1000.00)
+        OrderItem.objects.create(order=order, flower=flower, quantity=2, price=500.00, subtotal=1000.00)
+        OutboundMessage.objects.exclude(order=order).delete()
+        dispatch_batch()
+        kwargs = mock_send.call_args.kwargs
+        self.assertIn("Роза x 2 - 1000.00 руб.", kwargs["text"])
+        self.assertEqual(kwargs["reply_markup"].inline_keyboard[0][0].callback_data, f"oc:{order.id}")
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_dispatch_outbox_command(self, mock_send):
+        enqueue_message(self.user.telegram_id, "Первое")
+        enqueue_message(self.user.telegram_id, "Второе")
+        call_command("dispatch_outbox", "--once", "--batch-size", "1", stdout=StringIO())
+        self.assertEqual(mock_send.call_count, 2)
+        self.assertEqual(OutboundMessage.objects.filter(status=OutboundMessage.STATUS_SENT).count(), 2)
+
+
+
+class TelegramSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.sender = TelegramSender()
+
+    def tearDown(self):
+        self.sender.close()
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_messages_share_bot_and_loop(self, mock_send):
+        """Все сообщения идут через один Bot в одном постоянном цикле."""
+        futures = [self.sender.send_message(123456789, f"Сообщение {i}") for i in range(5)]
+        for future in futures:
+            future.result(5)
+        self.assertEqual(mock_send.call_count, 5)
+        bot = self.sender.bot
+        self.sender.send_message(123456789, "Ещё одно").result(5)
+        self.assertIs(self.sender.bot, bot)
+        self.assertTrue(self.sender._thread.is_alive())
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_error_propagates_through_future(self, mock_send):
+        mock_send.side_effect = TelegramForbiddenError(method=Mock(), message="bot was blocked by the user")
+        with self.assertRaises(TelegramForbiddenError):
+            self.sender.send_message(123456789, "Привет").result(5)
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_close_stops_loop_and_restarts_on_demand(self, mock_send):
+        self.sender.send_message(123456789, "Привет").result(5)
+        thread = self.sender._thread
+        self.sender.close()
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(self.sender.bot)
+        self.sender.send_message(123456789, "Снова").result(5)
+        self.assertEqual(mock_send.call_count, 2)
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_sync_send_message_uses_shared_sender(self, mock_send):
+        with patch('bot.utils.get_sender', return_value=self.sender):
+            send_message(123456789, "Привет")
+        mock_send.assert_called_once_with(chat_id=123456789, text="Привет", reply_markup=None)
+
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock, side_effect=RuntimeError("сбой"))
+    def test_sync_send_message_logs_errors(self, mock_send):
+        with patch('bot.utils.get_sender', return_value=self.sender), self.assertLogs("bot.utils", "ERROR"):
+            send_message(123456789, "Привет")
+
+
+
+class TelegramRateLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        if hasattr(self, "limiter"):
+            await self.limiter.close()
+
+    async def test_high_priority_goes_first(self):
+        self.limiter = TelegramRateLimiter(global_rate=50)
+        self.limiter.global_bucket.tokens = 0  # все запросы встают в очередь
+        granted = []
+
+        async def wait(chat_id, priority):
+            await self.limiter.acquire(chat_id, priority)
+            granted.append(chat_id)
+
+        await asyncio.gather(
+            wait(1, PRIORITY_LOW), wait(2, PRIORITY_LOW), wait(3, PRIORITY_HIGH), wait(4, PRIORITY_NORMAL),
+        )
+        self.assertEqual(granted, [3, 4, 1, 2])
+        self.assertEqual(self.limiter.stats()["granted"], 4)
+
+    async def test_per_chat_limit(self):
+        self.limiter = TelegramRateLimiter(global_rate=1000, chat_rate=20, chat_burst=1)
+        started = monotonic()
+        for _ in range(3):
+            await self.limiter.acquire(123456789)
+        self.assertGreaterEqual(monotonic() - started, 0.09)
+        # Другой чат не ждёт, пока освободится первый
+        started = monotonic()
+        await self.limiter.acquire(987654321)
+        self.assertLess(monotonic() - started, 0.05)
+
+    async def test_retry_after_is_honoured(self):
+        self.limiter = TelegramRateLimiter(global_rate=1000)
+        method = SendMessage(chat_id=123456789, text="Привет")
+        make_request = AsyncMock(side_effect=[
+            TelegramRetryAfter(method=method, message="Flood control", retry_after=1), "ok",
+        ])
+        started = monotonic()
+        self.assertEqual(await self.limiter(make_request, Mock(), method), "ok")
+        self.assertGreaterEqual(monotonic() - started, 0.9)
+        self.assertEqual(make_request.call_count, 2)
+        self.assertEqual(self.limiter.stats()["retry_after"], 1)
+
+    async def test_long_retry_after_is_raised(self):
+        self.limiter = TelegramRateLimiter(global_rate=1000, max_retry_after=5)
+        method = SendMessage(chat_id=123456789, text="Привет")
+        make_request = AsyncMock(side_effect=TelegramRetryAfter(method=method, message="Flood control", retry_after=600))
+        with self.assertRaises(TelegramRetryAfter):
+            await self.limiter(make_request, Mock(), method)
+        make_request.assert_called_once()
+
+    async def test_requests_without_chat_are_not_limited(self):
+        self.limiter = TelegramRateLimiter(global_rate=1000)
+        self.limiter.global_bucket.tokens = 0
+        make_request = AsyncMock(return_value=[])
+        await self.limiter(make_request, Mock(), GetUpdates())
+        make_request.assert_called_once()
+        self.assertEqual(self.limiter.stats()["granted"], 0)
+
+
+class OutboxPriorityTest(TestCase):
+    @patch('aiogram.Bot.send_message', new_callable=AsyncMock)
+    def test_high_priority_claimed_first(self, mock_send):
+        enqueue_message(111, "Напоминание", priority=PRIORITY_LOW)
+        enqueue_message(222, "Заказ создан", priority=PRIORITY_HIGH)
+        dispatch_batch(batch_size=1)
+        mock_send.assert_called_once_with(chat_id=222, text="Заказ создан", reply_markup=None)
+        stats = outbox_stats()
+        self.assertEqual(stats["pending"], 1)
+        self.assertEqual(stats["pending_by_priority"]["Низкий"], 1)
+
+
+
+@patch('bot.reminders.get_schedule', return_value=Mock(is_open=Mock(return_value=True)))
+class ReminderSchedulerTest(TestCase):
+    def setUp(self):
+        self.auth_user = User.objects.create(username="reminderuser")
+        self.user = UserProfile.objects.get(user=self.auth_user)
+        self.user.telegram_id = 123456789
+        self.user.save()
+        self.moment = now()
+        self.remind = AsyncMock()
+        self.scheduler = ReminderScheduler(self.remind)
+
+    def create_order(self, hours_ago, status="awaiting_payment"):
+        order = Order.objects.create(user=self.user, status=status, total_price=1000.00)
+        Order.objects.filter(id=order.id).update(created_at=self.moment - timedelta(hours=hours_ago))
+        return order
+
+    async def test_load_schedules_unpaid_orders_by_due_time(self, mock_schedule):
+        overdue = await sync_to_async(self.create_order)(30)
+        fresh = await sync_to_async(self.create_order)(1)
+        await sync_to_async(self.create_order)(30, status="pending")
+        await self.scheduler.load_new()
+        self.assertEqual(len(self.scheduler), 2)
+        self.assertEqual(self.scheduler.pop_due(self.moment), [overdue.id])
+        self.assertAlmostEqual(self.scheduler.next_due(), self.moment + timedelta(hours=23), delta=timedelta(seconds=1))
+        self.assertEqual(self.scheduler.pop_due(self.moment + timedelta(hours=24)), [fresh.id])
+
+    @override_settings(PAYMENT_REMINDER_INTERVAL_HOURS=12, PAYMENT_REMINDER_MAX=2)
+    async def test_reminders_follow_cadence_and_cap(self, mock_schedule):
+        order = await sync_to_async(self.create_order)(30)
+        await self.scheduler.load_new()
+
+        self.assertEqual(await self.scheduler.process_due(self.moment), 1)
+        self.assertEqual(await self.scheduler.process_due(self.moment + timedelta(hours=11)), 0)
+        self.assertEqual(await self.scheduler.process_due(self.moment + timedelta(hours=12)), 1)
+        # Предел исчерпан — заказ снят с расписания
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertEqual(self.remind.call_count, 2)
+        numbers = await sync_to_async(list)(order.payment_reminders.values_list("number", flat=True))
+        self.assertEqual(sorted(numbers), [1, 2])
+
+    @override_settings(PAYMENT_REMINDER_INTERVAL_HOURS=12, PAYMENT_REMINDER_MAX=2)
+    async def test_ledger_survives_restart(self, mock_schedule):
+        order = await sync_to_async(self.create_order)(30)
+        await sync_to_async(PaymentReminder.objects.create)(order=order, number=1, sent_at=self.moment - timedelta(hours=2))
+        await self.scheduler.load_new()
+        self.assertAlmostEqual(self.scheduler.next_due(), self.moment + timedelta(hours=10), delta=timedelta(seconds=1))
+
+    async def test_paid_order_is_not_reminded(self, mock_schedule):
+        order = await sync_to_async(self.create_order)(30)
+        await self.scheduler.load_new()
+        await sync_to_async(Order.objects.filter(id=order.id).update)(status="pending")
+        self.assertEqual(await self.scheduler.process_due(self.moment), 0)
+        self.remind.assert_not_called()
+        self.assertEqual(len(self.scheduler), 0)
+
+    async def test_closed_shop_postpones_to_opening(self, mock_schedule):
+        opening = self.moment + timedelta(hours=8)
+        mock_schedule.return_value = Mock(is_open=Mock(return_value=False), next_opening=Mock(return_value=opening))
+        order = await sync_to_async(self.create_order)(30)
+        await self.scheduler.load_new()
+        self.assertEqual(await self.scheduler.process_due(self.moment), 0)
+        self.remind.assert_not_called()
+        self.assertFalse(await sync_to_async(order.payment_reminders.exists)())
+        self.assertEqual(self.scheduler.next_due(), opening)
+
+    async def test_failed_reminder_is_retried(self, mock_schedule):
+        self.remind.side_effect = ConnectionError("network down")
+        order = await sync_to_async(self.create_order)(30)
+        await self.scheduler.load_new()
+        self.assertEqual(await self.scheduler.process_due(self.moment), 0)
+        self.assertFalse(await sync_to_async(order.payment_reminders.exists)())
+        self.assertEqual(len(self.scheduler), 1)
+
+    async def test_run_sends_due_reminders(self, mock_schedule):
+        await sync_to_async(self.create_order)(30)
+        await sync_to_async(self.create_order)(1)
+        task = asyncio.ensure_future(self.scheduler.run())
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.remind.assert_called_once()
+
+    def test_signals_update_running_scheduler(self, mock_schedule):
+        self.scheduler._loop = Mock(is_closed=Mock(return_value=False))
+        with patch('bot.reminders._active_scheduler', self.scheduler):
+            with self.captureOnCommitCallbacks(execute=True):
+                order = Order.objects.create(user=self.user, status="awaiting_payment", total_price=1000.00)
+            self.scheduler._loop.call_soon_threadsafe.assert_called_once_with(
+                self.scheduler.schedule, order.id, order.created_at + Order.PAYMENT_TIMEOUT)
+            with self.captureOnCommitCallbacks(execute=True):
+                order.status = "pending"
+                order.save()
+            self.scheduler._loop.call_soon_threadsafe.assert_called_with(self.scheduler.schedule, order.id, None)
+
+
+
+class OrderCallbackTest(TestCase):
+    def setUp(self):
+        self.auth_user = User.objects.create(username="callbackuser")
+        self.user = UserProfile.objects.get(user=self.auth_user)
+        self.user.telegram_id = 123456789
+        self.user.save()
+        self.order = Order.objects.create(user=self.user, status="awaiting_payment", total_price=1500.00)
+        for name in ("Роза", "Тюльпан", "Пион"):
+            flower = Flower.objects.create(name=name, price=500.00, image="flowers/flower.jpg")
+            OrderItem.objects.create(order=self.order, flower=flower, quantity=1, price=500.00, subtotal=500.00)
+
+    def make_callback(self, data):
+        return Mock(data=data, id="42", message=Mock(chat=Mock(id=123456789), message_id=7))
+
+    def test_load_order_summary_queries(self):
+        """Заказ, позиции и цветы загружаются двумя запросами независимо от числа позиций."""
+        with self.assertNumQueries(2):
+            order, summary = async_to_sync(load_order_summary)(self.order.id)
+            self.assertEqual(order.user.telegram_id, 123456789)
+        for name in ("Роза", "Тюльпан", "Пион"):
+            self.assertIn(f"{name} x 1 - 500.00 руб.", summary)
+
+    @patch('bot.main.bot.answer_callback_query', new_callable=AsyncMock)
+    @patch('bot.main.bot.edit_message_text', new_callable=AsyncMock)
+    def test_cancel_order_callback(self, mock_edit, mock_answer):
+        with self.assertNumQueries(2):
+            async_to_sync(route_callback)(self.make_callback(f"oc:{self.order.id}"))
+        text = mock_edit.call_args[0][0]
+        self.assertIn("Вы уверены", text)
+        self.assertIn("Пион x 1", text)
+
+    @patch('bot.main.bot.answer_callback_query', new_callable=AsyncMock)
+    @patch('bot.main.bot.edit_message_text', new_callable=AsyncMock)
+    def test_cancel_no_callback(self, mock_edit, mock_answer):
+        with self.assertNumQueries(2):
+            async_to_sync(route_callback)(self.make_callback(f"on:{self.order.id}"))
+        self.assertIn("Роза x 1", mock_edit.call_args.kwargs["text"])
+        reply_markup = mock_edit.call_args.kwargs["reply_markup"]
+        self.assertEqual(reply_markup.inline_keyboard[0][0].callback_data, f"oc:{self.order.id}")
+
+    @patch('bot.main.bot.answer_callback_query', new_callable=AsyncMock)
+    @patch('bot.main.bot.edit_message_text', new_callable=AsyncMock)
+    async def test_confirm_cancel_callback(self, mock_edit, mock_answer):
+        await route_callback(self.make_callback(f"oy:{self.order.id}"))
+        await sync_to_async(self.order.refresh_from_db)()
+        self.assertEqual(self.order.status, "canceled")
+        self.assertIn("Тюльпан x 1", mock_edit.call_args[0][0])
+
+    @patch('bot.main.bot.answer_callback_query', new_callable=AsyncMock)
+    @patch('bot.main.bot.edit_message_text', new_callable=AsyncMock)
+    def test_legacy_callback_data(self, mock_edit, mock_answer):
+        """Кнопки из уже отправленных сообщений продолжают работать."""
+        async_to_sync(route_callback)(self.make_callback(f"cancel_order_{self.order.id}"))
+        keyboard = mock_edit.call_args.kwargs["reply_markup"].inline_keyboard
+        self.assertEqual([row[0].callback_data for row in keyboard], [f"oy:{self.order.id}", f"on:{self.order.id}"])
+
+    @patch('bot.main.bot.answer_callback_query', new_callable=AsyncMock)
+    @patch('bot.main.bot.edit_message_text', new_callable=AsyncMock)
+    def test_malformed_callback_data(self, mock_edit, mock_answer):
+        for data in ("oc:abc", "oc:1:2", "zz:1", "cancel_order_", "", None):
+            with self.subTest(data=data):
+                async_to_sync(route_callback)(self.make_callback(data))
+                mock_answer.assert_called_with("42", "Кнопка устарела.")
+        mock_edit.assert_not_called()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "awaiting_payment")
+
+
+class CallbackRouterTest(unittest.TestCase):
+    def test_payloads_fit_telegram_limit(self):
+        for factory in (CancelOrder, ConfirmCancel):
+            self.assertLessEqual(len(factory(order_id=2 ** 63 - 1).pack().encode()), 24)
+
+    def test_duplicate_prefix_rejected(self):
+        router = CallbackRouter()
+        router.route(CancelOrder)(AsyncMock())
+        with self.assertRaises(ValueError):
+            router.route(CancelOrder)(AsyncMock())
+
+    def test_resolve(self):
+        router = CallbackRouter()
+        handler = router.route(CancelOrder)(AsyncMock())
+        self.assertEqual(router.resolve("oc:15"), (handler, CancelOrder(order_id=15)))
+        self.assertEqual(router.resolve("cancel_order_15"), (handler, CancelOrder(order_id=15)))
+        self.assertIsNone(router.resolve("oy:15"))  # обработчик не зарегистрирован
+
+
+# Сценарии запускаются через asyncio.run, как в процессе бота: под async_to_sync тестового
+# раннера sync_to_async всегда уходит в родительский поток и ThreadSensitiveContext не действует
+class OwnDbThreadTest(SimpleTestCase):
+    def test_blocked_update_does_not_hold_others(self):
+        """Долгая синхронная работа одного обновления не задерживает ORM другого."""
+        started, release = threading.Event(), threading.Event()
+
+        async def slow():
+            async with own_db_thread():
+                await sync_to_async(lambda: (started.set(), release.wait(5)))()
+
+        async def fast():
+            async with own_db_thread():
+                return await sync_to_async(threading.get_ident)()
+
+        async def scenario():
+            task = asyncio.ensure_future(slow())
+            await asyncio.to_thread(started.wait, 5)
+            try:
+                return await asyncio.wait_for(fast(), 2)
+            finally:
+                release.set()
+                await task
+
+        self.assertNotEqual(asyncio.run(scenario()), threading.get_ident())
+
+    def test_asgiref_is_the_pinned_version(self):
+        """Пул опирается на внутренности asgiref: обновление зависимости требует перепроверки dbthreads."""
+        requirements = os.path.join(settings.BASE_DIR.parent, "requirements.txt")
+        with open(requirements, encoding="utf-16") as file:
+            self.assertIn(f"asgiref=={ASGIREF_VERSION}", file.read().split())
+        self.assertEqual(asgiref.__version__, ASGIREF_VERSION)
+
+    def test_pool_refuses_unsupported_asgiref(self):
+        with patch("asgiref.sync.SyncToAsync.context_to_thread_executor", None):
+            with self.assertRaises(ImproperlyConfigured):
+                DbThreadPool(2)
+            DbThreadPool(0)  # общий поток обходится без внутренностей asgiref
+
+    def test_pool_spreads_chats_over_reused_threads(self):
+        pool = DbThreadPool(2)
+        barrier = threading.Barrier(2, timeout=5)  # пройдут, только если полосы работают одновременно
+
+        async def update(chat_id, wait=False):
+            with pool.lane(chat_id):
+                if wait:
+                    await sync_to_async(barrier.wait)()
+                return await sync_to_async(threading.get_ident)()
+
+        async def scenario():
+            try:
+                first = await asyncio.gather(update(10, wait=True), update(11, wait=True))
+                again = await asyncio.gather(update(10), update(12))  # 12 — та же полоса, что у 10
+                return first, again
+            finally:
+                await pool.close()
+
+        (even, odd), (even_again, same_lane) = asyncio.run(scenario())
+        self.assertNotEqual(even, odd)
+        self.assertEqual(even, even_again)
+        self.assertEqual(even, same_lane)
+
+
+class TelegramProfileCacheTest(TestCase):
+    def setUp(self):
+        profile_cache.clear()
+        self.addCleanup(profile_cache.clear)
+        self.profile = UserProfile.objects.get(user=User.objects.create(username="cached"))
+        self.profile.full_name = "Из кэша"
+        self.profile.telegram_id = 777
+        self.profile.save()
+
+    def lookup(self, telegram_id, cache=profile_cache):
+        return async_to_sync(cache.aget)(telegram_id)
+
+    def test_repeat_lookups_skip_database(self):
+        with self.assertNumQueries(2):
+            for _ in range(3):
+                self.assertEqual(self.lookup(777).full_name, "Из кэша")
+                self.assertIsNone(self.lookup(778))  # неизвестный ID тоже кэшируется
+        stats = profile_cache.stats()
+        self.assertEqual((stats["hits"], stats["negative_hits"], stats["misses"]), (4, 2, 2))
+
+    def test_unlink_and_link_invalidate(self):
+        self.lookup(777)
+        self.lookup(778)
+        profile = UserProfile.objects.get(pk=self.profile.pk)
+        profile.telegram_id = 778  # перепривязка: сбрасываются и старый, и новый ID
+        profile.save()
+        self.assertIsNone(self.lookup(777))
+        self.assertEqual(self.lookup(778).pk, self.profile.pk)
+        profile.delete()
+        self.assertIsNone(self.lookup(778))
+
+    def test_ttl_and_size_bound(self):
+        cache = TelegramProfileCache(maxsize=2, ttl=60, negative_ttl=0)
+        self.lookup(777, cache)
+        self.lookup(1, cache)
+        with self.assertNumQueries(1):
+            self.lookup(1, cache)  # отрицательная запись уже истекла
+        with freeze_time(now() + timedelta(seconds=61)), self.assertNumQueries(1):
+            self.lookup(777, cache)
+        self.lookup(2, cache)
+        self.lookup(3, cache)
+        self.assertEqual(cache.stats()["size"], 2)
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+    def test_change_during_lookup_is_not_cached(self):
+        async def lookup_racing_unlink():
+            started, release = asyncio.Event(), asyncio.Event()
+
+            async def slow_lookup(telegram_id):
+                started.set()
+                await release.wait()
+                return self.profile
+
+            with patch.object(UserProfile, "aget_by_telegram_id", new=slow_lookup):
+                task = asyncio.ensure_future(profile_cache.aget(777))
+                await started.wait()
+                profile_cache.invalidate(777, profile_pk=self.profile.pk)
+                release.set()
+                return await task
+
+        async_to_sync(lookup_racing_unlink)()
+        self.assertEqual(profile_cache.stats()["size"], 0)
+
+
+class DispatcherUpdateTest(TransactionTestCase):
+    """Обновление проходит через dp: ORM работает в отдельном потоке со своим соединением."""
+
+    def setUp(self):
+        user = User.objects.create(username="dispatched")
+        self.profile = UserProfile.objects.get(user=user)
+        self.profile.full_name = "Через диспетчер"
+        self.profile.telegram_id = 555
+        self.profile.save()
+
+    @patch('bot.main.bot.send_message', new_callable=AsyncMock)
+    def test_start_command(self, mock_send_message):
+        update = types.Update.model_validate({
+            "update_id": 1,
+            "message": {
+                "message_id": 1, "date": 0, "text": "/start",
+                "chat": {"id": 555, "type": "private"},
+                "from": {"id": 555, "is_bot": False, "first_name": "Тест"},
+            },
+        }, context={"bot": main_bot})
+        asyncio.run(dp.feed_update(main_bot, update))
+        self.assertIn("Через диспетчер", mock_send_message.call_args[0][1])
+
+
+def start_update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": 1, "date": 0, "text": "/start",
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Тест"},
+        },
+    }
+
+
+async def post_updates(webhook, *requests):
+    """Локальный «Telegram»: отправляет (тело, секрет) на вебхук и возвращает коды ответов."""
+    client = TestClient(TestServer(webhook.create_app("/hook")))
+    await client.start_server()
+    try:
+        async def post(body, secret):
+            headers = {SECRET_HEADER: secret} if secret is not None else {}
+            response = await client.post("/hook", data=body, headers={"Content-Type": "application/json", **headers})
+            return response.status
+        return await asyncio.gather(*(post(body, secret) for body, secret in requests))
+    finally:
+        await client.close()  # дожидается обновлений, принятых в обработку
+
+
+class WebhookTest(TransactionTestCase):
+    def setUp(self):
+        profile_cache.clear()
+        profile = UserProfile.objects.get(user=User.objects.create(username="webhook"))
+        profile.full_name = "Через вебхук"
+        profile.telegram_id = 556
+        profile.save()
+
+    @patch('bot.main.bot.send_message', new_callable=AsyncMock)
+    def test_update_with_secret_is_handled(self, mock_send_message):
+        webhook = TelegramWebhook(dp, main_bot, "s3cret")
+        body = json.dumps(start_update(1, 556))
+        self.assertEqual(asyncio.run(post_updates(webhook, (body, "s3cret"))), [200])
+        self.assertIn("Через вебхук", mock_send_message.call_args[0][1])
+
+    @patch('bot.main.bot.send_message', new_callable=AsyncMock)
+    def test_rejected_requests(self, mock_send_message):
+        webhook = TelegramWebhook(dp, main_bot, "s3cret")
+        body = json.dumps(start_update(1, 556))
+        statuses = asyncio.run(post_updates(
+            webhook, (body, "wrong"), (body, None), ("не json", "s3cret"), ('{"message": 1}', "s3cret"),
+        ))
+        self.assertEqual(statuses, [401, 401, 400, 400])
+        mock_send_message.assert_not_called()
+
+
+class WebhookConcurrencyTest(SimpleTestCase):
+    def test_concurrency_is_bounded(self):
+        active, peak, handled = 0, 0, []
+
+        class SlowDispatcher:
+            async def feed_update(self, bot, update):
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.05)
+                active -= 1
+                handled.append(update.update_id)
+
+        webhook = TelegramWebhook(SlowDispatcher(), main_bot, "s3cret", concurrency=2)
+        requests = [(json.dumps(start_update(i, 1)), "s3cret") for i in range(6)]
+        self.assertEqual(asyncio.run(post_updates(webhook, *requests)), [200] * 6)
+        self.assertEqual(peak, 2)
+        self.assertEqual(sorted(handled), list(range(6)))
+
+    def test_handler_error_is_not_returned_to_telegram(self):
+        dispatcher = Mock(feed_update=AsyncMock(side_effect=RuntimeError("сбой")))
+        webhook = TelegramWebhook(dispatcher, main_bot, "s3cret", concurrency=1)
+        requests = [(json.dumps(start_update(i, 1)), "s3cret") for i in range(2)]
+        with self.assertLogs("bot.webhook", "ERROR"):
+            self.assertEqual(asyncio.run(post_updates(webhook, *requests)), [200, 200])
+        self.assertEqual(dispatcher.feed_update.await_count, 2)
+
+    @override_settings(BOT_WEBHOOK_SECRET=None)
+    def test_runbot_webhook_requires_secret(self):
+        with self.assertRaises(CommandError):
+            call_command("runbot", "--mode", "webhook")
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file
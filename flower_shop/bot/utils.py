@@ -1,15 +1,14 @@
-import asyncio
-from aiogram import Bot
-from bot.config import TOKEN
+import logging
+from bot.sender import get_sender
 
-async def send_telegram_message(chat_id, text, reply_markup=None):
-    bot = Bot(token=TOKEN)
-    try:
-        await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
-    except Exception as e:
-        print(f"Ошибка при отправке сообщения: {e}")
-    finally:
-        await bot.session.close()
+logger = logging.getLogger(__name__)
+
+# Сколько секунд синхронный вызов ждёт ответа Telegram
+SEND_TIMEOUT = 30
 
 def send_message(chat_id, text, reply_markup=None):
-    asyncio.run(send_telegram_message(chat_id, text, reply_markup))
\ No newline at end of file
+    """Отправка из синхронного кода через общий отправитель (одна сессия бота на процесс)."""
+    try:
+        get_sender().send_message(chat_id, text, reply_markup).result(SEND_TIMEOUT)
+    except Exception:
+        logger.exception("Ошибка при отправке сообщения в чат %s", chat_id)
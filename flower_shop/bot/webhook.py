@@ -0,0 +1,79 @@
+import asyncio
+import hmac
+import logging
+from aiogram import types
+from aiohttp import web
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для приёма обновлений через вебхук (команда runbot --mode webhook)
+WEBHOOK_DEFAULTS = {
+    "BOT_WEBHOOK_URL": None,  # внешний адрес сервиса, например https://shop.example.com; None — не регистрировать
+    "BOT_WEBHOOK_PATH": "/telegram/webhook",
+    "BOT_WEBHOOK_SECRET": None,  # secret_token из setWebhook: 1–256 символов A-Z, a-z, 0-9, _ и -
+    "BOT_WEBHOOK_CONCURRENCY": 16,  # сколько обновлений обрабатывается одновременно
+}
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_setting(name):
+    return getattr(settings, name, WEBHOOK_DEFAULTS[name])
+
+
+class TelegramWebhook:
+    """
+    Приём обновлений Telegram по HTTP.
+
+    Запрос без верного секрета (заголовок X-Telegram-Bot-Api-Secret-Token)
+    отклоняется с 401 до разбора тела. Принятое обновление обрабатывается в
+    фоне, а Telegram сразу получает 200, но одновременно обрабатывается не больше
+    concurrency обновлений: когда все места заняты, ответ ждёт свободного места,
+    и Telegram сам придерживает следующие обновления.
+    """
+
+    def __init__(self, dispatcher, bot, secret_token, concurrency=None):
+        if not secret_token:
+            raise ValueError("Для вебхука нужен секрет (BOT_WEBHOOK_SECRET)")
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.concurrency = concurrency or webhook_setting("BOT_WEBHOOK_CONCURRENCY")
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._tasks = set()
+
+    async def handle(self, request):
+        secret = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(secret.encode(), self.secret_token.encode()):
+            return web.Response(status=401)
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:  # не JSON или не обновление Telegram
+            return web.Response(status=400)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception:
+            # Ошибка обработчика не должна возвращать обновление: Telegram повторял бы его бесконечно
+            logger.exception("Ошибка при обработке обновления %s", update.update_id)
+        finally:
+            self._slots.release()
+
+    async def close(self, app=None):
+        """Дожидается обновлений, которые уже приняты."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def create_app(self, path=None):
+        """Приложение aiohttp с обработчиком вебхука по path (BOT_WEBHOOK_PATH)."""
+        app = web.Application()
+        app.router.add_post(path or webhook_setting("BOT_WEBHOOK_PATH"), self.handle)
+        app.on_shutdown.append(self.close)
+        return app
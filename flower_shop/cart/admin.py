@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WorkingHours
+from .models import WorkingHours, HolidayOverride
 # Register your models here.
 
 @admin.register(WorkingHours)
@@ -10,4 +10,10 @@ class WorkingHoursAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         """Возвращает queryset с сортировкой по day_order."""
         qs = super().get_queryset(request)
-        return qs.order_by("day_order")  # Сортировка по полю day_order
\ No newline at end of file
+        return qs.order_by("day_order")  # Сортировка по полю day_order
+
+@admin.register(HolidayOverride)
+class HolidayOverrideAdmin(admin.ModelAdmin):
+    list_display = ("date", "is_working", "opening_time", "closing_time", "note")
+    list_filter = ("is_working",)
+    date_hierarchy = "date"
@@ -0,0 +1,12 @@
+class CartCookieMiddleware:
+    """Сохраняет гостевую корзину в подписанную cookie, если за запрос она изменилась."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        cookie_cart = getattr(request, "_cart_cookie", None)
+        if cookie_cart is not None:
+            cookie_cart.write(response)
+        return response
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0006_cart_cartline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HolidayOverride',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Дата')),
+                ('is_working', models.BooleanField(default=False, verbose_name='Рабочий день')),
+                ('opening_time', models.TimeField(blank=True, null=True, verbose_name='Время открытия')),
+                ('closing_time', models.TimeField(blank=True, null=True, verbose_name='Время закрытия')),
+                ('note', models.CharField(blank=True, max_length=255, verbose_name='Комментарий')),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+    ]
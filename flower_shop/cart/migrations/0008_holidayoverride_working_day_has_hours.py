@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0007_holidayoverride'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='holidayoverride',
+            constraint=models.CheckConstraint(condition=models.Q(('is_working', False), models.Q(('closing_time__isnull', False), ('opening_time__isnull', False)), _connector='OR'), name='holidayoverride_working_day_has_hours', violation_error_message='Для рабочего дня укажите время открытия и закрытия.'),
+        ),
+    ]
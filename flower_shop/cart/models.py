@@ -1,4 +1,8 @@
-from django.db import models
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from catalog.models import Flower
 
 class WorkingHours(models.Model):
     DAY_CHOICES = [
@@ -31,4 +35,121 @@ class WorkingHours(models.Model):
             "sun": 6,
         }
         self.day_order = day_order_map.get(self.day, 0)
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class HolidayOverride(models.Model):
+    """Особый график на конкретную дату (праздник, сокращённый день), важнее недельного расписания."""
+    date = models.DateField(unique=True, verbose_name="Дата")
+    is_working = models.BooleanField(default=False, verbose_name="Рабочий день")
+    opening_time = models.TimeField(null=True, blank=True, verbose_name="Время открытия")
+    closing_time = models.TimeField(null=True, blank=True, verbose_name="Время закрытия")
+    note = models.CharField(max_length=255, blank=True, verbose_name="Комментарий")
+
+    class Meta:
+        ordering = ["date"]
+        constraints = [
+            # Рабочий день без времени уронил бы проверку расписания — запрещаем и в обход формы
+            models.CheckConstraint(
+                condition=models.Q(is_working=False) | models.Q(opening_time__isnull=False, closing_time__isnull=False),
+                name="holidayoverride_working_day_has_hours",
+                violation_error_message="Для рабочего дня укажите время открытия и закрытия.",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date:%d.%m.%Y} ({self.note or ('рабочий' if self.is_working else 'выходной')})"
+
+    def clean(self):
+        if self.is_working and (self.opening_time is None or self.closing_time is None):
+            raise ValidationError("Для рабочего дня укажите время открытия и закрытия.")
+
+class Cart(models.Model):
+    """Серверная корзина: у авторизованного пользователя — по user, у гостя — по ключу сессии."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name="cart", verbose_name="Пользователь")
+    session_key = models.CharField(max_length=40, unique=True, null=True, blank=True, verbose_name="Ключ сессии")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    def __str__(self):
+        return f"Корзина {self.user or self.session_key}"
+
+    def as_dict(self):
+        """Содержимое корзины в формате {str(flower_id): quantity}."""
+        return {str(flower_id): quantity for flower_id, quantity in self.lines.values_list("flower_id", "quantity")}
+
+    def add(self, flower_id, quantity=1):
+        """Атомарно увеличивает количество цветка. Возвращает новое количество или None, если цветка нет."""
+        lines = self.lines.filter(flower_id=flower_id)
+        if not lines.update(quantity=F("quantity") + quantity):
+            if not self._create_line(flower_id, quantity):
+                # Строку успел создать параллельный запрос — прибавляем к ней
+                if not lines.update(quantity=F("quantity") + quantity):
+                    return None
+        return lines.values_list("quantity", flat=True).first()
+
+    def set_quantity(self, flower_id, quantity):
+        """Устанавливает количество одним UPDATE; при quantity <= 0 удаляет строку."""
+        if quantity <= 0:
+            self.remove(flower_id)
+            return 0
+        lines = self.lines.filter(flower_id=flower_id)
+        if not lines.update(quantity=quantity):
+            if not self._create_line(flower_id, quantity) and not lines.update(quantity=quantity):
+                return 0
+        return quantity
+
+    def change(self, flower_id, delta):
+        """Атомарно меняет количество на delta; строка удаляется, если количество падает до нуля."""
+        if delta > 0:
+            return self.add(flower_id, delta) or 0
+        lines = self.lines.filter(flower_id=flower_id)
+        if delta == 0:
+            return lines.values_list("quantity", flat=True).first() or 0
+        if lines.filter(quantity__gt=-delta).update(quantity=F("quantity") + delta):
+            return lines.values_list("quantity", flat=True).first()
+        lines.delete()
+        return 0
+
+    def remove(self, *flower_ids):
+        self.lines.filter(flower_id__in=flower_ids).delete()
+
+    def clear(self):
+        self.lines.all().delete()
+
+    def merge_items(self, items):
+        """Прибавляет к корзине содержимое {flower_id: quantity}."""
+        with transaction.atomic():
+            for flower_id, quantity in items.items():
+                self.add(flower_id, quantity)
+
+    def merge_from(self, other):
+        """Переносит строки другой корзины (например, гостевой после входа) и удаляет её."""
+        with transaction.atomic():
+            self.merge_items(other.as_dict())
+            other.delete()
+
+    def _create_line(self, flower_id, quantity):
+        """Создаёт строку. False — если цветка нет в каталоге или строка уже существует."""
+        if not Flower.objects.filter(pk=flower_id).exists():
+            return False
+        try:
+            with transaction.atomic():
+                CartLine.objects.create(cart=self, flower_id=flower_id, quantity=quantity)
+        except IntegrityError:
+            return False
+        return True
+
+
+class CartLine(models.Model):
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="lines")
+    flower = models.ForeignKey(Flower, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "flower"], name="unique_cart_flower"),
+        ]
+
+    def __str__(self):
+        return f"{self.flower_id} x {self.quantity}"
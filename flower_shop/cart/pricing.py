@@ -0,0 +1,68 @@
+from catalog.models import Flower
+
+
+class PricedLine:
+    """Строка корзины: цветок, количество и подытог."""
+
+    __slots__ = ("flower", "quantity", "subtotal")
+
+    def __init__(self, flower, quantity):
+        self.flower = flower
+        self.quantity = quantity
+        self.subtotal = flower.price * quantity
+
+
+class PricedCart:
+    """Корзина с рассчитанными ценами: строки, подытоги и общая сумма."""
+
+    def __init__(self, lines, stale_ids=()):
+        self.lines = lines
+        self.stale_ids = list(stale_ids)
+        self.total_price = sum(line.subtotal for line in lines)
+        self._by_id = {line.flower.id: line for line in lines}
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def subtotal(self, flower_id):
+        """Подытог по цветку или 0, если его нет в корзине."""
+        line = self._by_id.get(int(flower_id))
+        return line.subtotal if line else 0
+
+
+def price_cart(cart):
+    """
+    Рассчитывает корзину {flower_id: quantity} одним запросом к каталогу.
+
+    Цветы, которых больше нет в каталоге, и строки с неположительным количеством
+    молча отбрасываются; их идентификаторы доступны в ``stale_ids``.
+    """
+    quantities = {}
+    stale_ids = []
+    for flower_id, quantity in cart.items():
+        try:
+            flower_id, quantity = int(flower_id), int(quantity)
+        except (TypeError, ValueError):
+            stale_ids.append(flower_id)
+            continue
+        if quantity > 0:
+            quantities[flower_id] = quantity
+        else:
+            stale_ids.append(flower_id)
+
+    flowers = Flower.objects.in_bulk(list(quantities)) if quantities else {}
+    lines = []
+    for flower_id, quantity in quantities.items():
+        flower = flowers.get(flower_id)
+        if flower is None:
+            stale_ids.append(flower_id)
+            continue
+        lines.append(PricedLine(flower, quantity))
+
+    return PricedCart(lines, stale_ids)
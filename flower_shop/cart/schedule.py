@@ -0,0 +1,139 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import WorkingHours, HolidayOverride
+
+# Насколько вперёд ищем ближайшее открытие (на случай длинных праздников)
+LOOKAHEAD_DAYS = 370
+# Сколько дней особого графика показываем в тексте расписания
+UPCOMING_OVERRIDE_DAYS = 14
+# Код дня -> номер дня недели (0 — понедельник), как у date.weekday(). Берётся из day,
+# а не из day_order: его заполняет только save(), у строк из bulk_create и loaddata там 0
+DAY_INDEX = {day: index for index, (day, _) in enumerate(WorkingHours.DAY_CHOICES)}
+
+
+class WeeklySchedule:
+    """
+    Скомпилированное расписание работы: недельный график и особые даты.
+
+    Отвечает на вопросы «открыто ли сейчас» и «когда ближайшее открытие»
+    без обращений к базе. Текст расписания для сообщений строится один раз.
+    """
+
+    def __init__(self, working_hours, overrides, today=None):
+        # номер дня недели -> (открытие, закрытие) только для рабочих дней
+        self.weekly = {
+            DAY_INDEX[wh.day]: (wh.opening_time, wh.closing_time)
+            for wh in working_hours if wh.is_working
+        }
+        # дата -> (открытие, закрытие) или None для выходного
+        self.overrides = {
+            override.date: (override.opening_time, override.closing_time) if override.is_working else None
+            for override in overrides
+        }
+        self.text = self._render(sorted(working_hours, key=lambda wh: DAY_INDEX[wh.day]), overrides,
+                                 today or timezone.localdate())
+
+    @staticmethod
+    def _render(working_hours, overrides, today):
+        lines = [
+            f"{wh.get_day_display()}: {wh.opening_time} - {wh.closing_time}"
+            for wh in working_hours if wh.is_working
+        ]
+        upcoming = [
+            override for override in overrides
+            if today <= override.date <= today + timedelta(days=UPCOMING_OVERRIDE_DAYS)
+        ]
+        if upcoming:
+            lines.append("\nОсобые дни:")
+            for override in upcoming:
+                hours = (f"{override.opening_time} - {override.closing_time}"
+                         if override.is_working else "выходной")
+                note = f" ({override.note})" if override.note else ""
+                lines.append(f"{override.date:%d.%m.%Y}: {hours}{note}")
+        return "\n".join(lines)
+
+    def hours_for(self, date):
+        """Часы работы на дату: (открытие, закрытие) или None, если магазин закрыт весь день."""
+        if date in self.overrides:
+            return self.overrides[date]
+        return self.weekly.get(date.weekday())
+
+    def is_open(self, moment=None):
+        """Открыт ли магазин в момент moment (по умолчанию — сейчас, по местному времени)."""
+        local_now = timezone.localtime(moment or timezone.now())
+        hours = self.hours_for(local_now.date())
+        if hours is None:
+            return False
+        opening_time, closing_time = hours
+        return opening_time <= local_now.time() <= closing_time
+
+    def next_opening(self, moment=None):
+        """Ближайший момент, когда магазин открыт: moment, если открыто сейчас, иначе время открытия."""
+        local_now = timezone.localtime(moment or timezone.now())
+        if self.is_open(local_now):
+            return local_now
+        for offset in range(LOOKAHEAD_DAYS):
+            date = local_now.date() + timedelta(days=offset)
+            hours = self.hours_for(date)
+            if hours is None:
+                continue
+            opening = timezone.make_aware(datetime.combine(date, hours[0]), local_now.tzinfo)
+            if opening > local_now:
+                return opening
+        return None
+
+
+_lock = threading.Lock()
+_schedule = None
+_compiled_at = 0.0
+
+
+def compile_schedule():
+    """Строит расписание из базы (два запроса)."""
+    today = timezone.localdate()
+    return WeeklySchedule(
+        list(WorkingHours.objects.all()),
+        list(HolidayOverride.objects.filter(date__gte=today - timedelta(days=1))),
+        today=today,
+    )
+
+
+def get_schedule():
+    """
+    Возвращает расписание, закэшированное в памяти процесса.
+
+    Кэш сбрасывается сигналами при изменении WorkingHours/HolidayOverride, а также
+    по истечении WORKING_HOURS_CACHE_TTL — на случай правок из другого процесса
+    и чтобы особые даты в тексте расписания не устаревали.
+    """
+    global _schedule, _compiled_at
+    ttl = getattr(settings, "WORKING_HOURS_CACHE_TTL", 300)
+    schedule = _schedule
+    if schedule is not None and time.monotonic() - _compiled_at < ttl:
+        return schedule
+    with _lock:
+        if _schedule is None or time.monotonic() - _compiled_at >= ttl:
+            _schedule = compile_schedule()
+            _compiled_at = time.monotonic()
+        return _schedule
+
+
+@receiver([post_save, post_delete], sender=WorkingHours)
+@receiver([post_save, post_delete], sender=HolidayOverride)
+def invalidate_schedule(sender=None, **kwargs):
+    """Сбрасывает закэшированное расписание при изменении рабочего времени."""
+    _reset()
+    # Повторно после коммита: параллельный запрос мог успеть скомпилировать старые данные
+    transaction.on_commit(_reset)
+
+
+def _reset():
+    global _schedule
+    with _lock:
+        _schedule = None
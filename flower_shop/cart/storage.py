@@ -0,0 +1,213 @@
+from django.conf import settings
+from django.contrib.auth import login
+from django.core import signing
+from catalog.models import Flower
+from .models import Cart, CartLine
+
+CART_COOKIE_SALT = "cart.storage.CookieCart"
+
+# Значения по умолчанию для настроек гостевой cookie-корзины
+CART_COOKIE_DEFAULTS = {
+    "CART_COOKIE_NAME": "cart",
+    "CART_COOKIE_AGE": 60 * 60 * 24 * 30,
+    "CART_COOKIE_MAX_LINES": 50,
+    "CART_COOKIE_MAX_QUANTITY": 999,
+}
+
+
+def _cookie_setting(name):
+    return getattr(settings, name, CART_COOKIE_DEFAULTS[name])
+
+
+class DatabaseCart:
+    """
+    Корзина текущего запроса, хранящаяся в таблицах Cart/CartLine.
+
+    Строка Cart создаётся лениво — только при первом изменении, поэтому
+    просмотр каталога гостем не создаёт записей в базе.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self._cart = None
+
+    def _lookup(self):
+        user = self.request.user
+        if user.is_authenticated:
+            return {"user": user}
+        session_key = self.request.session.session_key
+        return {"session_key": session_key} if session_key else None
+
+    def _get_or_create(self):
+        if self._cart is None:
+            lookup = self._lookup()
+            if lookup is None:
+                # У гостя ещё нет сессии — создаём её, чтобы привязать корзину
+                self.request.session.save()
+                self.request.session.modified = True
+                lookup = {"session_key": self.request.session.session_key}
+            self._cart, created = Cart.objects.get_or_create(**lookup)
+        return self._cart
+
+    def items(self):
+        """Содержимое корзины в формате {str(flower_id): quantity}."""
+        if self._cart is not None:
+            return self._cart.as_dict()
+        lookup = self._lookup()
+        if lookup is None:
+            return {}
+        lines = CartLine.objects.filter(**{f"cart__{key}": value for key, value in lookup.items()})
+        return {str(flower_id): quantity for flower_id, quantity in lines.values_list("flower_id", "quantity")}
+
+    def add(self, flower_id, quantity=1):
+        return self._get_or_create().add(flower_id, quantity)
+
+    def update(self, flower_id, quantity):
+        return self._get_or_create().set_quantity(flower_id, quantity)
+
+    def change(self, flower_id, delta):
+        return self._get_or_create().change(flower_id, delta)
+
+    def remove(self, *flower_ids):
+        if flower_ids and self._lookup() is not None:
+            self._get_or_create().remove(*flower_ids)
+
+    def clear(self):
+        if self._lookup() is not None:
+            self._get_or_create().clear()
+
+
+class CookieCart:
+    """
+    Корзина гостя в подписанной cookie (включается настройкой CART_COOKIE_ENABLED).
+
+    Содержимое кодируется компактно — «id:количество» через точку — и ограничено
+    CART_COOKIE_MAX_LINES строками, поэтому cookie остаётся в пределах нескольких сотен
+    байт. До входа или оформления заказа корзина не пишет в базу ни сессию, ни строки
+    корзины; cookie выставляет CartCookieMiddleware, если корзина изменилась.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.modified = False
+        self._items = self._load()
+
+    def _load(self):
+        try:
+            raw = self.request.get_signed_cookie(
+                _cookie_setting("CART_COOKIE_NAME"),
+                default="",
+                salt=CART_COOKIE_SALT,
+                max_age=_cookie_setting("CART_COOKIE_AGE"),
+            )
+        except signing.BadSignature:
+            raw = ""
+        items = {}
+        for chunk in raw.split(".") if raw else ():
+            flower_id, _, quantity = chunk.partition(":")
+            if flower_id.isdigit() and quantity.isdigit() and int(quantity) > 0:
+                items[flower_id] = int(quantity)
+        return items
+
+    def _encode(self):
+        return ".".join(f"{flower_id}:{quantity}" for flower_id, quantity in self._items.items())
+
+    def items(self):
+        """Содержимое корзины в формате {str(flower_id): quantity}."""
+        return dict(self._items)
+
+    def add(self, flower_id, quantity=1):
+        key = str(flower_id)
+        if key not in self._items:
+            if len(self._items) >= _cookie_setting("CART_COOKIE_MAX_LINES"):
+                return None
+            if not Flower.objects.filter(pk=flower_id).exists():
+                return None
+        self._items[key] = min(self._items.get(key, 0) + quantity, _cookie_setting("CART_COOKIE_MAX_QUANTITY"))
+        self.modified = True
+        return self._items[key]
+
+    def update(self, flower_id, quantity):
+        key = str(flower_id)
+        if quantity <= 0:
+            self.remove(flower_id)
+            return 0
+        if key not in self._items:
+            return self.add(flower_id, quantity) or 0
+        self._items[key] = min(quantity, _cookie_setting("CART_COOKIE_MAX_QUANTITY"))
+        self.modified = True
+        return self._items[key]
+
+    def change(self, flower_id, delta):
+        if delta > 0:
+            return self.add(flower_id, delta) or 0
+        return self.update(flower_id, self._items.get(str(flower_id), 0) + delta)
+
+    def remove(self, *flower_ids):
+        for flower_id in flower_ids:
+            if self._items.pop(str(flower_id), None) is not None:
+                self.modified = True
+
+    def clear(self):
+        if self._items:
+            self._items = {}
+            self.modified = True
+
+    def write(self, response):
+        """Записывает изменённую корзину в cookie ответа (или удаляет пустую)."""
+        if not self.modified:
+            return
+        name = _cookie_setting("CART_COOKIE_NAME")
+        if not self._items:
+            response.delete_cookie(name, samesite="Lax")
+            return
+        response.set_signed_cookie(
+            name,
+            self._encode(),
+            salt=CART_COOKIE_SALT,
+            max_age=_cookie_setting("CART_COOKIE_AGE"),
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite="Lax",
+        )
+
+
+def _use_cookie_cart(request):
+    return getattr(settings, "CART_COOKIE_ENABLED", False) and not request.user.is_authenticated
+
+
+def get_cart(request):
+    """Возвращает корзину текущего запроса (один объект на запрос)."""
+    if not hasattr(request, "_cart"):
+        if _use_cookie_cart(request):
+            request._cart = request._cart_cookie = CookieCart(request)
+        else:
+            request._cart = DatabaseCart(request)
+    return request._cart
+
+
+def merge_anonymous_cart(session_key, user):
+    """Переносит гостевую корзину в корзину пользователя."""
+    if not session_key:
+        return
+    anonymous_cart = Cart.objects.filter(session_key=session_key, user__isnull=True).first()
+    if anonymous_cart is None:
+        return
+    user_cart, created = Cart.objects.get_or_create(user=user)
+    user_cart.merge_from(anonymous_cart)
+
+
+def login_with_cart(request, user):
+    """Выполняет вход и сохраняет гостевую корзину (login() меняет ключ сессии)."""
+    cookie_cart = get_cart(request) if _use_cookie_cart(request) else None
+    session_key = request.session.session_key
+    login(request, user)
+    if cookie_cart is not None:
+        items = cookie_cart.items()
+        if items:
+            user_cart, created = Cart.objects.get_or_create(user=user)
+            user_cart.merge_items(items)
+            cookie_cart.clear()
+    else:
+        merge_anonymous_cart(session_key, user)
+    request.__dict__.pop("_cart", None)
@@ -1,13 +1,23 @@
 from django.core.files.uploadedfile import SimpleUploadedFile
-from datetime import time  # Импортируем time из модуля datetime
-from django.test import TestCase, Client
+from datetime import datetime, time, timedelta  # Импортируем time из модуля datetime
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.db import IntegrityError, connection, transaction
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
 from catalog.models import Flower
 from orders.models import Order, OrderItem
 from users.models import UserProfile
-from .models import WorkingHours
+from bot.models import OutboundMessage
+from bot.outbox import render
+from django.utils import timezone
+from .models import WorkingHours, HolidayOverride, Cart, CartLine
+from .schedule import get_schedule, invalidate_schedule
+from .views import is_working_hours
+from .pricing import price_cart
 import json
+import threading
+from unittest.mock import patch
 
 class WorkingHoursModelTest(TestCase):
     def setUp(self):
@@ -30,6 +40,84 @@ class WorkingHoursModelTest(TestCase):
         """Тест метода save для установки порядка дней недели."""
         self.assertEqual(self.working_hours.day_order, 0)  # Понедельник должен иметь порядок 0
 
+class WorkingScheduleTest(TestCase):
+    def setUp(self):
+        invalidate_schedule()
+        self.addCleanup(invalidate_schedule)
+        for day in ("mon", "tue", "wed", "thu", "fri"):
+            WorkingHours.objects.create(day=day, opening_time=time(9, 0), closing_time=time(18, 0), is_working=True)
+        WorkingHours.objects.create(day="sat", opening_time=time(10, 0), closing_time=time(16, 0), is_working=False)
+
+    def local(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def test_is_open_without_queries(self):
+        """После компиляции расписание отвечает без обращений к базе."""
+        get_schedule()
+        with self.assertNumQueries(0):
+            schedule = get_schedule()
+            self.assertTrue(schedule.is_open(self.local(2025, 3, 3, 12, 0)))  # понедельник
+            self.assertFalse(schedule.is_open(self.local(2025, 3, 3, 19, 0)))
+            self.assertFalse(schedule.is_open(self.local(2025, 3, 8, 12, 0)))  # суббота, выходной
+            is_working_hours()
+
+    def test_next_opening(self):
+        """Ближайшее открытие пропускает выходные."""
+        schedule = get_schedule()
+        self.assertEqual(schedule.next_opening(self.local(2025, 3, 7, 19, 0)), self.local(2025, 3, 10, 9, 0))
+        self.assertEqual(schedule.next_opening(self.local(2025, 3, 3, 8, 0)), self.local(2025, 3, 3, 9, 0))
+        moment = self.local(2025, 3, 3, 12, 0)
+        self.assertEqual(schedule.next_opening(moment), moment)
+
+    def test_signals_invalidate_schedule(self):
+        """Изменение рабочего времени сразу видно без перезапуска."""
+        self.assertFalse(get_schedule().is_open(self.local(2025, 3, 9, 12, 0)))  # воскресенье
+        WorkingHours.objects.create(day="sun", opening_time=time(11, 0), closing_time=time(15, 0), is_working=True)
+        self.assertTrue(get_schedule().is_open(self.local(2025, 3, 9, 12, 0)))
+        WorkingHours.objects.filter(day="sun").first().delete()
+        self.assertFalse(get_schedule().is_open(self.local(2025, 3, 9, 12, 0)))
+
+    def test_holiday_overrides(self):
+        """Особые даты важнее недельного графика."""
+        today = timezone.localdate()
+        monday = today + timedelta(days=7 - today.weekday())
+        saturday = monday - timedelta(days=2)
+        HolidayOverride.objects.create(date=monday, is_working=False, note="Праздник")
+        HolidayOverride.objects.create(date=saturday, is_working=True,
+                                       opening_time=time(8, 0), closing_time=time(20, 0))
+        schedule = get_schedule()
+        self.assertFalse(schedule.is_open(self.local(monday.year, monday.month, monday.day, 12, 0)))
+        self.assertTrue(schedule.is_open(self.local(saturday.year, saturday.month, saturday.day, 19, 0)))
+        self.assertEqual(
+            schedule.next_opening(self.local(saturday.year, saturday.month, saturday.day, 21, 0)),
+            timezone.make_aware(datetime.combine(monday + timedelta(days=1), time(9, 0))),
+        )
+        self.assertIn("Праздник", schedule.text)
+
+    def test_rows_without_day_order(self):
+        """Строки, сохранённые в обход save() (bulk_create, loaddata), попадают на свой день."""
+        WorkingHours.objects.filter(day="sat").delete()
+        WorkingHours.objects.bulk_create([
+            WorkingHours(day="sat", opening_time=time(10, 0), closing_time=time(16, 0), is_working=True),
+        ])
+        self.assertEqual(WorkingHours.objects.get(day="sat").day_order, 0)
+        schedule = get_schedule()
+        self.assertTrue(schedule.is_open(self.local(2025, 3, 8, 12, 0)))  # суббота
+        self.assertTrue(schedule.is_open(self.local(2025, 3, 3, 17, 0)))  # понедельник не перезаписан
+        self.assertTrue(schedule.text.startswith("Понедельник"))
+
+    def test_working_override_requires_hours(self):
+        """Рабочий день без времени не сохраняется и в обход формы."""
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            HolidayOverride.objects.create(date=timezone.localdate(), is_working=True)
+
+    def test_schedule_text(self):
+        """Текст расписания строится заранее и упорядочен по дням недели."""
+        text = get_schedule().text
+        self.assertTrue(text.startswith("Понедельник: 09:00:00 - 18:00:00"))
+        self.assertNotIn("Суббота", text)
+
+
 class CartViewsTest(TestCase):
     def setUp(self):
         # Создаем клиент для тестирования
@@ -120,14 +208,12 @@ class CartViewsTest(TestCase):
         login_success = self.client.login(username="testuser", password="testpass123")
         self.assertTrue(login_success, "Failed to log in user")
 
-        # Добавляем товар в корзину через прямую модификацию сессии
-        session = self.client.session
-        session["cart"] = {str(self.flower.id): 1}
-        session.save()
+        # Добавляем товар в корзину пользователя
+        cart = Cart.objects.create(user=self.user)
+        cart.add(self.flower.id)
 
         # Убедимся, что корзина не пуста
-        cart = self.client.session.get("cart", {})
-        self.assertTrue(cart)
+        self.assertTrue(cart.as_dict())
 
         # Оформляем заказ
         url = reverse("checkout")
@@ -153,6 +239,308 @@ class CartViewsTest(TestCase):
         self.assertEqual(order_items[0].quantity, 1)
 
         # Проверяем, что корзина очищена
-        cart = self.client.session.get("cart", {})
-        self.assertFalse(cart)
+        self.assertFalse(cart.as_dict())
+
+class CartPricingTest(TestCase):
+    def setUp(self):
+        self.flowers = [
+            Flower.objects.create(name=f"Цветок {i}", price=100 + i, image="flowers/test.jpg")
+            for i in range(30)
+        ]
+
+    def test_price_cart_single_query(self):
+        """Вся корзина рассчитывается одним запросом к каталогу."""
+        cart = {str(flower.id): 2 for flower in self.flowers}
+        with self.assertNumQueries(1):
+            priced = price_cart(cart)
+        self.assertEqual(len(priced), 30)
+        self.assertEqual(priced.total_price, sum((100 + i) * 2 for i in range(30)))
+        self.assertEqual(priced.subtotal(self.flowers[0].id), 200)
+
+    def test_price_cart_drops_stale_ids(self):
+        """Удалённые из каталога цветы молча отбрасываются."""
+        priced = price_cart({str(self.flowers[0].id): 1, "999999": 3, "abc": 1})
+        self.assertEqual(len(priced), 1)
+        self.assertEqual(priced.total_price, 100)
+        self.assertCountEqual(priced.stale_ids, [999999, "abc"])
+        self.assertEqual(priced.subtotal(999999), 0)
+
+    def test_view_cart_ignores_deleted_flowers(self):
+        """Страница корзины не отдаёт 404 из-за удалённого из каталога цветка."""
+        for flower in self.flowers[:2]:
+            self.client.post(reverse("add_to_cart", args=[flower.id]))
+        self.flowers[1].delete()
+        response = self.client.get(reverse("view_cart"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["total_price"], 100)
+
+    def test_update_cart_query_count_is_flat(self):
+        """Число запросов при изменении количества не зависит от размера корзины."""
+        user = User.objects.create_user(username="buyer", password="testpass123")
+        cart = Cart.objects.create(user=user)
+        for flower in self.flowers:
+            cart.add(flower.id)
+        self.client.login(username="buyer", password="testpass123")
+        url = reverse("update_cart", args=[self.flowers[0].id, 3])
+        with self.assertNumQueries(9):
+            response = self.client.post(url)
+        self.assertEqual(response.json()["subtotal"], "300.00")
+
+
+class CartModelTest(TestCase):
+    def setUp(self):
+        self.flower = Flower.objects.create(name="Роза", price=500.00, image="flowers/test.jpg")
+        self.user = User.objects.create_user(username="testuser", password="testpass123")
+        self.cart = Cart.objects.create(user=self.user)
+
+    def test_add_is_single_update(self):
+        """Повторное добавление — один UPDATE с F() и чтение нового количества."""
+        self.cart.add(self.flower.id)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.cart.add(self.flower.id, 2), 3)
+
+    def test_add_unknown_flower(self):
+        """Несуществующий цветок не попадает в корзину."""
+        self.assertIsNone(self.cart.add(999999))
+        self.assertEqual(self.cart.as_dict(), {})
+
+    def test_set_quantity(self):
+        """Установка количества и удаление строки при нуле."""
+        self.assertEqual(self.cart.set_quantity(self.flower.id, 4), 4)
+        self.assertEqual(self.cart.as_dict(), {str(self.flower.id): 4})
+        self.assertEqual(self.cart.set_quantity(self.flower.id, 0), 0)
+        self.assertEqual(self.cart.as_dict(), {})
+
+    def test_merge_on_login(self):
+        """Гостевая корзина переносится в корзину пользователя при входе."""
+        self.cart.add(self.flower.id, 2)
+        self.client.post(reverse("add_to_cart", args=[self.flower.id]))
+        session_key = self.client.session.session_key
+        self.assertTrue(Cart.objects.filter(session_key=session_key).exists())
+
+        response = self.client.post(reverse("login"), {"username": "testuser", "password": "testpass123"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.cart.as_dict(), {str(self.flower.id): 3})
+        self.assertFalse(Cart.objects.filter(session_key=session_key).exists())
+
+    def test_anonymous_catalog_does_not_create_cart(self):
+        """Просмотр каталога гостем не создаёт ни корзину, ни сессию."""
+        self.client.get(reverse("flower_list"))
+        self.assertEqual(Cart.objects.filter(user__isnull=True).count(), 0)
+        self.assertFalse(Session.objects.exists())
+
+
+@override_settings(CART_COOKIE_ENABLED=True)
+class CookieCartTest(TestCase):
+    def setUp(self):
+        self.flower = Flower.objects.create(name="Роза", price=500.00, image="flowers/test.jpg")
+        self.tulip = Flower.objects.create(name="Тюльпан", price=300.00, image="flowers/test.jpg")
+        self.user = User.objects.create_user(username="testuser", password="testpass123")
+
+    def test_anonymous_cart_writes_nothing_to_db(self):
+        """Гостевая корзина живёт в cookie: ни сессии, ни строк корзины в БД."""
+        self.client.post(reverse("add_to_cart", args=[self.flower.id]))
+        response = self.client.post(reverse("update_cart", args=[self.flower.id, 3]))
+        self.assertEqual(response.json()["total_price"], "1500.00")
+        self.assertIn("cart", response.cookies)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+
+        response = self.client.get(reverse("flower_list"))
+        self.assertEqual(response.context["cart"], {str(self.flower.id): 3})
+        self.assertIn(f'<span id="cart-qty-{self.flower.id}">3</span>', response.content.decode())
+
+    def test_tampered_cookie_is_ignored(self):
+        """Подделанная cookie даёт пустую корзину."""
+        self.client.cookies["cart"] = f"{self.flower.id}:100"
+        response = self.client.get(reverse("view_cart"))
+        self.assertEqual(response.context["total_price"], 0)
+
+    @override_settings(CART_COOKIE_MAX_LINES=1)
+    def test_cookie_size_is_bounded(self):
+        """Число строк в cookie ограничено настройкой."""
+        self.client.post(reverse("add_to_cart", args=[self.flower.id]))
+        response = self.client.post(reverse("add_to_cart", args=[self.tulip.id]))
+        self.assertFalse(response.json()["success"])
+        response = self.client.get(reverse("view_cart"))
+        self.assertEqual(len(response.context["flowers"]), 1)
+
+    def test_login_merges_cookie_cart(self):
+        """При входе cookie-корзина переносится в корзину пользователя, cookie удаляется."""
+        Cart.objects.create(user=self.user).add(self.flower.id)
+        self.client.post(reverse("add_to_cart", args=[self.flower.id]))
+        self.client.post(reverse("add_to_cart", args=[self.tulip.id]))
+
+        response = self.client.post(reverse("login"), {"username": "testuser", "password": "testpass123"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies["cart"].value, "")
+        self.assertEqual(
+            Cart.objects.get(user=self.user).as_dict(),
+            {str(self.flower.id): 2, str(self.tulip.id): 1},
+        )
+
+
+class CartBatchUpdateTest(TestCase):
+    def setUp(self):
+        self.rose = Flower.objects.create(name="Роза", price=500.00, image="flowers/test.jpg")
+        self.tulip = Flower.objects.create(name="Тюльпан", price=300.00, image="flowers/test.jpg")
+        self.user = User.objects.create_user(username="testuser", password="testpass123")
+        self.client.login(username="testuser", password="testpass123")
+        self.cart = Cart.objects.create(user=self.user)
+        self.cart.add(self.rose.id, 2)
+        self.url = reverse("batch_update_cart")
+
+    def post(self, operations):
+        return self.client.post(self.url, json.dumps({"operations": operations}), content_type="application/json")
+
+    def test_batch_applies_all_operations(self):
+        """Несколько изменений применяются одним запросом, в ответе изменённые строки и итог."""
+        response = self.post([
+            {"flower_id": self.rose.id, "delta": 3},
+            {"flower_id": self.rose.id, "delta": -1},
+            {"flower_id": self.tulip.id, "quantity": 2},
+        ])
+        data = response.json()
+        self.assertTrue(data["success"])
+        self.assertEqual(data["lines"], [
+            {"flower_id": self.rose.id, "quantity": 4, "subtotal": "2000.00"},
+            {"flower_id": self.tulip.id, "quantity": 2, "subtotal": "600.00"},
+        ])
+        self.assertEqual(data["total_price"], "2600.00")
+        self.assertEqual(self.cart.as_dict(), {str(self.rose.id): 4, str(self.tulip.id): 2})
+
+    def test_batch_removes_lines_at_zero(self):
+        """Отрицательная дельта ниже нуля удаляет строку."""
+        data = self.post([{"flower_id": self.rose.id, "delta": -5}]).json()
+        self.assertEqual(data["lines"], [{"flower_id": self.rose.id, "quantity": 0, "subtotal": 0}])
+        self.assertEqual(data["line_count"], 0)
+        self.assertEqual(data["total_price"], 0)
+        self.assertEqual(self.cart.as_dict(), {})
+
+    def test_batch_rejects_malformed_payload(self):
+        """Некорректная операция отклоняет весь пакет, корзина не меняется."""
+        for operations in (
+            [{"flower_id": self.rose.id, "delta": 1}, {"flower_id": "x", "delta": 1}],
+            [{"flower_id": self.rose.id, "delta": 1, "quantity": 1}],
+            [{"flower_id": self.rose.id, "quantity": -1}],
+            [{"flower_id": self.rose.id, "quantity": 10 ** 20}],
+            [{"flower_id": self.rose.id, "delta": -10 ** 20}],
+            [{"flower_id": 10 ** 20, "delta": 1}],
+            [],
+            "oops",
+        ):
+            response = self.post(operations)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.cart.as_dict(), {str(self.rose.id): 2})
+
+    @override_settings(CART_COOKIE_ENABLED=True)
+    def test_batch_with_cookie_cart(self):
+        """Пакетное изменение работает и для cookie-корзины гостя."""
+        self.client.logout()
+        data = self.post([{"flower_id": self.tulip.id, "delta": 2}, {"flower_id": self.tulip.id, "delta": -1}]).json()
+        self.assertEqual(data["lines"], [{"flower_id": self.tulip.id, "quantity": 1, "subtotal": "300.00"}])
+
+
+class CheckoutPipelineTest(TestCase):
+    def setUp(self):
+        self.flower = Flower.objects.create(name="Роза", price=500.00, image="flowers/test.jpg")
+        self.user = User.objects.create_user(username="testuser", password="testpass123")
+        self.profile = UserProfile.objects.get(user=self.user)
+        self.profile.phone = "+79991234567"
+        self.profile.telegram_id = 123456789
+        self.profile.save()
+        self.cart = Cart.objects.create(user=self.user)
+        self.cart.add(self.flower.id, 2)
+        self.client.login(username="testuser", password="testpass123")
+
+    def checkout(self, key="key-1"):
+        return self.client.post(reverse("checkout"), {"address": "ул. Ленина, 10", "idempotency_key": key},
+                                HTTP_X_TEST="true")
+
+    def test_retry_returns_first_order(self):
+        """Повтор с тем же ключом возвращает первый заказ, а не создаёт дубликат."""
+        first = self.checkout().json()
+        self.cart.add(self.flower.id)  # корзина снова не пуста, но ключ тот же
+        second = self.checkout().json()
+        self.assertTrue(second["success"])
+        self.assertEqual(first["order_id"], second["order_id"])
+        self.assertEqual(Order.objects.filter(user=self.profile).count(), 1)
+
+    def test_different_keys_create_orders(self):
+        """Разные ключи — разные заказы."""
+        self.checkout("key-1")
+        self.cart.add(self.flower.id)
+        self.checkout("key-2")
+        self.assertEqual(Order.objects.filter(user=self.profile).count(), 2)
+
+    def test_failure_rolls_back_everything(self):
+        """Ошибка при сохранении позиций откатывает заказ и не трогает корзину."""
+        with patch("orders.models.OrderItem.objects.bulk_create", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.cart.as_dict(), {str(self.flower.id): 2})
+
+    def test_order_notification_queued_with_order(self):
+        """Уведомление о заказе ставится в очередь вместе с заказом и при отправке содержит позиции."""
+        self.checkout()
+        order = Order.objects.get(user=self.profile)
+        message = OutboundMessage.objects.get(order=order)
+        self.assertEqual(message.chat_id, self.profile.telegram_id)
+        text, reply_markup = render(message)
+        self.assertIn("Роза x 2 - 1000.00 руб.", text)
+        self.assertEqual(reply_markup.inline_keyboard[0][0].callback_data, f"oc:{order.id}")
+
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    def setUp(self):
+        self.flower = Flower.objects.create(name="Роза", price=500.00, image="flowers/test.jpg")
+        self.user = User.objects.create_user(username="testuser", password="testpass123")
+        profile = UserProfile.objects.get(user=self.user)
+        profile.phone = "+79991234567"
+        profile.save()
+        Cart.objects.create(user=self.user).add(self.flower.id, 2)
+
+    def submit_in_parallel(self, keys):
+        barrier = threading.Barrier(len(keys))
+        results = []
+
+        def submit(key):
+            client = Client()
+            client.force_login(self.user)
+            barrier.wait()
+            try:
+                response = client.post(reverse("checkout"), {"address": "ул. Ленина, 10", "idempotency_key": key},
+                                       HTTP_X_TEST="true")
+                results.append(response.json())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(key,)) for key in keys]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_parallel_double_submit_creates_one_order(self):
+        """Параллельные отправки формы с одним ключом создают ровно один заказ."""
+        threads_count = 6
+        results = self.submit_in_parallel(["same"] * threads_count)
+
+        self.assertEqual(Order.objects.count(), 1)
+        order = Order.objects.get()
+        self.assertEqual(order.items.count(), 1)
+        # Каждый запрос получил успешный ответ с одним и тем же заказом
+        self.assertEqual(len(results), threads_count)
+        self.assertTrue(all(result["success"] for result in results))
+        self.assertEqual({result["order_id"] for result in results}, {order.id})
+        self.assertFalse(CartLine.objects.exists())
 
+    def test_parallel_submits_with_different_keys_order_cart_once(self):
+        """Две вкладки с разными ключами: корзину оформляет одна, вторая видит пустую корзину."""
+        results = self.submit_in_parallel([f"tab-{i}" for i in range(4)])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(sorted(result["success"] for result in results), [False, False, False, True])
+        self.assertEqual(Order.objects.get().total_price, 1000)
+        self.assertFalse(CartLine.objects.exists())
@@ -1,31 +1,36 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.contrib import messages
-from catalog.models import Flower
 from orders.models import Order, OrderItem
 from users.models import UserProfile
-from bot.utils import send_message
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from .models import WorkingHours
+from core.db import retry_on_lock
+from .pricing import price_cart
+from .schedule import get_schedule
+from .storage import _cookie_setting, get_cart
+import json
 import logging
+import uuid
 logger = logging.getLogger(__name__)
 
+
+def _price(cart):
+    """Рассчитывает корзину и убирает из неё цветы, которых больше нет в каталоге."""
+    priced = price_cart(cart.items())
+    cart.remove(*priced.stale_ids)
+    return priced
+
 @csrf_exempt
 def add_to_cart(request, flower_id):
     """Добавление цветка в корзину (работает для всех пользователей)"""
     if request.method == "POST":
-        if "cart" not in request.session:
-            request.session["cart"] = {}
-            request.session.modified = True
+        quantity = get_cart(request).add(flower_id)
+        if quantity is None:
+            return JsonResponse({"success": False})
 
-        cart = request.session["cart"]
-        cart[str(flower_id)] = cart.get(str(flower_id), 0) + 1
-        request.session["cart"] = cart
-        request.session.modified = True
-
-        return JsonResponse({"success": True, "quantity": cart[str(flower_id)]})
+        return JsonResponse({"success": True, "quantity": quantity})
 
     return JsonResponse({"success": False})
 
@@ -33,61 +38,98 @@ def add_to_cart(request, flower_id):
 def update_cart(request, flower_id, quantity):
     """Обновление количества цветов в корзине с пересчётом итоговой суммы"""
     if request.method == "POST":
-        cart = request.session.get("cart", {})
-
-        if quantity > 0:
-            cart[str(flower_id)] = quantity
-        else:
-            cart.pop(str(flower_id), None)
-
-        request.session["cart"] = cart
-        request.session.modified = True
-
-        total_price = sum(get_object_or_404(Flower, id=f_id).price * qty for f_id, qty in cart.items())
-        flower = get_object_or_404(Flower, id=flower_id)
-        subtotal = flower.price * quantity if quantity > 0 else 0
+        cart = get_cart(request)
+        cart.update(flower_id, quantity)
+        priced = _price(cart)
 
         return JsonResponse({
             "success": True, 
             "quantity": quantity,
-            "subtotal": subtotal, 
-            "total_price": total_price
+            "subtotal": priced.subtotal(flower_id),
+            "total_price": priced.total_price
         })
 
     return JsonResponse({"success": False})
 
+# Максимальное число операций в одном пакетном запросе
+CART_BATCH_MAX_OPERATIONS = 100
+
+
+def _parse_operations(body):
+    """Разбирает список операций [{flower_id, delta|quantity}]. Возвращает None при ошибке формата."""
+    try:
+        operations = json.loads(body or b"{}").get("operations")
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(operations, list) or not 0 < len(operations) <= CART_BATCH_MAX_OPERATIONS:
+        return None
+
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or ("delta" in operation) == ("quantity" in operation):
+            return None
+        values = [operation.get("flower_id"), operation.get("delta", operation.get("quantity"))]
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            return None
+        flower_id, value = values
+        if not 0 < flower_id < 2 ** 63 or ("quantity" in operation and value < 0):
+            return None
+        if abs(value) > _cookie_setting("CART_COOKIE_MAX_QUANTITY"):  # иначе SQLite падает с OverflowError
+            return None
+        parsed.append((flower_id, "delta" if "delta" in operation else "quantity", value))
+    return parsed
+
+@csrf_exempt
+def batch_update_cart(request):
+    """Пакетное изменение корзины: все операции применяются атомарно, ответ — изменённые строки и итог"""
+    if request.method != "POST":
+        return JsonResponse({"success": False})
+
+    operations = _parse_operations(request.body)
+    if operations is None:
+        return JsonResponse({"success": False, "message": "Некорректный список операций."}, status=400)
+
+    cart = get_cart(request)
+    with transaction.atomic():
+        for flower_id, kind, value in operations:
+            if kind == "delta":
+                cart.change(flower_id, value)
+            else:
+                cart.update(flower_id, value)
+        priced = _price(cart)
+
+    touched = dict.fromkeys(flower_id for flower_id, kind, value in operations)
+    quantities = {line.flower.id: line.quantity for line in priced}
+    return JsonResponse({
+        "success": True,
+        "lines": [
+            {
+                "flower_id": flower_id,
+                "quantity": quantities.get(flower_id, 0),
+                "subtotal": priced.subtotal(flower_id),
+            }
+            for flower_id in touched
+        ],
+        "line_count": len(priced),
+        "total_price": priced.total_price,
+    })
+
 @csrf_exempt
 def view_cart(request):
     """Просмотр корзины"""
-    if "cart" not in request.session:
-        request.session["cart"] = {}
-        request.session.modified = True
-
-    cart = request.session.get("cart", {})
-    flowers = []
-    total_price = 0
-
-    for flower_id, quantity in cart.items():
-        flower = get_object_or_404(Flower, id=flower_id)
-        flowers.append({"flower": flower, "quantity": quantity, "subtotal": flower.price * quantity})
-        total_price += flower.price * quantity
+    priced = _price(get_cart(request))
 
-    return render(request, "cart/cart.html", {"flowers": flowers, "total_price": total_price})
+    return render(request, "cart/cart.html", {"flowers": priced, "total_price": priced.total_price})
 
 @csrf_exempt
 def remove_from_cart(request, flower_id):
     """Удаление одного цветка из корзины"""
     if request.method == "POST":
-        cart = request.session.get("cart", {})
+        cart = get_cart(request)
+        cart.remove(flower_id)
+        priced = _price(cart)
 
-        if str(flower_id) in cart:
-            del cart[str(flower_id)]
-            request.session["cart"] = cart
-            request.session.modified = True
-
-        total_price = sum(get_object_or_404(Flower, id=f_id).price * qty for f_id, qty in cart.items())
-
-        return JsonResponse({"success": True, "total_price": total_price})
+        return JsonResponse({"success": True, "total_price": priced.total_price})
 
     return JsonResponse({"success": False})
 
@@ -95,29 +137,80 @@ def remove_from_cart(request, flower_id):
 def clear_cart(request):
     """Очистка всей корзины"""
     if request.method == "POST":
-        request.session["cart"] = {}
-        request.session.modified = True
+        get_cart(request).clear()
         return JsonResponse({"success": True})
 
     return JsonResponse({"success": False})
 
 def is_working_hours():
     """Проверяет, находится ли текущее время в рамках рабочего времени."""
-    now = timezone.now()
-    # Преобразуем в местное время согласно TIME_ZONE
-    local_now = timezone.localtime(now)
-    # Получаем текущий день недели (например, "mon")
-    current_day = local_now.strftime("%a").lower()
-    # Получаем текущее местное время
-    current_time = local_now.time()
-    try:
-        working_hours = WorkingHours.objects.get(day=current_day)
-        if working_hours.is_working and working_hours.opening_time <= current_time <= working_hours.closing_time:
-            return True
-    except WorkingHours.DoesNotExist:
-        pass
+    return get_schedule().is_open()
+
+
+def _idempotency_key(request):
+    """Ключ идемпотентности из формы или заголовка Idempotency-Key."""
+    key = request.POST.get("idempotency_key") or request.headers.get("Idempotency-Key") or ""
+    return key.strip()[:64] or None
+
+def _find_order(profile, idempotency_key):
+    """Заказ, уже созданный с этим ключом, или None."""
+    if not idempotency_key:
+        return None
+    return Order.objects.filter(user=profile, idempotency_key=idempotency_key).first()
+
+def _create_order(profile, priced, address, idempotency_key):
+    """Создаёт заказ и его позиции по рассчитанной корзине."""
+    order = Order.objects.create(
+        user=profile,
+        status="awaiting_payment",
+        address=address,
+        total_price=priced.total_price,
+        idempotency_key=idempotency_key,
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem.from_flower(
+            line.flower,
+            order=order,
+            quantity=line.quantity,
+            price=line.flower.price,
+            subtotal=line.subtotal
+        )
+        for line in priced
+    ])
+    return order
+
+@retry_on_lock
+def _place_order(cart, profile, address, idempotency_key):
+    """
+    Чтение и расчёт корзины, заказ с позициями и очистка корзины — одна транзакция.
+
+    Транзакция открывается с BEGIN IMMEDIATE, поэтому параллельные оформления
+    одной корзины идут по очереди: следующее видит заказ с тем же ключом или
+    уже пустую корзину (тогда возвращает None). Уведомления уходят после коммита.
+    """
+    with transaction.atomic():
+        order = _find_order(profile, idempotency_key)
+        if order is not None:
+            return order
+        priced = _price(cart)
+        if not priced:
+            return None
+        order = _create_order(profile, priced, address, idempotency_key)
+        cart.clear()
+    return order
+
+def _empty_cart():
+    return JsonResponse({
+        "success": False,
+        "message": "Ваша корзина пуста."
+    })
 
-    return False
+def _checkout_success(order):
+    return JsonResponse({
+        "success": True,
+        "order_id": order.id,
+        "redirect_url": "/orders/"
+    })
 
 
 @login_required
@@ -125,19 +218,26 @@ def checkout(request):
     """Оформление заказа"""
     profile, created = UserProfile.objects.get_or_create(user=request.user)
 
-    cart = request.session.get("cart", {})
+    cart = get_cart(request)
     if request.method == "POST":
+        # Повторная отправка формы с тем же ключом возвращает уже созданный заказ
+        idempotency_key = _idempotency_key(request)
+        order = _find_order(profile, idempotency_key)
+        if order is not None:
+            return _checkout_success(order)
+
         # Отключаем проверку рабочего времени в тестовом режиме через заголовок HTTP_X_TEST
         if not request.headers.get('X-Test', 'false').lower() == 'true':  # Используем заголовок вместо атрибута            # Проверка рабочего времени только при оформлении заказа
             if not is_working_hours():
-                working_hours = WorkingHours.objects.filter(is_working=True)
-                schedule = "\n".join(
-                    f"{wh.get_day_display()}: {wh.opening_time} - {wh.closing_time}"
-                    for wh in working_hours
+                schedule = get_schedule()
+                next_opening = schedule.next_opening()
+                next_opening_text = (
+                    f"Ближайшее открытие: {timezone.localtime(next_opening):%d.%m.%Y %H:%M}.\n\n"
+                    if next_opening else ""
                 )
                 return JsonResponse({
                     "success": False,
-                    "message": f"К сожалению, мы можем принять заказ только в рабочее время.\nРасписание работы:\n\n{schedule}\n\nПожалуйста, попробуйте позже."
+                    "message": f"К сожалению, мы можем принять заказ только в рабочее время.\nРасписание работы:\n\n{schedule.text}\n\n{next_opening_text}Пожалуйста, попробуйте позже."
                 })
 
         if not profile.phone:
@@ -146,11 +246,12 @@ def checkout(request):
                 "message": "Пожалуйста, заполните ваш профиль (номер телефона) перед оформлением заказа."
             })
 
-        if not cart:
-            return JsonResponse({
-                "success": False,
-                "message": "Ваша корзина пуста."
-            })
+        if not cart.items():
+            # Корзину мог только что очистить параллельный запрос с тем же ключом
+            order = _find_order(profile, idempotency_key)
+            if order is not None:
+                return _checkout_success(order)
+            return _empty_cart()
 
         address = request.POST.get("address", "").strip()
         if not address:
@@ -159,46 +260,24 @@ def checkout(request):
                 "message": "Пожалуйста, укажите адрес доставки."
             })
 
-        order = Order(user=profile, status="awaiting_payment", address=address)
-        total_price = 0
-        items = []
-        for flower_id, quantity in cart.items():
-            flower = get_object_or_404(Flower, id=flower_id)
-            subtotal = flower.price * quantity
-            total_price += subtotal
-            items.append(OrderItem(
-                order=order,
-                flower=flower,
-                quantity=quantity,
-                price=flower.price,
-                subtotal=subtotal
-            ))
-        
-        order.total_price = total_price
-        order.save()
-        OrderItem.objects.bulk_create(items)
-
-        request.session["cart"] = {}
-        return JsonResponse({
-            "success": True,
-            "redirect_url": "/orders/"
-        })
+        try:
+            order = _place_order(cart, profile, address, idempotency_key)
+        except IntegrityError:
+            # Параллельный запрос с тем же ключом успел создать заказ раньше
+            order = _find_order(profile, idempotency_key)
+            if order is None:
+                raise
+        if order is None:
+            return _empty_cart()  # корзину оформил параллельный запрос с другим ключом
+
+        return _checkout_success(order)
 
     # Обработка GET-запроса для отображения формы (всегда рендерим страницу)
-    flowers = []
-    total_price = 0
-    for flower_id, quantity in cart.items():
-        flower = get_object_or_404(Flower, id=flower_id)
-        subtotal = flower.price * quantity
-        total_price += subtotal
-        flowers.append({
-            "flower": flower,
-            "quantity": quantity,
-            "subtotal": subtotal,
-        })
+    priced = _price(cart)
 
     return render(request, "cart/checkout.html", {
-        "flowers": flowers,
-        "total_price": total_price,
+        "flowers": priced,
+        "total_price": priced.total_price,
         "profile": profile,
+        "idempotency_key": uuid.uuid4().hex,
     })
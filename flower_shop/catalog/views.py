@@ -4,10 +4,11 @@ from django.contrib import messages
 from catalog.models import Flower
 from orders.models import Order
 from users.models import UserProfile
-from bot.utils import send_message
 from cart.views import add_to_cart, view_cart, remove_from_cart, update_cart
+from cart.storage import get_cart
 
 def flower_list(request):
     """Отображение каталога цветов"""
     flowers = Flower.objects.all()
-    return render(request, "catalog/catalog.html", {"flowers": flowers})
\ No newline at end of file
+    cart = get_cart(request).items()
+    return render(request, "catalog/catalog.html", {"flowers": flowers, "cart": cart})
\ No newline at end of file
@@ -1,3 +1,14 @@
-from django.contrib import admin
+from .routers import read_from_replica
 
-# Register your models here.
+
+class ReplicaChangeListMixin:
+    """Страница списка в админке читается с реплики; сохранение из списка и действия — из default."""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != "GET":
+            return super().changelist_view(request, extra_context)
+        with read_from_replica():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, "render"):
+                response.render()  # шаблон списка тоже обращается к базе
+        return response
@@ -1,6 +1,9 @@
 from django.apps import AppConfig
 
 
-class OrdersConfig(AppConfig):
+class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'orders'
+    name = 'core'
+
+    def ready(self):
+        from . import db  # noqa: F401 — подключает настройку соединений SQLite
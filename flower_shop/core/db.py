@@ -0,0 +1,67 @@
+import functools
+import logging
+import random
+import time
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+# Значения по умолчанию для настроек SQLite и повторов записи
+DB_DEFAULTS = {
+    "SQLITE_JOURNAL_MODE": "WAL",  # читатели не блокируют писателя и наоборот; None — не менять
+    "SQLITE_SYNCHRONOUS": "NORMAL",  # в режиме WAL безопасно и без fsync на каждый коммит
+    "SQLITE_BUSY_TIMEOUT": 5000,  # мс: сколько ждать освобождения блокировки внутри SQLite
+    "DB_LOCK_RETRIES": 5,  # сколько раз повторять транзакцию записи после «database is locked»
+    "DB_LOCK_BACKOFF": 0.05,  # сек, удваивается с каждой попыткой
+}
+
+
+def _setting(name):
+    return getattr(settings, name, DB_DEFAULTS[name])
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Настраивает каждое новое соединение с SQLite (PRAGMA действуют на соединение)."""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        if _setting("SQLITE_JOURNAL_MODE"):
+            cursor.execute(f"PRAGMA journal_mode={_setting('SQLITE_JOURNAL_MODE')}")
+        if _setting("SQLITE_SYNCHRONOUS"):
+            cursor.execute(f"PRAGMA synchronous={_setting('SQLITE_SYNCHRONOUS')}")
+        cursor.execute(f"PRAGMA busy_timeout={int(_setting('SQLITE_BUSY_TIMEOUT'))}")
+
+
+def is_lock_error(error):
+    message = str(error).lower()
+    return "database is locked" in message or "database table is locked" in message
+
+
+def retry_on_lock(func):
+    """
+    Повторяет транзакцию записи, если база занята другим процессом.
+
+    Декорируемая функция должна целиком открывать и закрывать транзакцию, чтобы
+    повтор начинался с чистого листа. Внутри внешней транзакции ошибка не
+    перехватывается: повторять имеет смысл только внешнюю транзакцию целиком.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if (not is_lock_error(e) or attempt >= _setting("DB_LOCK_RETRIES")
+                        or transaction.get_connection().in_atomic_block):
+                    raise
+                attempt += 1
+                delay = _setting("DB_LOCK_BACKOFF") * 2 ** (attempt - 1)
+                logger.warning("База занята, повтор %s из %s через %.2f с: %s",
+                               attempt, _setting("DB_LOCK_RETRIES"), delay, func.__qualname__)
+                time.sleep(delay * random.uniform(0.5, 1.5))  # разброс, чтобы процессы не повторяли хором
+    return wrapper
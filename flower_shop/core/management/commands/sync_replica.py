@@ -0,0 +1,37 @@
+import sqlite3
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = "Копирует основную базу SQLite в файл реплики (локальная проверка чтения с реплики)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=None,
+                            help="Алиас реплики (по умолчанию DATABASE_REPLICA или replica)")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Повторять копирование каждые N секунд (имитация отставания реплики); 0 — один раз")
+
+    def handle(self, *args, **options):
+        alias = options["database"] or getattr(settings, "DATABASE_REPLICA", None) or "replica"
+        if alias not in connections.settings:
+            raise CommandError(f"База {alias!r} не описана в DATABASES")
+        source, target = connections[DEFAULT_DB_ALIAS], connections.settings[alias]
+        if source.vendor != "sqlite" or "sqlite3" not in target["ENGINE"]:
+            raise CommandError("Команда копирует только SQLite; настоящую реплику наполняет репликация СУБД")
+        if str(target["NAME"]) == str(source.settings_dict["NAME"]):
+            raise CommandError(f"Реплика {alias!r} указывает на тот же файл, что и основная база")
+
+        while True:
+            source.ensure_connection()
+            destination = sqlite3.connect(target["NAME"])
+            try:
+                source.connection.backup(destination)
+            finally:
+                destination.close()
+            self.stdout.write(f"База скопирована в {target['NAME']}")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
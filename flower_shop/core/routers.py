@@ -0,0 +1,133 @@
+import contextvars
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Значения по умолчанию для настроек чтения с реплики
+REPLICA_DEFAULTS = {
+    "DATABASE_REPLICA": None,  # алиас реплики в DATABASES; None — всё читается из default
+    "REPLICA_PIN_SECONDS": 15,  # сколько после записи читать с основной базы (с запасом на отставание реплики)
+    "REPLICA_PIN_COOKIE": "db_pin",
+    "REPLICA_PIN_EXEMPT": ("sessions.session",),  # служебные записи, после которых реплике можно доверять
+}
+
+_use_replica = contextvars.ContextVar("db_use_replica", default=False)
+_pin = contextvars.ContextVar("db_pin", default=None)
+
+
+class _Pin:
+    """Состояние «прилипания» к default в одной области (запрос, обновление бота)."""
+    __slots__ = ("pinned", "wrote")
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def _setting(name):
+    return getattr(settings, name, REPLICA_DEFAULTS[name])
+
+
+def replica_alias():
+    """Алиас реплики, если она настроена."""
+    alias = _setting("DATABASE_REPLICA")
+    return alias if alias and alias in connections.settings else None
+
+
+@contextmanager
+def pinned_to_primary(pinned=False):
+    """
+    Новая область read-your-writes: после первой записи в ней чтение идёт из default.
+
+    Состояние изменяемое и общее для всего блока, поэтому запись в потоке
+    sync_to_async видна и вызывающей корутине.
+    """
+    pin = _Pin(pinned)
+    token = _pin.set(pin)
+    try:
+        yield pin
+    finally:
+        _pin.reset(token)
+
+
+@contextmanager
+def read_from_replica(ignore_writes=False):
+    """
+    Разрешает чтение с реплики внутри блока.
+
+    Подходит для путей, которым не страшно отставание реплики на несколько
+    секунд: история заказов, списки в админке, чтение в боте. ignore_writes=True —
+    читать с реплики, даже если в текущей области уже была запись (отчёты и
+    фоновые сканы, где свежесть не важна). Работает и как декоратор синхронной функции.
+    """
+    token = _use_replica.set(True)
+    try:
+        if ignore_writes:
+            with pinned_to_primary():
+                yield
+        else:
+            yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Маршрутизатор основной базы и реплики для чтения.
+
+    Запись всегда идёт в default. Чтение уходит на реплику, только если оно
+    внутри read_from_replica(), реплика настроена (DATABASE_REPLICA), нет
+    открытой транзакции на default и в текущей области ещё не было записи:
+    после записи запрос (или задача бота) читает свои же данные из default.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = replica_alias()
+        pin = _pin.get()
+        if (alias and _use_replica.get() and not (pin and pin.pinned)
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if model._meta.label_lower not in _setting("REPLICA_PIN_EXEMPT"):
+            pin = _pin.get()
+            if pin is None:  # вне явной области (команды, фоновые задачи) — на весь контекст
+                pin = _Pin()
+                _pin.set(pin)
+            pin.pinned = pin.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика — копия default: объекты из обеих баз можно связывать
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплики приходит вместе с данными с основной базы
+        if db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    Read-your-writes для веб-запросов.
+
+    Запрос, который что-то записал, до конца читает из default и получает cookie
+    REPLICA_PIN_COOKIE: следующие запросы в течение REPLICA_PIN_SECONDS (например,
+    страница после редиректа) тоже читают из default, пока реплика догоняет.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        cookie = _setting("REPLICA_PIN_COOKIE")
+        with pinned_to_primary(cookie in request.COOKIES) as pin:
+            response = self.get_response(request)
+        if pin.wrote:
+            response.set_cookie(cookie, "1", max_age=_setting("REPLICA_PIN_SECONDS"), httponly=True, samesite="Lax")
+        return response
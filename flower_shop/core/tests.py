@@ -1,5 +1,20 @@
-from django.test import TestCase, Client
+import multiprocessing
+from unittest.mock import Mock, patch
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.utils import ConnectionRouter
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from io import StringIO
+import sqlite3
+import tempfile
+from orders.models import Order
+from users.models import NotificationLog, UserProfile
+from .db import retry_on_lock
+from .routers import pinned_to_primary, read_from_replica
 
 class CoreViewsTest(TestCase):
     def setUp(self):
@@ -24,4 +39,179 @@ class CoreViewsTest(TestCase):
         response = self.client.get(url)
 
         # Проверяем, что используется правильный шаблон
-        self.assertTemplateUsed(response, "core/home.html")
\ No newline at end of file
+        self.assertTemplateUsed(response, "core/home.html")
+
+def _place_orders(profile_id, count, results):
+    """Процесс стресс-теста: оформляет count заказов (чтение и запись в одной транзакции)."""
+    @retry_on_lock
+    def place_order():
+        with transaction.atomic():
+            Order.objects.filter(user_id=profile_id).count()
+            Order.objects.create(user_id=profile_id, total_price=100)
+
+    errors = []
+    for _ in range(count):
+        try:
+            place_order()
+        except OperationalError as e:
+            errors.append(str(e))
+    results.put(errors)
+
+
+class SQLiteSettingsTest(TestCase):
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_BUSY_TIMEOUT)
+
+
+@override_settings(DB_LOCK_RETRIES=3, DB_LOCK_BACKOFF=0)
+class RetryOnLockTest(SimpleTestCase):
+    def locked_write(self, side_effect):
+        write = Mock(side_effect=side_effect)
+        write.__qualname__ = "write"
+        return write
+
+    def test_retries_lock_errors(self):
+        write = self.locked_write([OperationalError("database is locked"), OperationalError("database is locked"), "ok"])
+        self.assertEqual(retry_on_lock(write)(), "ok")
+        self.assertEqual(write.call_count, 3)
+
+    def test_gives_up_after_limit(self):
+        write = self.locked_write(OperationalError("database is locked"))
+        with self.assertRaises(OperationalError):
+            retry_on_lock(write)()
+        self.assertEqual(write.call_count, 4)
+
+    def test_other_errors_are_not_retried(self):
+        write = self.locked_write(OperationalError("no such table: orders_order"))
+        with self.assertRaises(OperationalError):
+            retry_on_lock(write)()
+        self.assertEqual(write.call_count, 1)
+
+    def test_not_retried_inside_outer_transaction(self):
+        write = self.locked_write(OperationalError("database is locked"))
+        with patch("core.db.transaction.get_connection", return_value=Mock(in_atomic_block=True)):
+            with self.assertRaises(OperationalError):
+                retry_on_lock(write)()
+        self.assertEqual(write.call_count, 1)
+
+
+class ConcurrentWritesTest(TransactionTestCase):
+    """Несколько процессов пишут в базу одновременно — как веб-воркеры и бот."""
+
+    def test_parallel_processes_do_not_hit_lock_errors(self):
+        user = get_user_model().objects.create_user(username="stress")
+        profile_id = UserProfile.objects.get(user=user).pk
+        connections.close_all()  # дочерние процессы открывают свои соединения
+
+        workers, per_worker = 4, 25
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        processes = [context.Process(target=_place_orders, args=(profile_id, per_worker, results))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        errors = [error for _ in processes for error in results.get(timeout=60)]
+        for process in processes:
+            process.join(timeout=60)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Order.objects.filter(user_id=profile_id).count(), workers * per_worker)
+
+
+@override_settings(DATABASE_REPLICA="replica")
+class ReplicaRouterTest(SimpleTestCase):
+    def test_reads_go_to_replica_only_inside_block(self):
+        self.assertEqual(Order.objects.all().db, "default")
+        with pinned_to_primary(), read_from_replica():
+            self.assertEqual(Order.objects.all().db, "replica")
+            self.assertEqual(Order.objects.select_for_update().db, "default")
+
+    def test_write_pins_scope_to_primary(self):
+        router = ConnectionRouter()
+        with pinned_to_primary() as pin, read_from_replica():
+            self.assertEqual(router.db_for_write(Order), "default")
+            self.assertTrue(pin.wrote)
+            self.assertEqual(Order.objects.all().db, "default")
+            with read_from_replica(ignore_writes=True):  # отчёты свежесть не требуют
+                self.assertEqual(Order.objects.all().db, "replica")
+        with pinned_to_primary(), read_from_replica():
+            self.assertEqual(Order.objects.all().db, "replica")  # новая область не прилипла
+
+    def test_session_writes_do_not_pin(self):
+        from django.contrib.sessions.models import Session
+        with pinned_to_primary() as pin, read_from_replica():
+            ConnectionRouter().db_for_write(Session)
+            self.assertFalse(pin.wrote)
+            self.assertEqual(Order.objects.all().db, "replica")
+
+    @override_settings(DATABASE_REPLICA=None)
+    def test_without_replica_everything_reads_default(self):
+        with pinned_to_primary(), read_from_replica():
+            self.assertEqual(Order.objects.all().db, "default")
+
+
+@override_settings(DATABASE_REPLICA="replica")
+class ReplicaReadPathsTest(TransactionTestCase):
+    """Реплика в тестах — второе соединение с тем же файлом (TEST MIRROR), поэтому запросы различимы."""
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="reader", password="testpass123")
+        self.profile = UserProfile.objects.get(user=self.user)
+        self.order = Order.objects.create(user=self.profile, total_price=100)
+        self.client.force_login(self.user)
+
+    def order_queries(self, alias, response_for):
+        with CaptureQueriesContext(connections["default"]) as default, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            response = response_for()
+        queries = {"default": default, "replica": replica}[alias]
+        return response, [q["sql"] for q in queries if '"orders_order"' in q["sql"]]
+
+    def test_order_history_reads_replica(self):
+        response, replica_reads = self.order_queries("replica", lambda: self.client.get(reverse("order_list")))
+        self.assertContains(response, f"#{self.order.id}")
+        self.assertTrue(replica_reads)
+        self.assertNotIn("db_pin", response.cookies)
+
+    def test_write_pins_next_requests_to_primary(self):
+        response = self.client.post(reverse("cancel_order", args=[self.order.id]))
+        self.assertIn("db_pin", response.cookies)
+        # Страница после редиректа читает из default, пока реплика догоняет
+        response, default_reads = self.order_queries("default", lambda: self.client.get(reverse("order_list")))
+        self.assertTrue(default_reads)
+        _, replica_reads = self.order_queries("replica", lambda: self.client.get(reverse("order_list")))
+        self.assertEqual(replica_reads, [])
+
+    def test_admin_changelist_reads_replica(self):
+        admin = get_user_model().objects.create_superuser(username="admin", password="adminpass123")
+        self.client.force_login(admin)
+        response, replica_reads = self.order_queries(
+            "replica", lambda: self.client.get(reverse("admin:orders_order_changelist")))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_reads)
+
+
+class SyncReplicaCommandTest(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def test_copies_primary_into_replica_file(self):
+        user = get_user_model().objects.create_user(username="copied")
+        NotificationLog.objects.create(user=UserProfile.objects.get(user=user), message="Проверка")
+        with tempfile.TemporaryDirectory() as directory:
+            target = f"{directory}/replica.sqlite3"
+            with patch.dict(connections.settings["replica"], {"NAME": target}):
+                call_command("sync_replica", stdout=StringIO())
+            with sqlite3.connect(target) as replica:
+                rows = replica.execute("SELECT message FROM users_notificationlog").fetchall()
+        self.assertEqual(rows, [("Проверка",)])
+
+    def test_refuses_to_copy_onto_primary(self):
+        with self.assertRaises(CommandError):
+            call_command("sync_replica", stdout=StringIO())
@@ -0,0 +1,69 @@
+class ChangeTrackingMixin:
+    """
+    Отслеживание изменённых полей модели.
+
+    Запоминает значения полей, загруженные из базы, и при save() без явного
+    update_fields пишет только изменённые столбцы. Если ничего не изменилось,
+    запись и сигналы pre_save/post_save пропускаются. Получатели post_save
+    видят набор изменённых полей в update_fields (None — новая запись или
+    полное сохранение). Подмешивается перед models.Model:
+
+        class Order(ChangeTrackingMixin, models.Model): ...
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_state()
+        return instance
+
+    def _remember_state(self, fields=None):
+        deferred = self.get_deferred_fields()
+        state = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred and (fields is None or field.attname in fields)
+        }
+        if fields is None or not hasattr(self, "_loaded_state"):
+            self._loaded_state = state
+        else:
+            self._loaded_state.update(state)
+
+    def changed_fields(self):
+        """Имена полей, изменённых после загрузки из базы (None — состояние неизвестно, например новая запись)."""
+        state = getattr(self, "_loaded_state", None)
+        if state is None or self._state.adding:
+            return None
+        changed = set()
+        for field in self._meta.concrete_fields:
+            if field.primary_key:
+                continue
+            if field.attname in state:
+                if getattr(self, field.attname) != state[field.attname]:
+                    changed.add(field.name)
+            elif field.attname in self.__dict__:
+                changed.add(field.name)  # отложенное поле загружено или присвоено позже — считаем изменённым
+        return changed
+
+    def has_changed(self):
+        changed = self.changed_fields()
+        return changed is None or bool(changed)
+
+    def save(self, *args, **kwargs):
+        if kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            changed = self.changed_fields()
+            if changed is not None:
+                if not changed:
+                    return  # нечего записывать
+                kwargs["update_fields"] = changed
+        super().save(*args, **kwargs)
+        self._remember_state(self._attnames(kwargs.get("update_fields")))
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._remember_state(self._attnames(fields))
+
+    def _attnames(self, names):
+        if names is None:
+            return None
+        return {getattr(self._meta.get_field(name), "attname", name) for name in names}
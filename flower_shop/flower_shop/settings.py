@@ -42,14 +42,17 @@ INSTALLED_APPS = [
     'orders',
     'bot',
     'cart',
+    'core',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.routers.ReplicaPinningMiddleware',  # read-your-writes при чтении с реплики
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'cart.middleware.CartCookieMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -82,8 +85,37 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # Соединения переиспользуются между запросами (PRAGMA из core.db выполняются один раз)
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Транзакция сразу берёт блокировку записи: без этого две транзакции,
+            # начавшие с чтения, не могут обе перейти к записи и одна сразу
+            # получает «database is locked», не дожидаясь busy_timeout
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Тестовая база в файле, а не в памяти: только так параллельные соединения
+        # блокируются как в рабочей базе (тесты конкурентного оформления заказов)
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    },
+    # Реплика только для чтения (см. core.routers); используется, если DATABASE_REPLICA = "replica".
+    # Локально роль реплики играет второй файл SQLite, который заполняет команда sync_replica
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
 }
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+# Алиас реплики для истории заказов, списков админки, отчётов и чтения в боте; None — всё из default
+DATABASE_REPLICA = None
+REPLICA_PIN_SECONDS = 15  # сколько после записи читать из default, пока реплика догоняет
 
 
 # Password validation
@@ -147,6 +179,70 @@ SESSION_COOKIE_AGE = 86400  # 1 день
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # Сессия не удаляется при закрытии браузера
 SESSION_SAVE_EVERY_REQUEST = True  # Обновление сессии при каждом запросе
 
+# Корзина гостя в подписанной cookie: гость не создаёт записей в БД до входа или оформления заказа
+CART_COOKIE_ENABLED = False
+CART_COOKIE_NAME = "cart"
+CART_COOKIE_AGE = 60 * 60 * 24 * 30  # 30 дней
+CART_COOKIE_MAX_LINES = 50  # Ограничение размера cookie
+CART_COOKIE_MAX_QUANTITY = 999
+
+# Расписание работы кэшируется в памяти процесса; сигналы сбрасывают кэш, TTL — страховка для других процессов
+WORKING_HOURS_CACHE_TTL = 300  # секунд
+
+# Очередь уведомлений Telegram (bot.outbox, команда dispatch_outbox)
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE = 5  # секунд, удваивается с каждой попыткой
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_LEASE = 120  # секунд
+OUTBOX_SEND_TIMEOUT = 60  # секунд ожидания отправки пачки
+
+# Напоминания об оплате (bot.reminders): первое — через сутки после заказа, дальше по интервалу
+PAYMENT_REMINDER_INTERVAL_HOURS = 24
+PAYMENT_REMINDER_MAX = 3
+PAYMENT_REMINDER_POLL = 300  # секунд; как часто подхватывать заказы из других процессов
+
+# Сколько заказов показывать на странице истории (следующие подгружаются по курсору)
+ORDER_HISTORY_PAGE_SIZE = 20
+
+# Неоплаченные заказы старше этого срока отменяет команда cancel_overdue_orders
+ORDER_AUTO_CANCEL_HOURS = 72
+
+# Лимиты Telegram (bot.ratelimit): общий на бота, на личный чат и на группу
+TELEGRAM_GLOBAL_RATE = 30  # сообщений в секунду
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_GROUP_RATE = 20 / 60
+TELEGRAM_RETRY_LIMIT = 3  # повторов после RetryAfter
+TELEGRAM_MAX_RETRY_AFTER = 60  # секунд; дольше — ошибка возвращается в очередь уведомлений
+
+# SQLite в рабочем режиме (см. core.db): WAL, ожидание блокировок и повтор транзакций записи
+SQLITE_JOURNAL_MODE = "WAL"
+SQLITE_SYNCHRONOUS = "NORMAL"
+SQLITE_BUSY_TIMEOUT = 5000  # мс
+DB_LOCK_RETRIES = 5
+DB_LOCK_BACKOFF = 0.05  # секунд, удваивается с каждой попыткой
+
+# Сколько обновлений бота работают с базой одновременно (потоки ORM со своими соединениями); 0 — один общий поток
+BOT_DB_THREADS = 8
+
+# Кэш «Telegram ID → профиль» в боте; сигналы сбрасывают записи, TTL — страховка для правок из других процессов
+BOT_PROFILE_CACHE_SIZE = 10000
+BOT_PROFILE_CACHE_TTL = 300  # секунд
+BOT_PROFILE_CACHE_NEGATIVE_TTL = 30  # секунд для неизвестных ID
+
+# Запускать бота (long polling) вместе с runserver; в продакшене — команда runbot
+BOT_RUN_WITH_RUNSERVER = True
+
+# Вебхук бота (runbot --mode webhook): внешний адрес, путь, секрет и число одновременно обрабатываемых обновлений
+BOT_WEBHOOK_URL = None
+BOT_WEBHOOK_PATH = "/telegram/webhook"
+BOT_WEBHOOK_SECRET = os.environ.get("BOT_WEBHOOK_SECRET")
+BOT_WEBHOOK_CONCURRENCY = 16
+
+# Адрес Bot API (например, локального telegram-bot-api); None — api.telegram.org
+TELEGRAM_API_SERVER = None
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
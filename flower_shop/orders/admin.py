@@ -1,33 +1,136 @@
+import re
 from django.contrib import admin
-from .models import Order
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.db.models import Q
+from core.admin import ReplicaChangeListMixin
+from users.models import normalize_phone
+from .models import Order, OrderItem, set_orders_status
+
+# Номер телефона или его начало в поиске: от 4 цифр, возможно с «+», пробелами, скобками и дефисами
+PHONE_RE = re.compile(r"^\+?[\d\s()-]{4,20}$")
+
+
+def phone_prefixes(term):
+    """Варианты начала номера в том виде, в каком номера хранятся в профиле."""
+    cleaned = re.sub(r"[()\s-]", "", term)
+    digits = cleaned.lstrip("+")
+    national = digits[1:] if digits[:1] in ("7", "8") else digits  # номер без кода страны
+    return {normalize_phone(cleaned), "+7" + national}
+
+
+def phone_startswith(prefix):
+    """Номер клиента начинается с prefix.
+
+    Диапазон вместо LIKE 'prefix%': в SQLite LIKE не регистрозависим и индекс
+    phone не использует, а сравнение строк — использует.
+    """
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Q(user__phone__gte=prefix, user__phone__lt=upper)
+
+
+class OrderItemInline(admin.TabularInline):
+    """Позиции заказа из снимка на момент оформления (без обращения к каталогу)."""
+    model = OrderItem
+    fields = ("flower_name", "quantity", "price", "subtotal")
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+def user_autocomplete_widget(admin_site):
+    field = Order._meta.get_field("user")
+    widget = AutocompleteSelect(field, admin_site,
+                                attrs={"data-placeholder": "Найти клиента", "style": "width: 100%"})
+    # Поле формы подставляет в виджет ModelChoiceIterator: выбранный клиент выводится одним запросом
+    return field.formfield(widget=widget, required=False).widget
+
+
+class UserAutocompleteFilter(admin.SimpleListFilter):
+    """
+    Фильтр по клиенту с автодополнением.
+
+    В отличие от list_filter = ("user",) не загружает в боковую панель всех
+    клиентов: варианты подбирает autocomplete-поиск UserProfileAdmin.
+    """
+    title = "Пользователь"
+    parameter_name = "user"
+    template = "admin/orders/autocomplete_filter.html"
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.widget = user_autocomplete_widget(model_admin.admin_site)
+        # Остальные параметры списка сохраняются скрытыми полями формы фильтра
+        self.query_parts = [
+            (key, value) for key, values in request.GET.lists()
+            if key not in (self.parameter_name, "p") for value in values
+        ]
+
+    def lookups(self, request, model_admin):
+        return (("", ""),)  # варианты не перечисляются, но фильтр должен отображаться
+
+    def choices(self, changelist):
+        yield {
+            "widget": self.widget.render(self.parameter_name, self.value(), attrs={"id": "user-filter"}),
+            "query_parts": self.query_parts,
+        }
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value and value.isdigit():
+            return queryset.filter(user_id=value)
+        return queryset
+
+
 # Register your models here.
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ("id", "user", "status", "created_at")
-    list_filter = ("status", "created_at", "user")
-    search_fields = ("user__full_name", "user__phone", "id")
+    list_select_related = ("user",)
+    inlines = [OrderItemInline]
+    list_filter = ("status", "created_at", UserAutocompleteFilter)
+    # Номер заказа и начало телефона ищутся по индексу (см. get_search_results), остальное — по имени
+    search_fields = ("user__full_name",)
+    search_help_text = "Номер заказа, телефон клиента или часть ФИО"
+    show_full_result_count = False  # без второго COUNT(*) по всей таблице
     actions = ["mark_as_shipped", "mark_as_delivered", "mark_as_canceled"]
 
+    @property
+    def media(self):
+        return super().media + user_autocomplete_widget(self.admin_site).media
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        order_id = term.lstrip("#")
+        if order_id.isdigit() and len(order_id) < 10 and (term.startswith("#") or len(order_id) < 4):
+            return queryset.filter(id=int(order_id)), False
+        if PHONE_RE.match(term):
+            query = Q()
+            for prefix in phone_prefixes(term):
+                query |= phone_startswith(prefix)
+            if term.isdigit() and len(term) < 10:  # короткое число — номер заказа или начало телефона
+                query |= Q(id=int(term))
+            return queryset.filter(query), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def _set_status(self, request, queryset, status, message):
+        # Один UPDATE на всю выборку; уведомления уходят пакетом через очередь
+        updated = set_orders_status(queryset, status)
+        self.message_user(request, f"{message} Изменено заказов: {updated}.")
+
     def mark_as_shipped(self, request, queryset):
-        for order in queryset:
-            order.status = "shipped"
-            order.save()
-        self.message_user(request, "Выбранные заказы отмечены как отправленные.")
+        self._set_status(request, queryset, "shipped", "Выбранные заказы отмечены как отправленные.")
 
     mark_as_shipped.short_description = "Отметить как отправленный"
 
     def mark_as_delivered(self, request, queryset):
-        for order in queryset:
-            order.status = "delivered"
-            order.save()
-        self.message_user(request, "Выбранные заказы отмечены как доставленные.")
+        self._set_status(request, queryset, "delivered", "Выбранные заказы отмечены как доставленные.")
 
     mark_as_delivered.short_description = "Отметить как доставленный"
 
     def mark_as_canceled(self, request, queryset):
-        for order in queryset:
-            order.status = "canceled"
-            order.save()
-        self.message_user(request, "Выбранные заказы отменены.")
+        self._set_status(request, queryset, "canceled", "Выбранные заказы отменены.")
 
     mark_as_canceled.short_description = "Отменить заказ"
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from orders.models import cancel_unpaid_orders
+
+
+class Command(BaseCommand):
+    help = "Отменяет заказы, не оплаченные дольше заданного срока, и уведомляет клиентов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=None,
+                            help="Срок оплаты в часах (по умолчанию ORDER_AUTO_CANCEL_HOURS)")
+        parser.add_argument("--dry-run", action="store_true", help="Только показать, что будет отменено")
+
+    def handle(self, *args, **options):
+        report = cancel_unpaid_orders(options["hours"], dry_run=options["dry_run"])
+        if not report["orders"]:
+            self.stdout.write("Просроченных неоплаченных заказов нет.")
+            return
+        verb = "Будет отменено" if options["dry_run"] else "Отменено"
+        self.stdout.write(
+            f"{verb} заказов: {report['orders']} на сумму {report['total_price']:.2f} руб. "
+            f"(самый старый от {report['oldest']:%d.%m.%Y %H:%M})"
+        )
+        if not options["dry_run"]:
+            self.stdout.write(f"Уведомлений поставлено в очередь: {report['notified']}")
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 07:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentReminder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField(verbose_name='Номер напоминания')),
+                ('sent_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Отправлено')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_reminders', to='orders.order', verbose_name='Заказ')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('order', 'number'), name='unique_payment_reminder')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 07:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0002_alter_flower_image'),
+        ('orders', '0008_paymentreminder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='flower_image',
+            field=models.ImageField(blank=True, upload_to='flowers/', verbose_name='Изображение'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='flower_name',
+            field=models.CharField(blank=True, max_length=100, verbose_name='Название цветка'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='flower',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='catalog.flower'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+# Сколько позиций обновлять за один UPDATE
+BATCH_SIZE = 1000
+
+
+def backfill_snapshot(apps, schema_editor):
+    """Заполняет название и изображение цветка в старых позициях заказов порциями по id."""
+    OrderItem = apps.get_model("orders", "OrderItem")
+    Flower = apps.get_model("catalog", "Flower")
+    flower = Flower.objects.filter(pk=OuterRef("flower_id"))
+    pending = OrderItem.objects.filter(flower_name="", flower__isnull=False)
+    last_id = 0
+    while True:
+        ids = list(pending.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        OrderItem.objects.filter(id__in=ids).update(
+            flower_name=Subquery(flower.values("name")[:1]),
+            flower_image=Subquery(flower.values("image")[:1]),
+        )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0002_alter_flower_image'),
+        ('orders', '0009_orderitem_flower_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_snapshot, migrations.RunPython.noop),
+    ]
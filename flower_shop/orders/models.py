@@ -1,15 +1,22 @@
 import asyncio
-from bot.utils import send_message
+from bot.callbacks import CancelOrder
+from bot.models import OutboundMessage
+from bot.outbox import enqueue_message
+from bot.ratelimit import PRIORITY_HIGH, PRIORITY_NORMAL
 from users.models import UserProfile, NotificationLog
 from catalog.models import Flower
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, Min, Sum
 from django.utils.timezone import now, timedelta
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib import admin
 from django.utils.html import mark_safe
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from core.db import retry_on_lock
+from core.tracking import ChangeTrackingMixin
 
 User = get_user_model()
 
@@ -18,15 +25,31 @@ SHOP_NAME_E = "Цветочной Лавке"
 
 class OrderItem(models.Model):
     order = models.ForeignKey('Order', on_delete=models.CASCADE, related_name='items')
-    flower = models.ForeignKey(Flower, on_delete=models.CASCADE)
+    # Цветок может быть удалён из каталога — позиция заказа при этом сохраняется
+    flower = models.ForeignKey(Flower, on_delete=models.SET_NULL, null=True, blank=True)
+    flower_name = models.CharField(max_length=100, blank=True, verbose_name="Название цветка")  # Снимок на момент заказа
+    flower_image = models.ImageField(upload_to="flowers/", blank=True, verbose_name="Изображение")  # Ссылка на файл из каталога
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)  # Цена за единицу на момент заказа
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)  # Общая стоимость (цена * количество)
 
     def __str__(self):
-        return f"{self.flower.name} x {self.quantity}"
+        return f"{self.flower_name} x {self.quantity}"
+
+    @classmethod
+    def from_flower(cls, flower, **kwargs):
+        """Позиция заказа со снимком названия и изображения цветка."""
+        return cls(flower=flower, flower_name=flower.name, flower_image=flower.image.name, **kwargs)
+
+    def save(self, *args, **kwargs):
+        if self.flower_id and not self.flower_name:
+            self.flower_name = self.flower.name
+            self.flower_image = self.flower.image.name
+        super().save(*args, **kwargs)
+
+class Order(ChangeTrackingMixin, models.Model):
+    PAYMENT_TIMEOUT = timedelta(hours=24)  # Срок оплаты, после которого отправляется напоминание
 
-class Order(models.Model):
     STATUS_CHOICES = [
         ("awaiting_payment", "Ожидает оплаты"),
         ("pending", "Ожидает обработки"),
@@ -41,25 +64,39 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Общая стоимость заказа
     address = models.CharField(max_length=255, blank=True, null=True)  # Адрес доставки
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, editable=False)  # Ключ повторной отправки формы
+
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "idempotency_key"], name="unique_order_idempotency_key"),
+        ]
+        indexes = [
+            # Поиск просроченных неоплаченных заказов в cancel_unpaid_orders
+            models.Index(fields=["status", "created_at"], name="order_status_created_idx"),
+            models.Index(fields=["user", "-created_at", "-id"], name="order_user_history_idx"),
+        ]
 
     def __str__(self):
         return f"Заказ {self.id} - {self.user.full_name}"
 
     def is_payment_overdue(self):
         if self.status == "awaiting_payment":
-            return now() > self.created_at + timedelta(hours=24)
+            return now() > self.created_at + self.PAYMENT_TIMEOUT
         return False
 
     def duplicate_order(self):
         """Создание нового заказа на основе текущего."""
         new_order = Order.objects.create(user=self.user, status="awaiting_payment", total_price=self.total_price, address=self.address)
         for item in self.items.all():
-            OrderItem.objects.create(order=new_order, flower=item.flower, quantity=item.quantity, price=item.price, subtotal=item.subtotal)
+            OrderItem.objects.create(order=new_order, flower_id=item.flower_id, flower_name=item.flower_name,
+                                     flower_image=item.flower_image.name, quantity=item.quantity,
+                                     price=item.price, subtotal=item.subtotal)
         return new_order
 
     def get_order_summary(self):
         """Формирует текстовое описание заказа для Telegram."""
-        items_list = "\n".join([f"{item.flower.name} x {item.quantity} - {item.subtotal} руб." for item in self.items.all()])
+        items_list = "\n".join([f"{item.flower_name} x {item.quantity} - {item.subtotal} руб." for item in self.items.all()])
         return (
             f"Заказ #{self.id}\n"
             f"Состав:\n{items_list}\n"
@@ -68,25 +105,44 @@ class Order(models.Model):
         )
 
     def send_telegram_notification(self):
-        """Отправка уведомления в Telegram с кнопкой 'Отменить' только для создания заказа."""
+        """Постановка в очередь уведомления с кнопкой 'Отменить' только для создания заказа.
+
+        Текст сводки формируется при отправке, когда позиции заказа уже сохранены.
+        """
         if not self.user.telegram_id:
             return
-        
-        message = self.get_order_summary()
+
         # Кнопка "Отменить" только для первого сообщения при создании
         if self.status in ["awaiting_payment", "pending", "processing"]:
-            callback_data = f"cancel_order_{self.id}"
+            callback_data = CancelOrder(order_id=self.id).pack()
             button = InlineKeyboardButton(text="Отменить заказ", callback_data=callback_data)
             keyboard = [[button]]
             reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
         else:
             reply_markup = None
 
-        send_message(self.user.telegram_id, message, reply_markup=reply_markup)
+        enqueue_message(self.user.telegram_id, reply_markup=reply_markup, order=self, user=self.user,
+                        priority=PRIORITY_HIGH)
+
+class PaymentReminder(models.Model):
+    """Отправленное напоминание об оплате: по журналу считаются повторы и их предел."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="payment_reminders", verbose_name="Заказ")
+    number = models.PositiveSmallIntegerField(verbose_name="Номер напоминания")
+    sent_at = models.DateTimeField(default=now, verbose_name="Отправлено")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["order", "number"], name="unique_payment_reminder"),
+        ]
+
+    def __str__(self):
+        return f"Напоминание {self.number} по заказу #{self.order_id}"
 
 @receiver(post_save, sender=Order)
-def send_status_update(sender, instance, created, **kwargs):
+def send_status_update(sender, instance, created, update_fields=None, **kwargs):
     """Отправка уведомления пользователю при создании или изменении статуса заказа."""
+    if not created and update_fields is not None and "status" not in update_fields:
+        return  # статус не менялся (например, исправлен адрес) — уведомлять не о чем
 
     if not instance.user.telegram_id:
         if not instance.user.notified_to_join_bot:
@@ -96,17 +152,95 @@ def send_status_update(sender, instance, created, **kwargs):
             NotificationLog.objects.create(user=instance.user, message=message)
         return
 
-    # Уведомление при создании заказа (с кнопкой "Отменить")
+    # Уведомление при создании заказа (с кнопкой "Отменить").
+    # Сообщение пишется в очередь в той же транзакции, что и заказ.
     if created and instance.status == "awaiting_payment":
         instance.send_telegram_notification()
     # Уведомление при изменении статуса (без кнопок)
     elif not created:
-        if instance.status == "delivered":
-            message = (
-                f"Ваш заказ #{instance.id} доставлен!\n"
-                f"Спасибо, что выбрали нас! Ждём вас снова в нашей {SHOP_NAME_E} 🌸"
-            )
-        else:
-            message = f"Статус вашего заказа #{instance.id} изменён на: {instance.get_status_display()}"
-        send_message(instance.user.telegram_id, message)
-        NotificationLog.objects.create(user=instance.user, message=message)
\ No newline at end of file
+        enqueue_message(instance.user.telegram_id, status_message(instance.id, instance.status),
+                        user=instance.user, log=True, priority=status_priority(instance.status))
+
+
+def status_message(order_id, status):
+    """Текст уведомления о смене статуса заказа."""
+    if status == "delivered":
+        return (
+            f"Ваш заказ #{order_id} доставлен!\n"
+            f"Спасибо, что выбрали нас! Ждём вас снова в нашей {SHOP_NAME_E} 🌸"
+        )
+    return f"Статус вашего заказа #{order_id} изменён на: {dict(Order.STATUS_CHOICES)[status]}"
+
+
+def status_priority(status):
+    # Отмена заказа важнее остальных смен статуса
+    return PRIORITY_HIGH if status == "canceled" else PRIORITY_NORMAL
+
+
+def _queue_notifications(recipients, message_for, priority):
+    """Одним bulk_create ставит в очередь уведомления (order_id, user_id, telegram_id) -> message_for(order_id)."""
+    OutboundMessage.objects.bulk_create(
+        [
+            OutboundMessage(chat_id=telegram_id, text=message_for(order_id), user_id=user_id,
+                            log_on_delivery=True, priority=priority)
+            for order_id, user_id, telegram_id in recipients if telegram_id
+        ],
+        batch_size=1000,
+    )
+
+
+@retry_on_lock
+def set_orders_status(orders, status):
+    """
+    Переводит заказы в статус status одним UPDATE.
+
+    В отличие от save() по каждому заказу, post_save не срабатывает: уведомления
+    клиентам собираются и пишутся в очередь одним bulk_create в той же транзакции,
+    а диспетчер отправит их после коммита. Заказы, уже имеющие этот статус,
+    не трогаются. Возвращает число изменённых заказов.
+    """
+    with transaction.atomic():
+        recipients = list(
+            orders.exclude(status=status).select_for_update().order_by()
+            .values_list("id", "user_id", "user__telegram_id")
+        )
+        if not recipients:
+            return 0
+        updated = Order.objects.filter(id__in=[order_id for order_id, _, _ in recipients]).update(status=status)
+        _queue_notifications(recipients, lambda order_id: status_message(order_id, status), status_priority(status))
+    return updated
+
+@retry_on_lock
+def cancel_unpaid_orders(hours=None, dry_run=False, moment=None):
+    """
+    Отменяет заказы, не оплаченные дольше hours часов (по умолчанию ORDER_AUTO_CANCEL_HOURS).
+
+    Статус меняется одним UPDATE без save() и post_save, а уведомления клиентам
+    пишутся в очередь одним bulk_create в той же транзакции. При dry_run=True
+    ничего не меняется. Возвращает отчёт: число заказов, сумму, число уведомлений
+    и дату самого старого заказа.
+    """
+    if hours is None:  # 0 — допустимый срок: отменить все неоплаченные
+        hours = getattr(settings, "ORDER_AUTO_CANCEL_HOURS", 72)
+    cutoff = (moment or now()) - timedelta(hours=hours)
+    stale = Order.objects.filter(status="awaiting_payment", created_at__lt=cutoff)
+
+    with transaction.atomic():
+        report = stale.aggregate(orders=Count("id"), total_price=Sum("total_price"), oldest=Min("created_at"))
+        if dry_run or not report["orders"]:
+            report["notified"] = 0
+            return report
+
+        recipients = list(
+            stale.select_for_update().filter(user__telegram_id__isnull=False)
+            .values_list("id", "user_id", "user__telegram_id")
+        )
+        report["orders"] = stale.update(status="canceled")
+        # Массовая отмена — обычный приоритет, чтобы не задерживать уведомления о новых заказах
+        _queue_notifications(
+            recipients,
+            lambda order_id: f"Заказ #{order_id} отменён: оплата не поступила в течение {hours} ч.",
+            PRIORITY_NORMAL,
+        )
+        report["notified"] = len(recipients)
+    return report
@@ -1,10 +1,23 @@
 from django.urls import reverse, resolve
 from .views import order_list, repeat_order, cancel_order
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+import re
+import warnings
+from django.core.paginator import UnorderedObjectListWarning
 from django.contrib.auth import get_user_model
 from users.models import UserProfile
 from catalog.models import Flower
-from .models import Order, OrderItem
+from cart.models import Cart
+from .models import Order, OrderItem, cancel_unpaid_orders, set_orders_status
+from bot.ratelimit import PRIORITY_HIGH
+from bot.models import OutboundMessage
+from django.core.management import call_command
+from io import StringIO
+from importlib import import_module
+from unittest.mock import patch
+from django.apps import apps as django_apps
 from django.utils import timezone
 from datetime import timedelta
 
@@ -55,7 +68,7 @@ class OrderViewsTest(TestCase):
         self.client.login(username="testuser", password="testpass123")
         response = self.client.get(reverse("repeat_order", args=[self.order.id]))
         self.assertEqual(response.status_code, 302)  # Перенаправление на корзину
-        self.assertIn("cart", self.client.session)
+        self.assertEqual(Cart.objects.get(user=self.user).as_dict(), {str(self.flower.id): 2})
 
     def test_cancel_order_view(self):
         """Тест отмены заказа."""
@@ -157,3 +170,348 @@ class OrderModelTest(TestCase):
         self.assertEqual(self.order_item.quantity, 2)
         self.assertEqual(self.order_item.price, 500.00)
         self.assertEqual(self.order_item.subtotal, 1000.00)
+
+
+class OrderChangeTrackingTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="tracked")
+        self.profile = UserProfile.objects.get(user=user)
+        self.profile.telegram_id = 4242
+        self.profile.save()
+        Order.objects.create(user=self.profile, total_price=700.00)
+        OutboundMessage.objects.all().delete()
+        self.order = Order.objects.get(user=self.profile)
+
+    def test_address_change_does_not_notify(self):
+        self.order.address = "ул. Новая, 3"
+        with CaptureQueriesContext(connection) as queries:
+            self.order.save()
+        updates = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "orders_order"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"status"', updates[0])
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_status_change_notifies(self):
+        self.order.status = "processing"
+        self.order.save()
+        message = OutboundMessage.objects.get()
+        self.assertEqual(message.chat_id, 4242)
+        self.assertIn("В обработке", message.text)
+
+    def test_unchanged_save_is_skipped(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.order.save()
+        self.assertEqual(len(queries), 0)
+        self.assertFalse(OutboundMessage.objects.exists())
+
+
+class CancelUnpaidOrdersTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="canceluser", password="testpass123")
+        self.profile = UserProfile.objects.get(user=self.user)
+        self.profile.phone = "+79991234567"
+        self.profile.telegram_id = 123456789
+        self.profile.save()
+        other = User.objects.create_user(username="nobotuser", password="testpass123")
+        self.no_bot_profile = UserProfile.objects.get(user=other)
+        self.stale = self.create_order(self.profile, hours_ago=80)
+        self.stale_no_bot = self.create_order(self.no_bot_profile, hours_ago=100)
+        self.recent = self.create_order(self.profile, hours_ago=30)
+        self.paid = self.create_order(self.profile, hours_ago=80, status="pending")
+        OutboundMessage.objects.all().delete()
+
+    def create_order(self, profile, hours_ago, status="awaiting_payment"):
+        order = Order.objects.create(user=profile, status=status, total_price=1000.00)
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(hours=hours_ago))
+        return order
+
+    def statuses(self):
+        return dict(Order.objects.values_list("id", "status"))
+
+    def test_dry_run_changes_nothing(self):
+        report = cancel_unpaid_orders(72, dry_run=True)
+        self.assertEqual(report["orders"], 2)
+        self.assertEqual(report["total_price"], 2000)
+        self.assertEqual(self.statuses()[self.stale.id], "awaiting_payment")
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_cancels_in_one_update_and_queues_notifications(self):
+        with self.assertNumQueries(6):  # агрегат, получатели, UPDATE, bulk_create + точки сохранения
+            report = cancel_unpaid_orders(72)
+        self.assertEqual(report["orders"], 2)
+        self.assertEqual(report["notified"], 1)
+        statuses = self.statuses()
+        self.assertEqual(statuses[self.stale.id], "canceled")
+        self.assertEqual(statuses[self.stale_no_bot.id], "canceled")
+        self.assertEqual(statuses[self.recent.id], "awaiting_payment")
+        self.assertEqual(statuses[self.paid.id], "pending")
+        message = OutboundMessage.objects.get()
+        self.assertEqual(message.chat_id, 123456789)
+        self.assertIn(f"Заказ #{self.stale.id} отменён", message.text)
+        self.assertTrue(message.log_on_delivery)
+
+    def test_zero_hours_cancels_all_awaiting(self):
+        report = cancel_unpaid_orders(0, dry_run=True)
+        self.assertEqual(report["orders"], 3)
+
+    def test_stale_scan_uses_status_created_index(self):
+        cutoff = timezone.now() - timedelta(hours=72)
+        plan = Order.objects.filter(status="awaiting_payment", created_at__lt=cutoff).explain()
+        self.assertIn("order_status_created_idx", plan)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("cancel_overdue_orders", "--hours", "72", "--dry-run", stdout=out)
+        self.assertIn("Будет отменено заказов: 2", out.getvalue())
+        call_command("cancel_overdue_orders", "--hours", "72", stdout=out)
+        self.assertIn("Отменено заказов: 2", out.getvalue())
+        call_command("cancel_overdue_orders", "--hours", "72", stdout=out)
+        self.assertIn("Просроченных неоплаченных заказов нет.", out.getvalue())
+
+
+class OrderItemSnapshotTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="snapshotuser", password="testpass123")
+        self.profile = UserProfile.objects.get(user=self.user)
+        self.flower = Flower.objects.create(name="Роза", price=500.00, image="flowers/rose.jpg")
+        self.order = Order.objects.create(user=self.profile, total_price=1000.00)
+        self.item = OrderItem.objects.create(order=self.order, flower=self.flower, quantity=2, price=500.00, subtotal=1000.00)
+
+    def test_snapshot_taken_on_create(self):
+        self.assertEqual(self.item.flower_name, "Роза")
+        self.assertEqual(self.item.flower_image.name, "flowers/rose.jpg")
+        self.assertEqual(str(self.item), "Роза x 2")
+
+    def test_history_survives_catalog_changes(self):
+        """Переименование и удаление цветка не меняют и не удаляют историю заказов."""
+        Flower.objects.filter(id=self.flower.id).update(name="Роза красная")
+        self.flower.delete()
+        item = OrderItem.objects.get(id=self.item.id)
+        self.assertIsNone(item.flower_id)
+        self.assertEqual(item.flower_name, "Роза")
+        self.assertIn("Роза x 2 - 1000.00 руб.", self.order.get_order_summary())
+
+    def test_summary_does_not_join_catalog(self):
+        order = Order.objects.prefetch_related("items").get(id=self.order.id)
+        with self.assertNumQueries(0):
+            order.get_order_summary()
+
+    def test_repeat_order_skips_deleted_flowers(self):
+        self.client.login(username="snapshotuser", password="testpass123")
+        other = Flower.objects.create(name="Пион", price=300.00, image="flowers/peony.jpg")
+        OrderItem.objects.create(order=self.order, flower=other, quantity=1, price=300.00, subtotal=300.00)
+        self.flower.delete()
+        self.client.get(reverse("repeat_order", args=[self.order.id]))
+        self.assertEqual(Cart.objects.get(user=self.user).as_dict(), {str(other.id): 1})
+
+    def test_backfill_migration(self):
+        OrderItem.objects.filter(id=self.item.id).update(flower_name="", flower_image="")
+        backfill = import_module("orders.migrations.0010_backfill_orderitem_flower_snapshot")
+        with patch.object(backfill, "BATCH_SIZE", 1):
+            backfill.backfill_snapshot(django_apps, None)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.flower_name, "Роза")
+        self.assertEqual(self.item.flower_image.name, "flowers/rose.jpg")
+
+
+@override_settings(ORDER_HISTORY_PAGE_SIZE=10)
+class OrderHistoryPaginationTest(TestCase):
+    def create_customer(self, username, orders_count):
+        user = User.objects.create_user(username=username, password="testpass123")
+        profile = UserProfile.objects.get(user=user)
+        flower = Flower.objects.create(name=f"Роза {username}", price=500.00, image="flowers/rose.jpg")
+        moment = timezone.now()
+        orders = Order.objects.bulk_create([Order(user=profile, total_price=500.00) for _ in range(orders_count)])
+        for index, order in enumerate(orders):
+            # Пары заказов с одинаковым временем проверяют сортировку по id внутри одной секунды
+            Order.objects.filter(id=order.id).update(created_at=moment - timedelta(minutes=index // 2))
+        OrderItem.objects.bulk_create([
+            OrderItem.from_flower(flower, order=order, quantity=1, price=500.00, subtotal=500.00)
+            for order in orders for _ in range(3)
+        ])
+        return user
+
+    def test_pages_cover_all_orders_in_order(self):
+        user = self.create_customer("pager", 25)
+        self.client.force_login(user)
+        expected = list(Order.objects.filter(user__user=user).order_by("-created_at", "-id").values_list("id", flat=True))
+        seen = []
+        response = self.client.get(reverse("order_list"))
+        seen += [order.id for order in response.context["orders"]]
+        cursor = response.context["next_cursor"]
+        while cursor:
+            data = self.client.get(reverse("order_list"), {"before": cursor},
+                                   headers={"X-Requested-With": "XMLHttpRequest"}).json()
+            seen += [int(order_id) for order_id in re.findall(r"Заказ #(\d+)", data["html"])]
+            cursor = data["next_cursor"]
+        self.assertEqual(seen, expected)
+
+    def test_query_count_does_not_grow_with_history(self):
+        """Число запросов на страницу одинаково для 5 и для 60 заказов."""
+        counts = []
+        for username, orders_count in (("few", 5), ("many", 60)):
+            user = self.create_customer(username, orders_count)
+            self.client.force_login(user)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("order_list"))
+            self.assertContains(response, "Роза")
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_cursor_shows_first_page(self):
+        user = self.create_customer("badcursor", 3)
+        self.client.force_login(user)
+        for cursor in ("garbage", "99999999999999999999-1", "253402300800000000-1", "1-99999999999999999999"):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse("order_list"), {"before": cursor})
+                self.assertEqual(len(response.context["orders"]), 3)
+                self.assertIsNone(response.context["next_cursor"])
+
+
+class OrderAdminBulkStatusTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", password="adminpass123", email="admin@example.com")
+        self.client.force_login(self.admin)
+        customer = User.objects.create_user(username="bulkcustomer", password="testpass123")
+        self.profile = UserProfile.objects.get(user=customer)
+        self.profile.telegram_id = 123456789
+        self.profile.save()
+        other = User.objects.create_user(username="nobot", password="testpass123")
+        self.no_bot_profile = UserProfile.objects.get(user=other)
+
+    def create_orders(self, count, profile=None):
+        return Order.objects.bulk_create(
+            [Order(user=profile or self.profile, status="processing", total_price=500.00) for _ in range(count)]
+        )
+
+    def run_action(self, action, orders):
+        return self.client.post(reverse("admin:orders_order_changelist"), {
+            "action": action,
+            "_selected_action": [order.id for order in orders],
+        })
+
+    def test_mark_as_delivered_updates_and_queues_batch(self):
+        orders = self.create_orders(3) + self.create_orders(2, self.no_bot_profile)
+        OutboundMessage.objects.all().delete()
+        response = self.run_action("mark_as_delivered", orders)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.filter(status="delivered").count(), 5)
+        messages = OutboundMessage.objects.order_by("id")
+        self.assertEqual(messages.count(), 3)
+        self.assertIn("доставлен", messages[0].text)
+        self.assertTrue(all(message.log_on_delivery for message in messages))
+
+    def test_query_count_does_not_depend_on_selection_size(self):
+        counts = []
+        for count in (2, 40):
+            orders = self.create_orders(count)
+            with CaptureQueriesContext(connection) as queries:
+                self.run_action("mark_as_shipped", orders)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_cancel_uses_high_priority_and_skips_unchanged(self):
+        orders = self.create_orders(2)
+        Order.objects.filter(id=orders[0].id).update(status="canceled")
+        OutboundMessage.objects.all().delete()
+        self.assertEqual(set_orders_status(Order.objects.filter(id__in=[o.id for o in orders]), "canceled"), 1)
+        message = OutboundMessage.objects.get()
+        self.assertEqual(message.priority, PRIORITY_HIGH)
+        self.assertIn(f"#{orders[1].id}", message.text)
+
+
+class OrderAdminChangelistTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", password="adminpass123", email="admin@example.com")
+        self.client.force_login(self.admin)
+        self.url = reverse("admin:orders_order_changelist")
+
+    def create_customers(self, count, prefix="customer", orders_each=2):
+        profiles = []
+        for index in range(count):
+            user = User.objects.create_user(username=f"{prefix}{index}")
+            profile = UserProfile.objects.get(user=user)
+            profile.full_name = f"Клиент {index}"
+            profile.phone = f"+7999{count:03d}{index:04d}"
+            profile.save()
+            profiles.append(profile)
+            Order.objects.bulk_create([Order(user=profile, total_price=500.00) for _ in range(orders_each)])
+        return profiles
+
+    def changelist_queries(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_flat_with_more_customers(self):
+        """Ни список, ни боковой фильтр не делают запросов на каждого клиента или заказ."""
+        self.create_customers(2, prefix="few")
+        response, few = self.changelist_queries()
+        self.assertContains(response, "Клиент 1")
+        self.create_customers(40, prefix="many")
+        response, many = self.changelist_queries()
+        self.assertEqual(few, many)
+
+    def test_search_by_order_id_is_exact(self):
+        self.create_customers(3)
+        order = Order.objects.order_by("id")[2]
+        response, _ = self.changelist_queries({"q": f"#{order.id}"})
+        self.assertEqual([o.id for o in response.context["cl"].result_list], [order.id])
+
+    def test_search_by_phone_is_exact(self):
+        profile = self.create_customers(3)[1]
+        digits = profile.phone[2:]
+        response, _ = self.changelist_queries({"q": f"8 ({digits[:3]}) {digits[3:6]}-{digits[6:]}"})
+        self.assertEqual({o.user_id for o in response.context["cl"].result_list}, {profile.pk})
+        self.assertEqual(len(response.context["cl"].result_list), 2)
+
+    def test_search_by_phone_prefix(self):
+        """Начало номера в любом формате находит клиентов, номера которых с него начинаются."""
+        self.create_customers(3, prefix="old")
+        profiles = self.create_customers(2, prefix="new", orders_each=1)
+        for term in ("8 999 002", "+7999002", "999 002", "7999002"):
+            response, _ = self.changelist_queries({"q": term})
+            self.assertEqual({o.user_id for o in response.context["cl"].result_list},
+                             {profile.pk for profile in profiles}, term)
+
+    def test_search_by_phone_without_country_code(self):
+        profile = self.create_customers(3)[2]
+        response, _ = self.changelist_queries({"q": profile.phone[2:]})  # 10 цифр без +7
+        self.assertEqual({o.user_id for o in response.context["cl"].result_list}, {profile.pk})
+
+    def test_short_number_matches_order_id_or_phone(self):
+        profile = self.create_customers(3)[0]
+        order = Order.objects.order_by("id").last()
+        response, _ = self.changelist_queries({"q": str(order.id).zfill(4)})
+        self.assertIn(order.id, [o.id for o in response.context["cl"].result_list])
+        response, _ = self.changelist_queries({"q": "8999"})
+        self.assertIn(profile.pk, {o.user_id for o in response.context["cl"].result_list})
+
+    def test_search_by_name_still_works(self):
+        self.create_customers(3)
+        response, _ = self.changelist_queries({"q": "Клиент 2"})
+        self.assertEqual(len(response.context["cl"].result_list), 2)
+
+    def test_user_filter(self):
+        profile = self.create_customers(3)[0]
+        response, _ = self.changelist_queries({"user": profile.pk, "status__exact": "awaiting_payment"})
+        self.assertEqual({o.user_id for o in response.context["cl"].result_list}, {profile.pk})
+        self.assertContains(response, 'name="status__exact" value="awaiting_payment"')
+
+    def test_user_autocomplete_endpoint(self):
+        profile = self.create_customers(3)[1]
+        response = self.client.get(reverse("admin:autocomplete"), {
+            "app_label": "orders", "model_name": "order", "field_name": "user", "term": profile.phone,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item["text"] for item in response.json()["results"]], ["Клиент 1"])
+
+    def test_user_autocomplete_pages_are_ordered(self):
+        self.create_customers(3)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", UnorderedObjectListWarning)
+            response = self.client.get(reverse("admin:autocomplete"), {
+                "app_label": "orders", "model_name": "order", "field_name": "user", "term": "Клиент",
+            })
+        self.assertEqual([item["text"] for item in response.json()["results"]], ["Клиент 0", "Клиент 1", "Клиент 2"])
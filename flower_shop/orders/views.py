@@ -1,17 +1,67 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Q
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from core.routers import read_from_replica
 from .models import Order
 from users.models import UserProfile
+from cart.storage import get_cart
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _encode_cursor(order):
+    """Курсор страницы: точное время создания (мкс от эпохи) и id последнего заказа."""
+    return f"{(order.created_at - _EPOCH) // timedelta(microseconds=1)}-{order.id}"
+
+
+def _decode_cursor(cursor):
+    """(created_at, id) из курсора или None, если курсор испорчен или вне допустимых значений."""
+    try:
+        microseconds, order_id = (int(part) for part in cursor.split("-"))
+        created_at = _EPOCH + timedelta(microseconds=microseconds)
+    except (ValueError, OverflowError):
+        return None
+    if not 0 < order_id < 2 ** 63:  # id вне BIGINT уронил бы запрос
+        return None
+    return created_at, order_id
 
 
 @login_required
+@read_from_replica()
 def order_list(request):
-    """Страница со списком заказов пользователя"""
+    """
+    Страница со списком заказов пользователя.
+
+    Заказы выводятся страницами по ORDER_HISTORY_PAGE_SIZE с продолжением после
+    курсора (created_at, id) — без OFFSET, по индексу order_user_history_idx.
+    Позиции страницы загружаются одним запросом, поэтому число запросов
+    не зависит от числа заказов. AJAX-запрос получает следующую страницу в JSON.
+    История читается с реплики (после записи в этом запросе — из основной базы).
+    """
     profile = get_object_or_404(UserProfile, user=request.user)
-    orders = Order.objects.filter(user=profile).order_by("-created_at")
-    
-    return render(request, "orders/order_list.html", {"orders": orders})
+    orders = Order.objects.filter(user=profile).order_by("-created_at", "-id").prefetch_related("items")
+    cursor = _decode_cursor(request.GET.get("before", ""))
+    if cursor:
+        created_at, order_id = cursor
+        orders = orders.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=order_id))
+
+    page_size = getattr(settings, "ORDER_HISTORY_PAGE_SIZE", 20)
+    page = list(orders[:page_size + 1])
+    next_cursor = _encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+    context = {"orders": page[:page_size], "next_cursor": next_cursor, "is_first_page": cursor is None}
+
+    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+        return JsonResponse({
+            "html": render_to_string("orders/order_items.html", context, request=request),
+            "next_cursor": next_cursor,
+        })
+    return render(request, "orders/order_list.html", context)
 
 @login_required
 def repeat_order(request, order_id):
@@ -19,12 +69,12 @@ def repeat_order(request, order_id):
     profile = get_object_or_404(UserProfile, user=request.user)
     order = get_object_or_404(Order, id=order_id, user=profile)
 
-    cart = request.session.get("cart", {})
+    cart = get_cart(request)
 
     for item in order.items.all():
-        cart[str(item.flower.id)] = cart.get(str(item.flower.id), 0) + item.quantity
+        if item.flower_id:  # цветка больше нет в каталоге
+            cart.add(item.flower_id, item.quantity)
 
-    request.session["cart"] = cart
     messages.success(request, f"✅ Товары из заказа #{order.id} добавлены в корзину! Вы можете изменить их перед оформлением.")
     
     return redirect("view_cart")
@@ -1,13 +1,18 @@
 from django.db import models
 from django.contrib import admin
+from core.admin import ReplicaChangeListMixin
 from .models import NotificationLog
-from .models import UserProfile  # Импортируем модель UserProfile
+from .models import UserProfile, normalize_phone  # Импортируем модель UserProfile
 
 # Register your models here.
 @admin.register(UserProfile)
-class UserProfileAdmin(admin.ModelAdmin):
+class UserProfileAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     # Поля, которые будут отображаться в списке записей
     list_display = ('user', 'user_email', 'full_name', 'phone', 'address', 'telegram_id', 'notified_to_join_bot')
+    # Пользователь (для user и user_email) загружается вместе с профилем, без запроса на каждую строку
+    list_select_related = ('user',)
+    # Постоянный порядок: автодополнение клиента в заказах листает список по страницам
+    ordering = ('full_name', 'pk')
 
     def user_email(self, obj):
         return obj.user.email
@@ -38,8 +43,35 @@ class UserProfileAdmin(admin.ModelAdmin):
         models.TextField: {'widget': admin.widgets.AdminTextareaWidget(attrs={'style': 'width: 200px; height: 50px;'})},
     }
 
+    def save_model(self, request, obj, form, change):
+        """
+        Записывает только реально изменённые поля.
+
+        Сохранение страницы списка с list_editable вызывает save_model для каждой
+        строки, где форма считает данные изменёнными, — в том числе когда номер
+        введён в другом формате или пустой адрес пришёл как "". Такие строки не
+        пишутся вовсе, а остальные сохраняются с update_fields, поэтому
+        уведомление клиенту уходит только при изменении видимых ему данных.
+        """
+        if not change:
+            return super().save_model(request, obj, form, change)
+        if obj.phone:
+            obj.phone = normalize_phone(obj.phone)
+        changed = [
+            name for name in form.changed_data
+            if not _same_value(obj._meta.get_field(name).value_from_object(obj), form.initial.get(name))
+        ]
+        if changed:
+            obj.save(update_fields=changed)
+
+
+def _same_value(value, initial):
+    # None и пустая строка в необязательных полях означают одно и то же
+    return value == initial or (value in (None, "") and initial in (None, ""))
+
+
 @admin.register(NotificationLog)
-class NotificationLogAdmin(admin.ModelAdmin):
+class NotificationLogAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ("user", "created_at", "message")
     search_fields = ("user__full_name", "message")
     list_filter = ("created_at",)
@@ -5,11 +5,20 @@ from django.db import models
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib import admin
-from bot.utils import send_message
+from bot.outbox import enqueue_message
+from core.tracking import ChangeTrackingMixin
 
 User = get_user_model()
 
-class UserProfile(models.Model):
+def normalize_phone(phone):
+    """Приводит номер телефона к виду, в котором он хранится в профиле (+7...)."""
+    cleaned_phone = str(phone).strip().replace(" ", "").replace("-", "")
+    if cleaned_phone.startswith("8"):
+        cleaned_phone = "+7" + cleaned_phone[1:]
+    return cleaned_phone
+
+
+class UserProfile(ChangeTrackingMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, verbose_name="Пользователь",
                                 related_name="profile")
     full_name = models.CharField(max_length=255, verbose_name="ФИО")
@@ -29,12 +38,14 @@ class UserProfile(models.Model):
         except UserProfile.DoesNotExist:
             return None
 
+    @staticmethod
+    async def aget_by_telegram_id(telegram_id):
+        """Асинхронный вариант get_by_telegram_id (для обработчиков бота)"""
+        return await UserProfile.objects.filter(telegram_id=telegram_id).afirst()
+
     def save(self, *args, **kwargs):
         if self.phone:
-            cleaned_phone = str(self.phone).strip().replace(" ", "").replace("-", "")
-            if cleaned_phone.startswith("8"):
-                cleaned_phone = "+7" + cleaned_phone[1:]
-            self.phone = cleaned_phone  # ✅ Сохраняем нормализованный номер
+            self.phone = normalize_phone(self.phone)  # ✅ Сохраняем нормализованный номер
         super().save(*args, **kwargs)
 
 @receiver(post_save, sender=User)
@@ -43,16 +54,21 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance, full_name=instance.get_full_name())
 
+# Поля профиля, которые видит клиент в уведомлении об обновлении
+PROFILE_NOTIFY_FIELDS = frozenset({"full_name", "phone", "address"})
+
+
 @receiver(post_save, sender=UserProfile)
-def notify_profile_update(sender, instance, **kwargs):
-    """Отправка уведомления в Telegram при обновлении данных профиля и логирование."""
+def notify_profile_update(sender, instance, update_fields=None, **kwargs):
+    """Постановка уведомления об обновлении профиля в очередь (в журнал попадёт после доставки)."""
+    if update_fields is not None and not PROFILE_NOTIFY_FIELDS & set(update_fields):
+        return  # изменились только служебные поля — клиенту сообщать нечего
     if instance.telegram_id:
         message = (f"Ваш профиль был обновлен.\n"
                    f"ФИО: {instance.full_name}\n"
                    f"Телефон: {instance.phone}\n"
                    f"Адрес: {instance.address}")
-        send_message(instance.telegram_id, message)
-        NotificationLog.objects.create(user=instance, message=message)
+        enqueue_message(instance.telegram_id, message, user=instance, log=True)
 
 class NotificationLog(models.Model):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, verbose_name="Пользователь", null=True, blank=True, related_name="notifications")
@@ -1,6 +1,9 @@
 from django.test import Client, TestCase
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from bot.models import OutboundMessage
 from .forms import UserProfileForm
 from .models import UserProfile, NotificationLog
 
@@ -121,6 +124,23 @@ class ProfileViewTest(TestCase):
         self.assertEqual(self.profile.address, "ул. Пушкина, 15")
         self.assertEqual(self.user.email, "updated@example.com")  # Теперь email должен обновиться
 
+    def test_link_and_unlink_telegram_are_queued(self):
+        """Уведомления о привязке и отвязке Telegram ставятся в очередь, а не отправляются из запроса."""
+        data = {"full_name": "Test User", "phone": "+79991234567", "address": "ул. Ленина, 10"}
+        self.client.post(self.profile_url, {**data, "telegram_id": "4242"})
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.telegram_id, 4242)
+        self.assertTrue(OutboundMessage.objects.filter(chat_id=4242, text__contains="привязан").exists())
+
+        OutboundMessage.objects.all().delete()
+        self.client.post(self.profile_url, {**data, "telegram_id": "4242"})
+        self.assertFalse(OutboundMessage.objects.filter(text__contains="привязан").exists())
+
+        self.client.post(self.profile_url, {**data, "telegram_id": ""})
+        self.profile.refresh_from_db()
+        self.assertIsNone(self.profile.telegram_id)
+        self.assertTrue(OutboundMessage.objects.filter(chat_id=4242, text__contains="отвязан").exists())
+
 class UserProfileSignalTest(TestCase):
     def test_profile_creation_signal(self):
         """Тест автоматического создания профиля при создании пользователя."""
@@ -143,6 +163,51 @@ class UserProfileSignalTest(TestCase):
         self.assertIsNone(profile.address)  # Поле address должно быть None по умолчанию
         self.assertIsNone(profile.telegram_id)  # Поле telegram_id должно быть None по умолчанию
 
+class UserProfileChangeTrackingTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="tracked")
+        profile = UserProfile.objects.get(user=user)
+        profile.full_name = "Иван Петров"
+        profile.phone = "+79990001122"
+        profile.telegram_id = 777
+        profile.save()
+        OutboundMessage.objects.all().delete()
+        self.profile = UserProfile.objects.get(user=user)
+
+    def profile_updates(self, queries):
+        return [q["sql"] for q in queries if q["sql"].startswith('UPDATE "users_userprofile"')]
+
+    def test_unchanged_save_writes_nothing(self):
+        self.profile.phone = "8 999 000-11-22"  # тот же номер после нормализации
+        with CaptureQueriesContext(connection) as queries:
+            self.profile.save()
+        self.assertEqual(len(queries), 0)
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_only_changed_columns_are_written(self):
+        self.profile.address = "ул. Цветочная, 5"
+        with CaptureQueriesContext(connection) as queries:
+            self.profile.save()
+        updates = self.profile_updates(queries)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"address"', updates[0])
+        self.assertNotIn('"full_name"', updates[0])
+        self.assertEqual(OutboundMessage.objects.get().chat_id, 777)
+        # После сохранения изменений больше нет
+        self.assertEqual(self.profile.changed_fields(), set())
+
+    def test_service_field_change_does_not_notify(self):
+        self.profile.notified_to_join_bot = True
+        self.profile.save()
+        self.assertTrue(UserProfile.objects.get(pk=self.profile.pk).notified_to_join_bot)
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_deferred_field_assignment_is_saved(self):
+        profile = UserProfile.objects.only("pk").get(pk=self.profile.pk)
+        profile.address = "ул. Лесная, 7"
+        profile.save()
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).address, "ул. Лесная, 7")
+
 class UserIntegrationTest(TestCase):
     def setUp(self):
         self.client = Client()
@@ -187,3 +252,83 @@ class UserIntegrationTest(TestCase):
         self.assertEqual(profile.address, "ул. Ленина, 10")
         self.assertEqual(user.email, "test@example.com")
 
+
+
+class UserProfileAdminTest(TestCase):
+    def setUp(self):
+        admin_user = User.objects.create_superuser(username="admin", password="adminpass123", email="admin@example.com")
+        self.client.force_login(admin_user)
+        self.url = reverse("admin:users_userprofile_changelist")
+        self.profiles = []
+        for index in range(3):
+            user = User.objects.create_user(username=f"client{index}", email=f"client{index}@example.com")
+            profile = UserProfile.objects.get(user=user)
+            profile.full_name = f"Клиент {index}"
+            profile.phone = f"+7999000000{index}"
+            profile.telegram_id = 500 + index
+            profile.save()
+            self.profiles.append(profile)
+        OutboundMessage.objects.all().delete()
+
+    def changelist_data(self):
+        """POST-данные страницы списка с list_editable без изменений."""
+        profiles = list(UserProfile.objects.filter(user__username__startswith="client").order_by("-pk"))
+        data = {"form-TOTAL_FORMS": len(profiles), "form-INITIAL_FORMS": len(profiles),
+                "form-MIN_NUM_FORMS": 0, "form-MAX_NUM_FORMS": 1000, "_save": "Сохранить"}
+        for index, profile in enumerate(profiles):
+            row = {"user": profile.pk, "phone": profile.phone, "address": profile.address,
+                   "telegram_id": profile.telegram_id, "notified_to_join_bot": "on" if profile.notified_to_join_bot else None}
+            data.update({f"form-{index}-{field}": value for field, value in row.items() if value is not None})
+        return data
+
+    @staticmethod
+    def row_of(data, profile):
+        """Префикс формы строки с профилем profile."""
+        return next(key[:-len("-user")] for key, value in data.items() if key.endswith("-user") and value == profile.pk)
+
+    def test_changelist_query_count_does_not_grow(self):
+        """user_email не делает запрос на каждую строку."""
+        with CaptureQueriesContext(connection) as few:
+            self.assertContains(self.client.get(self.url), "client0@example.com")
+        for index in range(3, 20):
+            User.objects.create_user(username=f"client{index}", email=f"client{index}@example.com")
+        with CaptureQueriesContext(connection) as many:
+            self.assertContains(self.client.get(self.url), "client19@example.com")
+        self.assertEqual(len(few), len(many))
+
+    def test_saving_unchanged_page_writes_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, self.changelist_data())
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse([q for q in queries if q["sql"].startswith('UPDATE "users_userprofile"')])
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_reformatted_phone_is_not_a_change(self):
+        """Тот же номер в другом формате не пишется и не уведомляет клиента."""
+        data = self.changelist_data()
+        data[f"{self.row_of(data, self.profiles[1])}-phone"] = "8 999 000-00-01"
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, data)
+        self.assertFalse([q for q in queries if q["sql"].startswith('UPDATE "users_userprofile"')])
+        self.assertFalse(OutboundMessage.objects.exists())
+
+    def test_only_changed_row_and_field_are_written(self):
+        profile = self.profiles[2]
+        data = self.changelist_data()
+        data[f"{self.row_of(data, profile)}-address"] = "ул. Садовая, 1"
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, data)
+        updates = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "users_userprofile"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"full_name"', updates[0])
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).address, "ул. Садовая, 1")
+        message = OutboundMessage.objects.get()
+        self.assertEqual(message.chat_id, profile.telegram_id)
+
+    def test_service_field_change_does_not_notify(self):
+        profile = self.profiles[0]
+        data = self.changelist_data()
+        data[f"{self.row_of(data, profile)}-notified_to_join_bot"] = "on"
+        self.client.post(self.url, data)
+        self.assertTrue(UserProfile.objects.get(pk=profile.pk).notified_to_join_bot)
+        self.assertFalse(OutboundMessage.objects.exists())
@@ -1,15 +1,15 @@
 import asyncio
 #from bot.config import TOKEN
-from bot.utils import send_message
+from bot.outbox import enqueue_message
 #from aiogram import Bot
-from aiogram.exceptions import TelegramBadRequest
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
 from django.contrib.auth.forms import UserCreationForm
-from django.contrib.auth import login
 from django.contrib.auth.views import LoginView
 from django.contrib import messages
+from django.db import transaction
+from cart.storage import login_with_cart
 from .models import UserProfile
 
 #bot = Bot(token=TOKEN)
@@ -18,19 +18,12 @@ class CustomLoginView(LoginView):
     template_name = "users/login.html"  # ✅ Указываем правильный путь к шаблону
     """Вход с сохранением сессии"""
     def form_valid(self, form):
-        response = super().form_valid(form)
-        login(self.request, form.get_user())  # ✅ Принудительно обновляем сессию
+        # 1️⃣ Входим и переносим гостевую корзину в корзину пользователя
+        login_with_cart(self.request, form.get_user())
 
-        # 1️⃣ Определяем, куда перенаправить пользователя
+        # 2️⃣ Определяем, куда перенаправить пользователя
         next_url = self.request.GET.get("next") or "/"
 
-        # 2️⃣ Восстанавливаем корзину после входа
-        session_cart = self.request.session.get("cart", {})
-        if session_cart:
-            profile, created = UserProfile.objects.get_or_create(user=self.request.user)
-            profile.cart = session_cart  # ❗️Проверьте, что в `UserProfile` есть поле `cart`
-            profile.save()
-
         return redirect(next_url)  # ✅ Перенаправляем на checkout, если он был в `next`
 
 def register(request):
@@ -40,7 +33,7 @@ def register(request):
         if form.is_valid():
             user = form.save()
             profile, created = UserProfile.objects.get_or_create(user=user, defaults={"full_name": user.username})
-            login(request, user)  # ✅ Автоматический вход
+            login_with_cart(request, user)  # ✅ Автоматический вход с сохранением корзины
             return redirect("profile")  # ✅ Перенаправление на заполнение профиля
     else:
         form = UserCreationForm()
@@ -68,22 +61,19 @@ def profile(request):
         telegram_id = request.POST.get("telegram_id", "").strip()
         if telegram_id.lower() == "none":
             telegram_id = None
+        # Уведомление о привязке или отвязке уходит через очередь, а не из запроса
+        notice = None
         if profile.telegram_id and not telegram_id:
-            if profile.telegram_id:
-                try:
-                    send_message(profile.telegram_id, "⚠️ Ваш Telegram отвязан от аккаунта.")
-                except TelegramBadRequest:
-                    pass  # Игнорируем ошибку, если Telegram ID неверный
+            notice = (profile.telegram_id, "⚠️ Ваш Telegram отвязан от аккаунта.")
             profile.telegram_id = None
-        elif telegram_id and telegram_id != profile.telegram_id:
+        elif telegram_id and telegram_id != str(profile.telegram_id):
             profile.telegram_id = telegram_id
-            try:
-                send_message(profile.telegram_id, "✅ Ваш Telegram успешно привязан!")
-            except TelegramBadRequest:
-                messages.error(request, "❌ Ошибка: указанный Telegram ID не найден.")
-                return redirect("profile")  # Остаемся на странице профиля
+            notice = (telegram_id, "✅ Ваш Telegram успешно привязан!")
 
-        profile.save()
+        with transaction.atomic():
+            profile.save()
+            if notice:
+                enqueue_message(*notice, user=profile)
         messages.success(request, "✅ Профиль обновлен!")
         return redirect("profile")  # Остаемся на странице профиля
 